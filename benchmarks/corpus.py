@@ -0,0 +1,147 @@
+import io
+import os
+import random
+import struct
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from PIL import ExifTags, Image as PILImage
+from lib.imaging import register_heif
+
+from lib.isobmff import EPOCH_ADJUSTER
+
+# corpus format -> (PIL format, extension). mp4 files are built by hand.
+FORMATS = {
+    "jpeg": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+    "heic": ("HEIF", "heic"),
+    "mp4": (None, "mp4"),
+    "nef": ("TIFF", "nef"),
+}
+# extensions given to mislabeled files, none of them matches the real type
+WRONG_EXTENSIONS = {
+    "jpeg": "png",
+    "png": "jpeg",
+    "heic": "jpg",
+    "mp4": "mov",
+    "nef": "jpg",
+}
+IMAGE_SIZE = (96, 64)
+EARLIEST_DATE = datetime(2015, 1, 1)
+
+
+class CorpusConfig(NamedTuple):
+    """Parameters of a synthetic media library, see generate_corpus."""
+
+    files: int = 200
+    formats: tuple[str, ...] = tuple(FORMATS)
+    # file sizes are log-normally distributed around the median, in bytes
+    median_size: int = 256 * 1024
+    size_sigma: float = 1.0
+    # fraction of files that are byte-identical copies of an earlier file
+    duplicate_ratio: float = 0.1
+    # fraction of files that carry a created date in their metadata
+    metadata_ratio: float = 0.8
+    # fraction of files whose extension doesn't match their contents
+    mislabel_ratio: float = 0.1
+    seed: int = 0
+
+
+class CorpusStats(NamedTuple):
+    files: int
+    bytes: int
+    duplicates: int
+
+
+def _image_bytes(
+    rng: random.Random, pil_format: str, created: datetime | None
+) -> bytes:
+    """Encodes a small noisy gradient, so every image decodes to distinct pixels."""
+    width, height = IMAGE_SIZE
+    offset = rng.randrange(256)
+    pixels = bytes(
+        (x + y + offset + rng.randrange(16)) % 256
+        for y in range(height)
+        for x in range(width)
+        for _ in range(3)
+    )
+    image = PILImage.frombytes("RGB", IMAGE_SIZE, pixels)
+    kwargs = {}
+    if created is not None:
+        exif = PILImage.Exif()
+        exif[ExifTags.Base.DateTime] = created.strftime("%Y:%m:%d %H:%M:%S")
+        kwargs["exif"] = exif.tobytes()
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **kwargs)
+    return buffer.getvalue()
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def _mp4_bytes(created: datetime | None) -> bytes:
+    timestamp = int(created.timestamp()) + EPOCH_ADJUSTER if created else 0
+    mvhd = _box(
+        b"mvhd", bytes(4) + struct.pack(">II", timestamp, timestamp) + bytes(80)
+    )
+    return _box(b"ftyp", b"isom\x00\x00\x02\x00") + _box(b"moov", mvhd)
+
+
+def _pad(data: bytes, corpus_format: str, size: int, rng: random.Random) -> bytes:
+    """
+    Grows a file to size with random bytes. The padding goes into a trailing
+    box for ISOBMFF files and after the end of the image data for the others,
+    where every reader ignores it.
+    """
+    missing = size - len(data)
+    if corpus_format in ("heic", "mp4"):
+        if missing < 8:
+            return data
+        return data + _box(
+            b"mdat" if corpus_format == "mp4" else b"free", rng.randbytes(missing - 8)
+        )
+    return data + rng.randbytes(max(0, missing))
+
+
+def generate_corpus(out_dir: str, config: CorpusConfig = CorpusConfig()) -> CorpusStats:
+    """
+    Writes a reproducible library of config.files synthetic media files to
+    out_dir. The same config always produces the same bytes and file names.
+    """
+    register_heif()
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(config.seed)
+    written: list[tuple[str, bytes]] = []
+    total_bytes = 0
+    duplicates = 0
+
+    for i in range(config.files):
+        corpus_format = config.formats[i % len(config.formats)]
+        if written and rng.random() < config.duplicate_ratio:
+            corpus_format, data = written[rng.randrange(len(written))]
+            duplicates += 1
+        else:
+            created = None
+            if rng.random() < config.metadata_ratio:
+                created = EARLIEST_DATE + timedelta(
+                    seconds=rng.randrange(10 * 365 * 24 * 3600)
+                )
+            pil_format, _ = FORMATS[corpus_format]
+            data = (
+                _mp4_bytes(created)
+                if pil_format is None
+                else _image_bytes(rng, pil_format, created)
+            )
+            size = int(rng.lognormvariate(0, config.size_sigma) * config.median_size)
+            data = _pad(data, corpus_format, size, rng)
+            written.append((corpus_format, data))
+
+        extension = FORMATS[corpus_format][1]
+        if rng.random() < config.mislabel_ratio:
+            extension = WRONG_EXTENSIONS[corpus_format]
+        with open(os.path.join(out_dir, f"file{i:06d}.{extension}"), "wb") as f:
+            f.write(data)
+        total_bytes += len(data)
+
+    return CorpusStats(config.files, total_bytes, duplicates)
@@ -0,0 +1,230 @@
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Annotated
+
+import typer
+
+from benchmarks.corpus import FORMATS, CorpusConfig, generate_corpus
+from lib.logger import configure_worker_logging
+from lib.main import Utils
+
+app = typer.Typer()
+
+DEFAULT_CORPUS = CorpusConfig()
+
+# benchmark name -> the Utils method it times
+COMMANDS: dict[str, Callable[[Utils], object]] = {
+    "find_duplicates": Utils.find_duplicates,
+    "update_dates_from_metadata": Utils.update_dates_from_metadata,
+    "correct_file_types": Utils.correct_file_types,
+    "convert_names_to_dates": lambda utils: utils.convert_names_to_dates(
+        prevent_duplicates=True
+    ),
+    "find_similar": Utils.find_similar,
+    "organize": Utils.organize,
+}
+
+
+def _dir_size(path: str) -> tuple[int, int]:
+    files = 0
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            files += 1
+            total += entry.stat().st_size
+    return files, total
+
+
+def _run_command(
+    command: str, corpus_dir: str, live: bool, workers: int, jobs: int
+) -> dict:
+    """
+    Times one command in a fresh process, so peak RSS is the command's own.
+    Live runs work on a scratch copy of the corpus, which isn't timed.
+    """
+    configure_worker_logging()
+    scratch = None
+    base_dir = corpus_dir
+    if live:
+        scratch = tempfile.mkdtemp(prefix="photo-utils-bench-")
+        base_dir = os.path.join(scratch, "corpus")
+        shutil.copytree(corpus_dir, base_dir)
+    try:
+        utils = Utils(
+            base_dir=base_dir, is_dry_run=not live, workers=workers, jobs=jobs
+        )
+        start = time.perf_counter()
+        COMMANDS[command](utils)
+        seconds = time.perf_counter() - start
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "seconds": seconds,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        # the largest metadata worker process, if --jobs started any
+        "peak_child_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        * scale,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    corpus_dir: str,
+    commands: list[str],
+    repeat: int = 3,
+    live: bool = False,
+    workers: int = 1,
+    jobs: int = 1,
+) -> dict:
+    """
+    Runs every command repeat times over the corpus and returns the fastest run
+    of each, with files/s and bytes/s computed over the whole corpus.
+    """
+    files, total_bytes = _dir_size(corpus_dir)
+    results = []
+    for command in commands:
+        runs = []
+        for _ in range(repeat):
+            # spawn rather than fork, so no memory is inherited from this process
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                runs.append(
+                    executor.submit(
+                        _run_command, command, corpus_dir, live, workers, jobs
+                    ).result()
+                )
+        seconds = min(run["seconds"] for run in runs)
+        results.append(
+            {
+                "command": command,
+                "seconds": seconds,
+                "files_per_second": files / seconds,
+                "bytes_per_second": total_bytes / seconds,
+                "peak_rss_bytes": max(run["peak_rss_bytes"] for run in runs),
+                "peak_child_rss_bytes": max(
+                    run["peak_child_rss_bytes"] for run in runs
+                ),
+                "runs": [run["seconds"] for run in runs],
+            }
+        )
+    return {
+        "commit": _git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "corpus": {"path": corpus_dir, "files": files, "bytes": total_bytes},
+        "settings": {"repeat": repeat, "live": live, "workers": workers, "jobs": jobs},
+        "results": results,
+    }
+
+
+@app.command(help="Writes a reproducible synthetic media library.")
+def generate(
+    out: Annotated[str, typer.Option(help="Directory to write the corpus to.")],
+    files: Annotated[int, typer.Option(min=1)] = DEFAULT_CORPUS.files,
+    formats: Annotated[
+        str, typer.Option(help=f"Comma separated subset of {', '.join(FORMATS)}.")
+    ] = ",".join(FORMATS),
+    median_size: Annotated[
+        int, typer.Option(min=1, help="Median file size in bytes.")
+    ] = DEFAULT_CORPUS.median_size,
+    size_sigma: Annotated[
+        float, typer.Option(min=0, help="Spread of the log-normal file sizes.")
+    ] = DEFAULT_CORPUS.size_sigma,
+    duplicate_ratio: Annotated[
+        float, typer.Option(min=0, max=1)
+    ] = DEFAULT_CORPUS.duplicate_ratio,
+    metadata_ratio: Annotated[
+        float, typer.Option(min=0, max=1)
+    ] = DEFAULT_CORPUS.metadata_ratio,
+    mislabel_ratio: Annotated[
+        float, typer.Option(min=0, max=1)
+    ] = DEFAULT_CORPUS.mislabel_ratio,
+    seed: int = DEFAULT_CORPUS.seed,
+):
+    format_list = tuple(f.strip() for f in formats.split(",") if f.strip())
+    unknown = [f for f in format_list if f not in FORMATS]
+    if unknown or not format_list:
+        raise typer.BadParameter(
+            f"expected a subset of {', '.join(FORMATS)}", param_hint="--formats"
+        )
+    stats = generate_corpus(
+        out,
+        CorpusConfig(
+            files=files,
+            formats=format_list,
+            median_size=median_size,
+            size_sigma=size_sigma,
+            duplicate_ratio=duplicate_ratio,
+            metadata_ratio=metadata_ratio,
+            mislabel_ratio=mislabel_ratio,
+            seed=seed,
+        ),
+    )
+    print(json.dumps(stats._asdict()))
+
+
+@app.command(help="Times every command over a corpus and writes the results as JSON.")
+def run(
+    corpus: Annotated[str, typer.Option(help="Corpus directory, see generate.")],
+    output: Annotated[
+        str, typer.Option(help="File the JSON results are written to.")
+    ] = "bench_output.json",
+    command: Annotated[
+        list[str] | None,
+        typer.Option(
+            help=f"Command to time, one of {', '.join(COMMANDS)}. Repeatable."
+        ),
+    ] = None,
+    repeat: Annotated[int, typer.Option(min=1)] = 3,
+    live: Annotated[
+        bool,
+        typer.Option(
+            help="Let commands modify a scratch copy of the corpus instead of running in dry-run mode?"
+        ),
+    ] = False,
+    workers: Annotated[int, typer.Option(min=1)] = 1,
+    jobs: Annotated[int, typer.Option(min=1)] = 1,
+):
+    commands = command or list(COMMANDS)
+    unknown = [c for c in commands if c not in COMMANDS]
+    if unknown:
+        raise typer.BadParameter(
+            f"expected one of {', '.join(COMMANDS)}", param_hint="--command"
+        )
+    report = run_benchmarks(corpus, commands, repeat, live, workers, jobs)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in report["results"]:
+        print(
+            f"{result['command']:<28} {result['seconds']:8.3f}s "
+            f"{result['files_per_second']:10.1f} files/s "
+            f"{result['bytes_per_second'] / 1e6:8.1f} MB/s "
+            f"{result['peak_rss_bytes'] / 2**20:7.1f} MiB peak RSS"
+        )
+
+
+if __name__ == "__main__":
+    app()
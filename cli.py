@@ -1,18 +1,169 @@
+import socket
+from contextlib import contextmanager
 from typing import Annotated
 import typer
-from lib.main import Utils
+from lib.archive import is_archive
+from lib.cache import MetadataCache, open_cache
+from lib.external import DEFAULT_SPILL_RECORDS
+from lib.hashing import DEFAULT_HASH_ALGORITHM, HASH_ALGORITHMS
+from lib.main import DEFAULT_SAMPLE_BLOCKS, DuplicateConfirmation, Utils
+from lib.iosched import IOOrder
+from lib.logger import close_logging, configure_logging, get_logger
+from lib.prefetch import DEFAULT_PREFETCH_PER_MOUNT
+from lib.profiler import profiler
+from lib.rename import IncompleteRenameError
+from lib.shards import merge_scans
+from lib.similar import (
+    DEFAULT_PERCEPTUAL_HASH,
+    DEFAULT_SIMILAR_THRESHOLD,
+    PERCEPTUAL_HASHES,
+)
 
 app = typer.Typer()
+logger = get_logger()
 
 path_type = Annotated[
     str,
     typer.Option(
-        help="Path to base media directory. Note that there should only be media files in this directory, no subfolders, etc."
+        help="Path to base media directory. Note that there should only be media files in this directory."
     ),
 ]
+recursive_type = Annotated[
+    bool, typer.Option(help="Also process media files in sub-directories?")
+]
 dry_run_type = Annotated[
     bool, typer.Option(help="Run in dry-run mode? If True, no files will be modified.")
 ]
+cache_type = Annotated[
+    bool,
+    typer.Option(
+        help="Reuse hashes and metadata of unchanged files from previous runs?"
+    ),
+]
+jobs_type = Annotated[
+    int,
+    typer.Option(
+        min=1,
+        help="Number of processes used to parse file metadata. Useful on many-core machines.",
+    ),
+]
+prefetch_type = Annotated[
+    int,
+    typer.Option(
+        min=0,
+        help="Read the headers of this many upcoming files in the background. Useful on network drives. 0 disables prefetching.",
+    ),
+]
+prefetch_per_mount_type = Annotated[
+    int,
+    typer.Option(
+        min=1,
+        help="Maximum number of prefetch reads in flight per mounted drive.",
+    ),
+]
+io_order_type = Annotated[
+    IOOrder,
+    typer.Option(
+        help="Order files are read in. inode or extent (physical location, where the filesystem reports it) cut down seeks on spinning disks."
+    ),
+]
+incremental_type = Annotated[
+    bool,
+    typer.Option(
+        help="Only process files that are new or changed since the last run in this directory?"
+    ),
+]
+cache_path_type = Annotated[
+    str | None,
+    typer.Option(
+        help="Path to the cache database. Defaults to $XDG_CACHE_HOME/photo-utils."
+    ),
+]
+
+
+def check_prefetch(jobs: int, prefetch: int):
+    if jobs > 1 and prefetch > 0:
+        raise typer.BadParameter(
+            "--prefetch only works with a single job", param_hint="--prefetch"
+        )
+
+
+def check_not_archive(path: str):
+    if is_archive(path):
+        raise typer.BadParameter(
+            "zip archives are only read by find-duplicates, use extract-archive to extract one",
+            param_hint="--path",
+        )
+
+
+def check_archive_options(path: str, options: list[tuple[str, object, object]]):
+    """
+    Rejects the (name, value, default) options that were changed from their
+    default if path is a zip archive, whose members are hashed in one pass.
+    """
+    if not is_archive(path):
+        return
+    changed = [name for name, value, default in options if value != default]
+    if changed:
+        raise typer.BadParameter(
+            "can't be used with zip archives", param_hint=", ".join(changed)
+        )
+
+
+@contextmanager
+def rename_errors():
+    """Turns an unfinished rename journal into an error message."""
+    try:
+        yield
+    except IncompleteRenameError as e:
+        typer.echo(f"{e} (see normalize-file-names --resume/--rollback)", err=True)
+        raise typer.Exit(code=1)
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    profile: Annotated[
+        bool,
+        typer.Option(
+            help="Print the time, bytes read and syscalls spent per stage when the command finishes?"
+        ),
+    ] = False,
+    profile_output: Annotated[
+        str | None,
+        typer.Option(
+            help="Also write cProfile stats of the main thread to this file, for use with pstats or snakeviz."
+        ),
+    ] = None,
+    log_events: Annotated[
+        str | None,
+        typer.Option(
+            help="Write per-file events (renames, time updates) to this file as JSON lines instead of the console."
+        ),
+    ] = None,
+    log_sample: Annotated[
+        int | None,
+        typer.Option(
+            min=0,
+            help="Print every Nth per-file event, 0 prints none. Defaults to all of them, or none with --log-events.",
+        ),
+    ] = None,
+):
+    if log_sample is None:
+        log_sample = 0 if log_events is not None else 1
+    if log_events is not None or log_sample != 1:
+        configure_logging(log_events, log_sample)
+        ctx.call_on_close(close_logging)
+
+    if not profile and profile_output is None:
+        return
+    profiler.enable(profile_output)
+
+    def report():
+        profiler.disable()
+        typer.echo(profiler.summary(), err=True)
+
+    ctx.call_on_close(report)
 
 
 @app.command(
@@ -21,8 +172,27 @@ dry_run_type = Annotated[
 def correct_file_types(
     path: path_type,
     dry_run: dry_run_type = False,
+    recursive: recursive_type = False,
+    jobs: jobs_type = 1,
+    prefetch: prefetch_type = 0,
+    prefetch_per_mount: prefetch_per_mount_type = DEFAULT_PREFETCH_PER_MOUNT,
+    io_order: io_order_type = IOOrder.LISTING,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
 ):
-    Utils(base_dir=path, is_dry_run=dry_run).correct_file_types()
+    check_not_archive(path)
+    check_prefetch(jobs, prefetch)
+    with open_cache(cache, cache_path) as metadata_cache:
+        Utils(
+            base_dir=path,
+            is_dry_run=dry_run,
+            cache=metadata_cache,
+            recursive=recursive,
+            jobs=jobs,
+            prefetch=prefetch,
+            prefetch_per_mount=prefetch_per_mount,
+            io_order=io_order,
+        ).correct_file_types()
 
 
 @app.command(
@@ -31,32 +201,386 @@ def correct_file_types(
 def normalize_file_names(
     path: path_type,
     dry_run: dry_run_type = False,
+    recursive: recursive_type = False,
     prevent_duplicates: Annotated[
         bool,
-        typer.Option(help="Append random numbers to file names to prevent duplicates?"),
+        typer.Option(
+            help="Append sequence numbers to file names to prevent duplicates?"
+        ),
     ] = True,
+    resume: Annotated[
+        bool,
+        typer.Option(help="Finish the renames of an interrupted run instead?"),
+    ] = False,
+    rollback: Annotated[
+        bool,
+        typer.Option(
+            help="Rename the files of the last run back to their old names instead?"
+        ),
+    ] = False,
+    incremental: incremental_type = False,
 ):
-    Utils(base_dir=path, is_dry_run=dry_run).convert_names_to_dates(
-        prevent_duplicates=prevent_duplicates
+    check_not_archive(path)
+    if resume and rollback:
+        raise typer.BadParameter("pass only one of --resume and --rollback")
+    utils = Utils(
+        base_dir=path,
+        is_dry_run=dry_run,
+        recursive=recursive,
+        incremental=incremental,
     )
+    with rename_errors():
+        if resume:
+            utils.resume_renames()
+        elif rollback:
+            utils.rollback_renames()
+        else:
+            utils.convert_names_to_dates(prevent_duplicates=prevent_duplicates)
 
 
 @app.command(help="Updates the file creation date based on the EXIF data.")
 def correct_file_dates(
     path: path_type,
     dry_run: dry_run_type = False,
+    recursive: recursive_type = False,
+    jobs: jobs_type = 1,
+    prefetch: prefetch_type = 0,
+    prefetch_per_mount: prefetch_per_mount_type = DEFAULT_PREFETCH_PER_MOUNT,
+    io_order: io_order_type = IOOrder.LISTING,
+    incremental: incremental_type = False,
+    sidecars: Annotated[
+        bool,
+        typer.Option(
+            help="Take dates from the .json sidecars of a Google Takeout export where there are any, instead of the EXIF data?"
+        ),
+    ] = True,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
 ):
-    Utils(base_dir=path, is_dry_run=dry_run).update_dates_from_metadata()
+    check_not_archive(path)
+    check_prefetch(jobs, prefetch)
+    with open_cache(cache, cache_path) as metadata_cache:
+        Utils(
+            base_dir=path,
+            is_dry_run=dry_run,
+            cache=metadata_cache,
+            recursive=recursive,
+            jobs=jobs,
+            prefetch=prefetch,
+            prefetch_per_mount=prefetch_per_mount,
+            io_order=io_order,
+            incremental=incremental,
+            sidecars=sidecars,
+        ).update_dates_from_metadata()
 
 
 @app.command(
-    help="Prints out files with duplicate names, exluding the random number. This is really only useful if it's ran after normalize_file_names."
+    help="Prints out files with duplicate names, exluding the sequence number. This is really only useful if it's ran after normalize_file_names."
 )
 def find_duplicates(
     path: path_type,
     dry_run: dry_run_type = False,
+    recursive: recursive_type = False,
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help="Number of threads used to hash files. Useful on network drives and SSDs. 0 picks a number by measuring the disk.",
+        ),
+    ] = 1,
+    io_order: io_order_type = IOOrder.LISTING,
+    hash_name: Annotated[
+        str,
+        typer.Option(
+            "--hash",
+            help=f"Hash algorithm used to compare files, one of {', '.join(HASH_ALGORITHMS)}.",
+        ),
+    ] = DEFAULT_HASH_ALGORITHM,
+    sampling: Annotated[
+        bool,
+        typer.Option(
+            help="Hash a few blocks from the head, middle and tail of candidate files before hashing them in full?"
+        ),
+    ] = True,
+    sample_blocks: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help="Number of evenly spaced blocks sampled on top of the head, middle and tail.",
+        ),
+    ] = DEFAULT_SAMPLE_BLOCKS,
+    sampled_only: Annotated[
+        bool,
+        typer.Option(
+            help="Skip the full hash and report files with matching samples. Faster, but the duplicates are only probable, not verified."
+        ),
+    ] = False,
+    confirm: Annotated[
+        DuplicateConfirmation,
+        typer.Option(
+            help="Confirm duplicates by hashing candidates in full, or by comparing them byte by byte and stopping at the first difference."
+        ),
+    ] = DuplicateConfirmation.HASH,
+    spill: Annotated[
+        bool,
+        typer.Option(
+            help="Keep the file list in sorted files on disk instead of in memory? For libraries too large for the available RAM."
+        ),
+    ] = False,
+    spill_dir: Annotated[
+        str | None,
+        typer.Option(
+            help="Directory for the files written by --spill. Defaults to the system temp directory."
+        ),
+    ] = None,
+    spill_records: Annotated[
+        int,
+        typer.Option(
+            min=1,
+            help="Number of files held in memory at a time by --spill, before they are written to disk.",
+        ),
+    ] = DEFAULT_SPILL_RECORDS,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
+):
+    if hash_name not in HASH_ALGORITHMS:
+        raise typer.BadParameter(
+            f"expected one of {', '.join(HASH_ALGORITHMS)}", param_hint="--hash"
+        )
+    check_archive_options(
+        path,
+        [
+            ("--workers", workers, 1),
+            ("--io-order", io_order, IOOrder.LISTING),
+            ("--no-sampling", sampling, True),
+            ("--sample-blocks", sample_blocks, DEFAULT_SAMPLE_BLOCKS),
+            ("--sampled-only", sampled_only, False),
+            ("--confirm", confirm, DuplicateConfirmation.HASH),
+            ("--spill", spill, False),
+        ],
+    )
+    with open_cache(cache, cache_path) as metadata_cache:
+        Utils(
+            base_dir=path,
+            is_dry_run=dry_run,
+            workers=workers,
+            cache=metadata_cache,
+            hash_name=hash_name,
+            sample_blocks=sample_blocks if sampling or sampled_only else None,
+            sampled_only=sampled_only,
+            confirm=confirm,
+            spill=spill,
+            spill_dir=spill_dir,
+            spill_records=spill_records,
+            io_order=io_order,
+            recursive=recursive,
+        ).find_duplicates()
+
+
+@app.command(
+    help="Prints out groups of images that look alike, e.g. the same photo re-encoded, resized or exported as both HEIC and JPEG."
+)
+def find_similar(
+    path: path_type,
+    recursive: recursive_type = False,
+    threshold: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            max=64,
+            help="Maximum number of differing bits between the hashes of similar images.",
+        ),
+    ] = DEFAULT_SIMILAR_THRESHOLD,
+    hash_name: Annotated[
+        str,
+        typer.Option(
+            "--hash",
+            help=f"Perceptual hash used to compare images, one of {', '.join(PERCEPTUAL_HASHES)}.",
+        ),
+    ] = DEFAULT_PERCEPTUAL_HASH,
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=1,
+            help="Number of threads used to decode images.",
+        ),
+    ] = 1,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
+):
+    check_not_archive(path)
+    if hash_name not in PERCEPTUAL_HASHES:
+        raise typer.BadParameter(
+            f"expected one of {', '.join(PERCEPTUAL_HASHES)}", param_hint="--hash"
+        )
+    with open_cache(cache, cache_path) as metadata_cache:
+        Utils(
+            base_dir=path,
+            is_dry_run=True,
+            workers=workers,
+            cache=metadata_cache,
+            recursive=recursive,
+        ).find_similar(threshold=threshold, algorithm=hash_name)
+
+
+@app.command(
+    help="Corrects file types, file dates and file names, and reports duplicates, reading each file only once."
+)
+def organize(
+    path: path_type,
+    dry_run: dry_run_type = False,
+    recursive: recursive_type = False,
+    prevent_duplicates: Annotated[
+        bool,
+        typer.Option(
+            help="Append sequence numbers to file names to prevent duplicates?"
+        ),
+    ] = True,
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=1,
+            help="Number of threads used to hash duplicate candidates.",
+        ),
+    ] = 1,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
+):
+    check_not_archive(path)
+    with open_cache(cache, cache_path) as metadata_cache:
+        utils = Utils(
+            base_dir=path,
+            is_dry_run=dry_run,
+            workers=workers,
+            cache=metadata_cache,
+            recursive=recursive,
+        )
+        with rename_errors():
+            utils.organize(prevent_duplicates=prevent_duplicates)
+
+
+@app.command(
+    help="Hashes every file under a path and writes a sorted manifest that merge-duplicates can compare with the manifests of other drives or machines."
+)
+def scan(
+    path: path_type,
+    output: Annotated[str, typer.Option(help="File the manifest is written to.")],
+    recursive: recursive_type = False,
+    host: Annotated[
+        str | None,
+        typer.Option(
+            help="Host name recorded in the manifest. Defaults to this machine's."
+        ),
+    ] = None,
+    workers: Annotated[
+        int,
+        typer.Option(
+            min=0,
+            help="Number of threads used to hash files. 0 picks a number by measuring the disk.",
+        ),
+    ] = 1,
+    io_order: io_order_type = IOOrder.LISTING,
+    hash_name: Annotated[
+        str,
+        typer.Option(
+            "--hash",
+            help=f"Hash algorithm, one of {', '.join(HASH_ALGORITHMS)}. Manifests can only be merged with manifests using the same one.",
+        ),
+    ] = DEFAULT_HASH_ALGORITHM,
+    cache: cache_type = True,
+    cache_path: cache_path_type = None,
+):
+    check_not_archive(path)
+    if hash_name not in HASH_ALGORITHMS:
+        raise typer.BadParameter(
+            f"expected one of {', '.join(HASH_ALGORITHMS)}", param_hint="--hash"
+        )
+    with open_cache(cache, cache_path) as metadata_cache:
+        Utils(
+            base_dir=path,
+            is_dry_run=True,
+            workers=workers,
+            cache=metadata_cache,
+            hash_name=hash_name,
+            io_order=io_order,
+            recursive=recursive,
+        ).scan(output, host or socket.gethostname())
+
+
+@app.command(
+    help="Extracts the media files of zip archives, e.g. a Google Takeout export, leaving out duplicates and naming files after their date."
+)
+def extract_archive(
+    archives: Annotated[
+        list[str], typer.Argument(help="Zip archives, e.g. all parts of an export.")
+    ],
+    output: Annotated[str, typer.Option(help="Directory the files are extracted to.")],
+    dry_run: dry_run_type = False,
+    hash_name: Annotated[
+        str,
+        typer.Option(
+            "--hash",
+            help=f"Hash algorithm used to confirm duplicates, one of {', '.join(HASH_ALGORITHMS)}.",
+        ),
+    ] = DEFAULT_HASH_ALGORITHM,
+):
+    if hash_name not in HASH_ALGORITHMS:
+        raise typer.BadParameter(
+            f"expected one of {', '.join(HASH_ALGORITHMS)}", param_hint="--hash"
+        )
+    for archive in archives:
+        if not is_archive(archive):
+            raise typer.BadParameter(f"{archive} is not a zip archive")
+    Utils(base_dir=output, is_dry_run=dry_run, hash_name=hash_name).extract_archives(
+        archives
+    )
+
+
+@app.command(
+    help="Prints out duplicates across manifests written by scan, e.g. of different drives or machines."
+)
+def merge_duplicates(
+    manifests: Annotated[list[str], typer.Argument(help="Manifests written by scan.")],
+):
+    try:
+        for rows in merge_scans(manifests):
+            for row in rows[1:]:
+                logger.info(
+                    "Duplicate found",
+                    filename=row.path,
+                    host=row.host,
+                    duplicate=rows[0].path,
+                    duplicate_host=rows[0].host,
+                )
+    except (OSError, ValueError) as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+
+
+@app.command(help="Prints out statistics about the metadata cache.")
+def cache_info(cache_path: cache_path_type = None):
+    metadata_cache = MetadataCache(cache_path)
+    for key, value in metadata_cache.info().items():
+        typer.echo(f"{key}: {value}")
+    metadata_cache.close()
+
+
+@app.command(
+    help="Removes cache entries for files that changed or no longer exist, and optionally caps the number of entries."
+)
+def cache_prune(
+    cache_path: cache_path_type = None,
+    max_entries: Annotated[
+        int | None,
+        typer.Option(
+            min=0, help="Keep at most this many of the most recently used entries."
+        ),
+    ] = None,
 ):
-    Utils(base_dir=path, is_dry_run=dry_run).find_duplicates()
+    metadata_cache = MetadataCache(cache_path)
+    removed = metadata_cache.prune(max_entries=max_entries)
+    typer.echo(f"Removed {removed} entries")
+    metadata_cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import os
+import zipfile
+from collections.abc import Iterable
+from typing import IO, NamedTuple
+
+from lib.hashing import MAX_READ_SIZE, get_hash_factory, get_read_size
+from lib.profiler import STAGE_HASHING, profiled
+
+
+class ArchiveMember(NamedTuple):
+    """A file in one of the zip archives of an Archives, see Archives.members."""
+
+    archive: int
+    info: zipfile.ZipInfo
+
+    @property
+    def name(self) -> str:
+        return self.info.filename
+
+    @property
+    def size(self) -> int:
+        return self.info.file_size
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+class Archives:
+    """
+    Zip archives that are read together, e.g. the parts of a Google Takeout
+    export. Members are streamed out of the archives, nothing is extracted to
+    disk.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths = list(paths)
+        self._zips: list[zipfile.ZipFile] = []
+        try:
+            for path in self.paths:
+                self._zips.append(zipfile.ZipFile(path))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "Archives":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for archive in self._zips:
+            archive.close()
+        self._zips = []
+
+    def members(self) -> list[ArchiveMember]:
+        """Returns the files of all archives, in archive and then listing order."""
+        return [
+            ArchiveMember(i, info)
+            for i, archive in enumerate(self._zips)
+            for info in archive.infolist()
+            if not info.is_dir()
+        ]
+
+    def path(self, member: ArchiveMember) -> str:
+        """Returns a path for messages, the archive's path joined with the name."""
+        return os.path.join(self.paths[member.archive], member.name)
+
+    def open(self, member: ArchiveMember) -> IO[bytes]:
+        return self._zips[member.archive].open(member.info)
+
+    def open_name(self, name: str) -> IO[bytes]:
+        """
+        Opens a member by name, from the first archive that has it. Takeout
+        sometimes puts a sidecar in another part than its media file.
+        """
+        for archive in self._zips:
+            try:
+                return archive.open(name)
+            except KeyError:
+                continue
+        raise FileNotFoundError(name)
+
+    @profiled(STAGE_HASHING)
+    def hash(self, member: ArchiveMember, algorithm: str) -> bytes:
+        """Returns the hash of a member's contents, decompressed as it is read."""
+        hashobj = get_hash_factory(algorithm)()
+        read_size = get_read_size(member.size, MAX_READ_SIZE)
+        with self.open(member) as f:
+            while data := f.read(read_size):
+                hashobj.update(data)
+        return hashobj.digest()
+
+
+def group_by_crc(members: Iterable[ArchiveMember]) -> list[list[ArchiveMember]]:
+    """
+    Groups members with the same size and CRC32, keeping only groups of two
+    or more. Both come from the central directory, so nothing is read, and
+    members whose CRC32 differs can't have the same contents. Groups are in
+    the order of their first member.
+    """
+    groups: dict[tuple[int, int], list[ArchiveMember]] = {}
+    for member in members:
+        groups.setdefault((member.size, member.info.CRC), []).append(member)
+    return [group for group in groups.values() if len(group) > 1]
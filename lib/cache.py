@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from datetime import datetime
+
+CACHE_FILE_NAME = "cache.sqlite3"
+# Number of writes batched into one transaction before committing
+COMMIT_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    file_type TEXT,
+    created_date TEXT,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (device, inode)
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    PRIMARY KEY (device, inode, kind)
+);
+CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used);
+"""
+
+# Stored in the created_date column when the file was parsed but had no date
+NO_DATE = ""
+
+
+def get_default_cache_path() -> str:
+    """Returns the cache location under $XDG_CACHE_HOME (or ~/.cache)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "photo-utils", CACHE_FILE_NAME)
+
+
+class MetadataCache:
+    """
+    SQLite backed cache of per-file hashes and metadata.
+
+    Entries are identified by (device, inode) and are only valid while the
+    size and mtime of the file still match. A stale entry is dropped the first
+    time it is looked up, so files that changed are always re-read.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or get_default_cache_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+        self.pending_writes = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _is_current(self, st: os.stat_result) -> bool:
+        """
+        Returns True if there is a valid entry for the stat result. Stale entries
+        are removed.
+        """
+        row = self.conn.execute(
+            "SELECT size, mtime_ns FROM files WHERE device = ? AND inode = ?",
+            (st.st_dev, st.st_ino),
+        ).fetchone()
+        if row is None:
+            return False
+        if row == (st.st_size, st.st_mtime_ns):
+            return True
+        self._delete(st.st_dev, st.st_ino)
+        return False
+
+    def _delete(self, device: int, inode: int):
+        self.conn.execute(
+            "DELETE FROM files WHERE device = ? AND inode = ?", (device, inode)
+        )
+        self.conn.execute(
+            "DELETE FROM hashes WHERE device = ? AND inode = ?", (device, inode)
+        )
+        self._wrote()
+
+    def _ensure_entry(self, path: str, st: os.stat_result):
+        """Creates the entry for the stat result if there isn't a current one."""
+        if self._is_current(st):
+            self.conn.execute(
+                "UPDATE files SET path = ?, last_used = ? "
+                "WHERE device = ? AND inode = ?",
+                (path, time.time(), st.st_dev, st.st_ino),
+            )
+        else:
+            self.conn.execute(
+                "INSERT INTO files (device, inode, size, mtime_ns, path, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, path, time.time()),
+            )
+        self._wrote()
+
+    def _wrote(self):
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.conn.commit()
+            self.pending_writes = 0
+
+    def _get_column(self, st: os.stat_result, column: str) -> str | None:
+        if not self._is_current(st):
+            return None
+        row = self.conn.execute(
+            f"SELECT {column} FROM files WHERE device = ? AND inode = ?",
+            (st.st_dev, st.st_ino),
+        ).fetchone()
+        return row[0]
+
+    def _set_column(self, path: str, st: os.stat_result, column: str, value: str):
+        self._ensure_entry(path, st)
+        self.conn.execute(
+            f"UPDATE files SET {column} = ? WHERE device = ? AND inode = ?",
+            (value, st.st_dev, st.st_ino),
+        )
+
+    def get_hash(self, st: os.stat_result, kind: str) -> bytes | None:
+        if not self._is_current(st):
+            return None
+        row = self.conn.execute(
+            "SELECT digest FROM hashes WHERE device = ? AND inode = ? AND kind = ?",
+            (st.st_dev, st.st_ino, kind),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_hash(self, path: str, st: os.stat_result, kind: str, digest: bytes):
+        self._ensure_entry(path, st)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes (device, inode, kind, digest) "
+            "VALUES (?, ?, ?, ?)",
+            (st.st_dev, st.st_ino, kind, digest),
+        )
+
+    def get_file_type(self, st: os.stat_result) -> str | None:
+        return self._get_column(st, "file_type")
+
+    def set_file_type(self, path: str, st: os.stat_result, file_type: str):
+        self._set_column(path, st, "file_type", file_type)
+
+    def get_created_date(self, st: os.stat_result) -> tuple[bool, datetime | None]:
+        """
+        Returns (found, created_date). A file that was parsed but has no date is
+        cached as (True, None).
+        """
+        value = self._get_column(st, "created_date")
+        if value is None:
+            return False, None
+        if value == NO_DATE:
+            return True, None
+        return True, datetime.fromisoformat(value)
+
+    def set_created_date(
+        self, path: str, st: os.stat_result, created_date: datetime | None
+    ):
+        value = created_date.isoformat() if created_date is not None else NO_DATE
+        self._set_column(path, st, "created_date", value)
+
+    def refresh(self, path: str, previous_st: os.stat_result):
+        """
+        Moves a current entry over to the new stat result of the file. Used after
+        this tool changed the file's mtime without touching its contents.
+        """
+        if not self._is_current(previous_st):
+            return
+        st = os.stat(path)
+        self.conn.execute(
+            "UPDATE files SET size = ?, mtime_ns = ?, path = ? "
+            "WHERE device = ? AND inode = ?",
+            (st.st_size, st.st_mtime_ns, path, st.st_dev, st.st_ino),
+        )
+        self._wrote()
+
+    def info(self) -> dict[str, int | str]:
+        """Returns summary statistics about the cache."""
+        self.conn.commit()
+        entries = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        hashes = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        return {
+            "path": self.path,
+            "entries": entries,
+            "hashes": hashes,
+            "size_bytes": os.path.getsize(self.path),
+        }
+
+    def prune(self, max_entries: int | None = None) -> int:
+        """
+        Removes entries for files that no longer exist or have changed, then drops
+        the least recently updated entries until at most max_entries remain.
+
+        Returns the number of removed entries.
+        """
+        stale: list[tuple[int, int]] = []
+        for device, inode, size, mtime_ns, path in self.conn.execute(
+            "SELECT device, inode, size, mtime_ns, path FROM files"
+        ).fetchall():
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((device, inode))
+                continue
+            if (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) != (
+                device,
+                inode,
+                size,
+                mtime_ns,
+            ):
+                stale.append((device, inode))
+
+        if max_entries is not None:
+            stale_set = set(stale)
+            current = [
+                row
+                for row in self.conn.execute(
+                    "SELECT device, inode FROM files ORDER BY last_used DESC"
+                ).fetchall()
+                if row not in stale_set
+            ]
+            stale.extend(current[max_entries:])
+
+        for device, inode in stale:
+            self._delete(device, inode)
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        return len(stale)
+
+
+@contextmanager
+def open_cache(
+    enabled: bool, path: str | None = None
+) -> Generator[MetadataCache | None]:
+    """Opens the cache if enabled and makes sure it is flushed to disk at the end."""
+    if not enabled:
+        yield None
+        return
+    cache = MetadataCache(path)
+    try:
+        yield cache
+    finally:
+        cache.close()
@@ -0,0 +1,103 @@
+import os
+from collections.abc import Sequence
+
+from lib.hashing import MAX_READ_SIZE, MIN_READ_SIZE
+from lib.profiler import STAGE_COMPARING, profiled
+
+# files of a group kept open at once, the others are reopened for every block
+MAX_OPEN_FILES = 64
+
+
+class _GroupMember:
+    """A file being compared, read with pread so every member shares one offset."""
+
+    def __init__(self, path: str, keep_open: bool):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY) if keep_open else None
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self.fd is not None:
+            return os.pread(self.fd, size, offset)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return os.pread(fd, size, offset)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _split(
+    members: list[_GroupMember], offset: int, size: int
+) -> list[tuple[bytes, list[_GroupMember]]]:
+    """
+    Reads the next block of every member and splits them by its contents.
+    Blocks are compared directly against one representative per subgroup.
+    Members that can't be read are closed and left out.
+    """
+    subgroups: list[tuple[bytes, list[_GroupMember]]] = []
+    for member in members:
+        try:
+            block = member.read(offset, size)
+        except OSError:
+            member.close()
+            continue
+        for representative, subgroup in subgroups:
+            if block == representative:
+                subgroup.append(member)
+                break
+        else:
+            subgroups.append((block, [member]))
+    return subgroups
+
+
+@profiled(STAGE_COMPARING)
+def split_identical(
+    paths: Sequence[str], max_bytes_in_flight: int = 64 * MAX_READ_SIZE
+) -> list[list[str]]:
+    """
+    Finds the files of paths that are byte-for-byte identical, by reading all
+    of them in lockstep and splitting the group as soon as contents diverge.
+    Files that are left without a match are dropped right away, so they are
+    only read up to their first differing block. Identical files are read
+    exactly once and nothing is hashed.
+
+    The block size shrinks with the size of the group, so at most about
+    max_bytes_in_flight bytes are held at once. Files that can't be read are
+    left out.
+
+    Returns groups of two or more identical paths, in input order.
+    """
+    members: list[_GroupMember] = []
+    try:
+        for path in paths:
+            try:
+                members.append(_GroupMember(path, len(members) < MAX_OPEN_FILES))
+            except OSError:
+                continue
+
+        identical: list[list[str]] = []
+        # (offset, members) of groups still being compared
+        pending = [(0, members)] if len(members) > 1 else []
+        while pending:
+            offset, group = pending.pop()
+            size = max(
+                MIN_READ_SIZE, min(MAX_READ_SIZE, max_bytes_in_flight // len(group))
+            )
+            for block, subgroup in _split(group, offset, size):
+                if len(subgroup) < 2:
+                    # no match left, stop reading this file
+                    subgroup[0].close()
+                    continue
+                if not block:
+                    identical.append([member.path for member in subgroup])
+                else:
+                    pending.append((offset + len(block), subgroup))
+        order = {path: i for i, path in enumerate(paths)}
+        return sorted(identical, key=lambda group: order[group[0]])
+    finally:
+        for member in members:
+            member.close()
@@ -0,0 +1,91 @@
+import heapq
+import itertools
+import marshal
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+# records held in memory before they are sorted and spilled as a run
+DEFAULT_SPILL_RECORDS = 500_000
+# read buffer of every run while merging
+RUN_BUFFER_SIZE = 256 * 1024
+
+Record = tuple[Any, ...]
+
+
+def _iter_run(path: str) -> Iterator[Record]:
+    with open(path, "rb", buffering=RUN_BUFFER_SIZE) as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                return
+
+
+class ExternalSorter:
+    """
+    Sorts more records than fit in memory. Records are buffered until there
+    are max_records of them, then sorted and written to a run file in a
+    scratch directory. sorted() k-way merges the runs, holding one record per
+    run in memory.
+
+    Records are tuples of ints, bytes and strings, compared as tuples. Runs
+    are written with marshal, so they are only meant to be read back by the
+    same process. The scratch directory is removed on close.
+    """
+
+    def __init__(
+        self, spill_dir: str | None = None, max_records: int = DEFAULT_SPILL_RECORDS
+    ):
+        self.max_records = max(1, max_records)
+        self._scratch = tempfile.mkdtemp(prefix="photo-utils-spill-", dir=spill_dir)
+        self._buffer: list[Record] = []
+        self._runs: list[str] = []
+
+    def __enter__(self) -> "ExternalSorter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, record: Record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.max_records:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort()
+        path = os.path.join(self._scratch, f"run{len(self._runs):06d}")
+        with open(path, "wb", buffering=RUN_BUFFER_SIZE) as f:
+            for record in self._buffer:
+                marshal.dump(record, f)
+        self._runs.append(path)
+        self._buffer = []
+
+    @property
+    def run_count(self) -> int:
+        return len(self._runs)
+
+    def sorted(self) -> Iterator[Record]:
+        """Yields all records added so far in order. Call it only once."""
+        self._buffer.sort()
+        buffered = self._buffer
+        self._buffer = []
+        yield from heapq.merge(*(_iter_run(path) for path in self._runs), buffered)
+
+    def close(self):
+        self._buffer = []
+        shutil.rmtree(self._scratch, ignore_errors=True)
+
+
+def iter_groups(records: Iterable[Record], key_length: int) -> Iterator[list[Record]]:
+    """
+    Yields the runs of two or more consecutive records that share their first
+    key_length fields, e.g. the groups of a sorted stream.
+    """
+    for _, group in itertools.groupby(records, key=lambda r: r[:key_length]):
+        members = list(group)
+        if len(members) > 1:
+            yield members
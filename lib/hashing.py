@@ -0,0 +1,155 @@
+import importlib.util
+import os
+import threading
+from collections.abc import Callable
+from typing import Protocol
+
+
+class Hasher(Protocol):
+    def update(self, data: bytes | memoryview, /) -> None: ...
+
+    def digest(self) -> bytes: ...
+
+
+HashFactory = Callable[[], Hasher]
+
+
+def _hashlib_factory(name: str) -> HashFactory:
+    """Returns a factory for a hashlib algorithm that imports hashlib on first use."""
+
+    def factory() -> Hasher:
+        import hashlib
+
+        return hashlib.new(name)
+
+    return factory
+
+
+HASH_ALGORITHMS: dict[str, HashFactory] = {
+    name: _hashlib_factory(name) for name in ("sha1", "sha256", "blake2b")
+}
+DEFAULT_HASH_ALGORITHM = "sha1"
+
+SAMPLE_BLOCK_SIZE = 4096
+MIN_READ_SIZE = 64 * 1024
+MAX_READ_SIZE = 8 * 1024 * 1024
+
+# per-thread read buffer, so every worker reuses a single allocation
+_buffers = threading.local()
+
+
+def register_hash_algorithm(name: str, factory: HashFactory):
+    """
+    Makes a hash algorithm available to find_duplicates. The factory must return
+    an object with hashlib style update() and digest() methods.
+    """
+    HASH_ALGORITHMS[name] = factory
+
+
+def get_hash_factory(name: str) -> HashFactory:
+    try:
+        return HASH_ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown hash algorithm {name}, expected one of {', '.join(HASH_ALGORITHMS)}"
+        ) from None
+
+
+if importlib.util.find_spec("xxhash") is not None:
+
+    def _xxhash_factory(name: str) -> HashFactory:
+        def factory() -> Hasher:
+            import xxhash
+
+            return getattr(xxhash, name)()
+
+        return factory
+
+    # non-cryptographic, but several times faster than the hashlib algorithms
+    register_hash_algorithm("xxh3_128", _xxhash_factory("xxh3_128"))
+    register_hash_algorithm("xxh64", _xxhash_factory("xxh64"))
+
+
+def get_read_size(file_size: int, max_read_size: int = MAX_READ_SIZE) -> int:
+    """
+    Picks a read size for hashing a file of the given size. Larger files get
+    larger reads (roughly 1/64th of the file) so multi-GB videos don't need
+    millions of read calls, bounded by MIN_READ_SIZE and max_read_size.
+    """
+    read_size = 1 << (file_size // 64).bit_length()
+    return max(MIN_READ_SIZE, min(read_size, max_read_size, MAX_READ_SIZE))
+
+
+def _get_buffer(size: int) -> memoryview:
+    buffer: bytearray | None = getattr(_buffers, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        _buffers.buffer = buffer
+    return memoryview(buffer)[:size]
+
+
+def hash_bytes(data: bytes, algorithm: str) -> bytes:
+    hashobj = get_hash_factory(algorithm)()
+    hashobj.update(data)
+    return hashobj.digest()
+
+
+def hash_file_head(path: str, algorithm: str, size: int) -> bytes:
+    """Returns the hash of the first size bytes of a file."""
+    with open(path, "rb") as f:
+        return hash_bytes(f.read(size), algorithm)
+
+
+def hash_file(path: str, algorithm: str, max_read_size: int = MAX_READ_SIZE) -> bytes:
+    """
+    Returns the hash of a whole file. The file is read unbuffered with readinto
+    into one preallocated buffer per thread, sized by get_read_size.
+    """
+    hashobj = get_hash_factory(algorithm)()
+    with open(path, "rb", buffering=0) as f:
+        read_size = get_read_size(os.fstat(f.fileno()).st_size, max_read_size)
+        view = _get_buffer(read_size)
+        while True:
+            n = f.readinto(view)
+            if not n:
+                break
+            hashobj.update(view[:n])
+    return hashobj.digest()
+
+
+def get_sample_offsets(
+    file_size: int, sample_blocks: int, block_size: int
+) -> list[int]:
+    """
+    Returns the offsets of the blocks sampled from a file: the head, middle and
+    tail of the file plus sample_blocks evenly spaced blocks in between.
+    """
+    last = max(0, file_size - block_size)
+    offsets = {0, last // 2, last}
+    offsets.update(last * (i + 1) // (sample_blocks + 1) for i in range(sample_blocks))
+    return sorted(offsets)
+
+
+def hash_file_samples(
+    path: str, algorithm: str, sample_blocks: int, block_size: int = SAMPLE_BLOCK_SIZE
+) -> bytes:
+    """
+    Returns the hash of a few fixed-offset blocks of a file, see
+    get_sample_offsets. Files too small to sample are hashed completely.
+
+    Two files with different sample hashes are different, but equal sample hashes
+    only make it likely that the files are identical.
+    """
+    hashobj = get_hash_factory(algorithm)()
+    with open(path, "rb", buffering=0) as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size <= (sample_blocks + 3) * block_size:
+            hashobj.update(f.readall())
+            return hashobj.digest()
+
+        view = _get_buffer(block_size)
+        for offset in get_sample_offsets(file_size, sample_blocks, block_size):
+            f.seek(offset)
+            n = f.readinto(view)
+            hashobj.update(view[: n or 0])
+    return hashobj.digest()
@@ -0,0 +1,25 @@
+import functools
+from typing import IO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import ImageFile
+
+
+@functools.cache
+def register_heif():
+    """Registers the HEIF plugin with Pillow, once per process."""
+    from pillow_heif import register_heif_opener
+
+    register_heif_opener()
+
+
+def open_image(path: str | IO[bytes]) -> "ImageFile.ImageFile":
+    """
+    Opens an image, by path or from an open binary file, with Pillow. Pillow
+    and the HEIF plugin are only imported by the first call, so commands that
+    never decode images don't load them.
+    """
+    from PIL import Image as PILImage
+
+    register_heif()
+    return PILImage.open(path)
@@ -0,0 +1,160 @@
+import os
+import struct
+import sys
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from enum import StrEnum
+
+from lib.logger import get_logger
+
+logger = get_logger()
+
+# workers=AUTO_WORKERS picks the number of threads by measuring, see tune_workers
+AUTO_WORKERS = 0
+MAX_AUTO_WORKERS = 16
+# bytes read from every file while measuring
+TUNE_READ_SIZE = 1024 * 1024
+# a level must beat the previous one by this factor to be picked
+TUNE_MIN_SPEEDUP = 1.25
+# files needed by tune_workers to measure every level up to MAX_AUTO_WORKERS
+TUNE_SAMPLE_FILES = 64
+
+# linux/fs.h and linux/fiemap.h
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_MAX_OFFSET = 2**64 - 1
+_FIEMAP_HEADER = struct.Struct("=QQLLLL")
+_FIEMAP_EXTENT = struct.Struct("=QQQQQLLLL")
+
+
+class IOOrder(StrEnum):
+    """Order in which files are read, see io_sort_key."""
+
+    LISTING = "listing"
+    INODE = "inode"
+    EXTENT = "extent"
+
+
+def physical_offset(path: str) -> int | None:
+    """
+    Returns where the first extent of a file starts on its device, using the
+    FIEMAP ioctl. None if the platform or filesystem doesn't support it or the
+    file has no data on disk.
+    """
+    if sys.platform != "linux":
+        return None
+    import fcntl
+
+    buffer = bytearray(_FIEMAP_HEADER.size + _FIEMAP_EXTENT.size)
+    _FIEMAP_HEADER.pack_into(buffer, 0, 0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buffer)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    mapped_extents = _FIEMAP_HEADER.unpack_from(buffer)[3]
+    if not mapped_extents:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(buffer, _FIEMAP_HEADER.size)[1]
+
+
+def io_sort_key(path: str, st: os.stat_result, order: IOOrder) -> tuple[int, ...]:
+    """
+    Sort key that puts files in an order a spinning disk can read with few
+    seeks: by inode (which most filesystems allocate close to the data), or by
+    the physical offset of the data where FIEMAP is available. Files without a
+    physical offset go after the others, by inode.
+    """
+    if order == IOOrder.EXTENT:
+        offset = physical_offset(path)
+        if offset is not None:
+            return (st.st_dev, 0, offset)
+        return (st.st_dev, 1, st.st_ino)
+    if order == IOOrder.INODE:
+        return (st.st_dev, st.st_ino)
+    return ()
+
+
+def is_rotational(path: str) -> bool | None:
+    """
+    Whether the file is on a spinning disk, according to Linux's sysfs. None
+    if it can't be told, e.g. for network filesystems or on other platforms.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    device = os.path.realpath(
+        f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+    )
+    # partitions keep the queue settings in the directory of their disk
+    for directory in (device, os.path.dirname(device)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _read_head(path: str) -> int:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        return len(os.pread(fd, TUNE_READ_SIZE, 0))
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+
+
+def _measure(paths: Sequence[str], workers: int) -> float:
+    """Returns the bytes per second read from paths by workers threads."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(_read_head, paths))
+    return total / max(time.perf_counter() - start, 1e-9)
+
+
+def tune_workers(paths: Sequence[str], max_workers: int = MAX_AUTO_WORKERS) -> int:
+    """
+    Picks how many threads should read files from the disk of paths. Spinning
+    disks get one, so reads stay sequential. Otherwise the throughput of 1, 2,
+    4, ... threads is measured, each level reading the heads of files not read
+    before, and the level after which more threads stop paying off is picked.
+    """
+    if not paths:
+        return 1
+    rotational = is_rotational(paths[0])
+    if rotational:
+        logger.info("Tuned workers", workers=1, rotational=True)
+        return 1
+
+    best_workers = 1
+    best_rate = 0.0
+    used = 0
+    workers = 1
+    while workers <= max_workers:
+        sample = paths[used : used + max(4, 2 * workers)]
+        if len(sample) < max(4, 2 * workers):
+            break
+        used += len(sample)
+        rate = _measure(sample, workers)
+        if best_rate and rate < best_rate * TUNE_MIN_SPEEDUP:
+            break
+        best_workers, best_rate = workers, rate
+        workers *= 2
+    logger.info(
+        "Tuned workers",
+        workers=best_workers,
+        rotational=rotational,
+        mb_per_second=round(best_rate / 1e6, 1),
+    )
+    return best_workers
@@ -1,48 +1,286 @@
-from datetime import datetime
 import struct
+from collections.abc import Iterator
+from datetime import datetime
+from typing import NamedTuple
+
+from lib.reader import HeaderReader, ReadAt, buffer_reader
+from lib.tiff import parse_tiff_datetime
+from lib.xmp import parse_xmp_datetime
+
+# difference between Unix epoch and QuickTime epoch, in seconds
+EPOCH_ADJUSTER = 2082844800
+# Exif and XMP items are a few KB, anything much larger is corrupt
+MAX_METADATA_ITEM_SIZE = 4 * 1024 * 1024
+XMP_CONTENT_TYPE = b"application/rdf+xml"
+
+
+class Box(NamedTuple):
+    type: bytes
+    # offset of the box header and total size of the box, header included
+    offset: int
+    size: int
+    header_size: int
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def _read_exact(read_at: ReadAt, offset: int, length: int) -> bytes:
+    data = read_at(offset, length)
+    if len(data) != length:
+        raise ValueError(f"Truncated ISOBMFF data at offset {offset}")
+    return data
+
+
+def iter_boxes(read_at: ReadAt, start: int, end: int) -> Iterator[Box]:
+    """
+    Yields the boxes between start and end (usually the payload of a parent box,
+    or the whole file). Every box size is validated against end, so truncated
+    or corrupt files raise ValueError instead of looping forever.
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack(">I4s", _read_exact(read_at, pos, 8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", _read_exact(read_at, pos + 8, 8))[0]
+            header_size = 16
+        elif size == 0:
+            # the box extends to the end of its parent
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise ValueError(f"Invalid size for box {box_type!r} at offset {pos}")
+        yield Box(box_type, pos, size, header_size)
+        pos += size
+
+
+def find_box(read_at: ReadAt, start: int, end: int, box_type: bytes) -> Box | None:
+    for box in iter_boxes(read_at, start, end):
+        if box.type == box_type:
+            return box
+    return None
+
+
+def _uint(data: bytes, offset: int, size: int) -> int:
+    """Reads a big-endian unsigned int of 0, 2, 4 or 8 bytes (0 reads as 0)."""
+    return int.from_bytes(data[offset : offset + size], "big")
+
+
+def parse_mvhd_creation_time(read_at: ReadAt, mvhd: Box) -> datetime | None:
+    """Returns the creation time of a version 0 (32 bit) or 1 (64 bit) mvhd box."""
+    version = _read_exact(read_at, mvhd.payload_offset, 1)[0]
+    if version == 1:
+        creation_time = struct.unpack(
+            ">Q", _read_exact(read_at, mvhd.payload_offset + 4, 8)
+        )[0]
+    elif version == 0:
+        creation_time = struct.unpack(
+            ">I", _read_exact(read_at, mvhd.payload_offset + 4, 4)
+        )[0]
+    else:
+        raise ValueError(f"Unknown mvhd version {version}")
+
+    try:
+        created = datetime.fromtimestamp(creation_time - EPOCH_ADJUSTER)
+    except (OverflowError, OSError, ValueError):
+        return None
+    # unset creation times are written as 0, i.e. 1904
+    if created.year < 1990:
+        return None
+    return created
 
 
 def get_isobmff_timestamp(
     q_path: str,
+    reader: HeaderReader | None = None,
 ) -> datetime | None:
     """
     Get the creation and modification datetime from isobmff files.
+    An open reader over the file can be passed in to reuse its prefetched header.
 
     Returns
         creation_datetime of the image
     """
+    if reader is None:
+        with open(q_path, "rb") as f:
+            return get_isobmff_timestamp(q_path, HeaderReader(f, header_size=64))
+
+    read_at = reader.read_at
+    moov = find_box(read_at, 0, reader.size, b"moov")
+    if moov is None:
+        return None
+    # compressed (cmov) movie headers have no mvhd and aren't supported
+    mvhd = find_box(read_at, moov.payload_offset, moov.end, b"mvhd")
+    if mvhd is None:
+        return None
+    return parse_mvhd_creation_time(read_at, mvhd)
+
 
-    ATOM_HEADER_SIZE_BYTES = 8
-    # difference between Unix epoch and QuickTime epoch, in seconds
-    EPOCH_ADJUSTER = 2082844800
-
-    creation_time = None
-
-    # search for moov item
-    with open(q_path, "rb") as f:
-        while True:
-            atom_header: bytes = f.read(ATOM_HEADER_SIZE_BYTES)
-            if atom_header[4:8] == b"moov":
-                break
-            else:
-                atom_size = struct.unpack(">I", atom_header[0:4])[0]
-                if atom_size == 1:
-                    extended_size: bytes = f.read(
-                        ATOM_HEADER_SIZE_BYTES
-                    )  # read 64 bit extended size
-                    atom_size = struct.unpack(">Q", extended_size)[0]
-                    f.seek(atom_size - 16, 1)  # we are now 16 bytes into this
-                else:
-                    f.seek(atom_size - 8, 1)
-
-        atom_header = f.read(ATOM_HEADER_SIZE_BYTES)
-        if atom_header[4:8] == b"cmov" or atom_header[4:8] != b"mvhd":
-            return None
-        else:
-            f.seek(4, 1)
-            creation_time = struct.unpack(">I", f.read(4))[0] - EPOCH_ADJUSTER
-            creation_time = datetime.fromtimestamp(creation_time)
-            if creation_time.year < 1990:
-                creation_time = None
-
-    return creation_time
+class Extent(NamedTuple):
+    offset: int
+    length: int
+
+
+def _parse_iinf(read_at: ReadAt, iinf: Box) -> dict[int, tuple[bytes, bytes]]:
+    """Returns the item id -> (item type, content type) mapping of an iinf box."""
+    version = _read_exact(read_at, iinf.payload_offset, 1)[0]
+    count_size = 2 if version == 0 else 4
+    start = iinf.payload_offset + 4 + count_size
+
+    items: dict[int, tuple[bytes, bytes]] = {}
+    for infe in iter_boxes(read_at, start, iinf.end):
+        if infe.type != b"infe":
+            continue
+        if infe.size > MAX_METADATA_ITEM_SIZE:
+            raise ValueError("infe box too large")
+        data = _read_exact(read_at, infe.payload_offset, infe.end - infe.payload_offset)
+        if not data:
+            raise ValueError("Empty infe box")
+        version = data[0]
+        if version < 2:
+            # legacy entries don't have an item type
+            continue
+        id_size = 2 if version == 2 else 4
+        type_offset = 4 + id_size + 2
+        if len(data) < type_offset + 4:
+            raise ValueError("Truncated infe box")
+        item_id = _uint(data, 4, id_size)
+        item_type = data[type_offset : type_offset + 4]
+        content_type = b""
+        if item_type == b"mime":
+            # item_name and content_type are null terminated strings
+            strings = data[type_offset + 4 :].split(b"\x00")
+            content_type = strings[1] if len(strings) > 1 else b""
+        items[item_id] = (item_type, content_type)
+    return items
+
+
+def _parse_iloc(read_at: ReadAt, iloc: Box) -> dict[int, tuple[int, list[Extent]]]:
+    """Returns the item id -> (construction method, extents) mapping of an iloc box."""
+    if iloc.size > MAX_METADATA_ITEM_SIZE:
+        raise ValueError("iloc box too large")
+    data = _read_exact(read_at, iloc.payload_offset, iloc.end - iloc.payload_offset)
+    if len(data) < 6:
+        raise ValueError("Truncated iloc box")
+    version = data[0]
+    if version > 2:
+        raise ValueError(f"Unknown iloc version {version}")
+    offset_size, length_size = data[4] >> 4, data[4] & 0x0F
+    base_offset_size = data[5] >> 4
+    index_size = data[5] & 0x0F if version in (1, 2) else 0
+    id_size = 2 if version < 2 else 4
+    count_size = 2 if version < 2 else 4
+    item_count = _uint(data, 6, count_size)
+    pos = 6 + count_size
+
+    locations: dict[int, tuple[int, list[Extent]]] = {}
+    for _ in range(item_count):
+        item_id = _uint(data, pos, id_size)
+        pos += id_size
+        construction_method = 0
+        if version in (1, 2):
+            construction_method = _uint(data, pos, 2) & 0x0F
+            pos += 2
+        pos += 2  # data_reference_index
+        base_offset = _uint(data, pos, base_offset_size)
+        pos += base_offset_size
+        extent_count = _uint(data, pos, 2)
+        pos += 2
+        extents = []
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset = _uint(data, pos, offset_size)
+            pos += offset_size
+            extent_length = _uint(data, pos, length_size)
+            pos += length_size
+            extents.append(Extent(base_offset + extent_offset, extent_length))
+        if pos > len(data):
+            raise ValueError("Truncated iloc box")
+        locations[item_id] = (construction_method, extents)
+    return locations
+
+
+def _read_item(
+    read_at: ReadAt,
+    construction_method: int,
+    extents: list[Extent],
+    idat: Box | None,
+) -> bytes:
+    if construction_method == 1:
+        if idat is None:
+            raise ValueError("Item stored in a missing idat box")
+        base = idat.payload_offset
+    elif construction_method == 0:
+        base = 0
+    else:
+        raise ValueError(f"Unsupported construction method {construction_method}")
+
+    if sum(extent.length for extent in extents) > MAX_METADATA_ITEM_SIZE:
+        raise ValueError("Metadata item too large")
+    return b"".join(
+        _read_exact(read_at, base + extent.offset, extent.length) for extent in extents
+    )
+
+
+def get_heic_metadata(
+    q_path: str,
+    reader: HeaderReader | None = None,
+) -> tuple[bytes | None, bytes | None]:
+    """
+    Returns the raw (Exif, XMP) item payloads of a HEIC/HEIF file by walking
+    meta -> iinf/iloc and reading the items directly, without decoding the image.
+    An open reader over the file can be passed in to reuse its prefetched header.
+    """
+    if reader is None:
+        with open(q_path, "rb") as f:
+            return get_heic_metadata(q_path, HeaderReader(f, header_size=4096))
+
+    read_at = reader.read_at
+    meta = find_box(read_at, 0, reader.size, b"meta")
+    if meta is None:
+        return None, None
+
+    # meta is a full box, its children start after the version and flags
+    children = {
+        box.type: box for box in iter_boxes(read_at, meta.payload_offset + 4, meta.end)
+    }
+    if b"iinf" not in children or b"iloc" not in children:
+        return None, None
+    items = _parse_iinf(read_at, children[b"iinf"])
+    locations = _parse_iloc(read_at, children[b"iloc"])
+
+    exif = None
+    xmp = None
+    for item_id, (item_type, content_type) in items.items():
+        if item_id not in locations:
+            continue
+        method, extents = locations[item_id]
+        if item_type == b"Exif" and exif is None:
+            exif = _read_item(read_at, method, extents, children.get(b"idat"))
+        elif item_type == b"mime" and content_type == XMP_CONTENT_TYPE and xmp is None:
+            xmp = _read_item(read_at, method, extents, children.get(b"idat"))
+    return exif, xmp
+
+
+def get_heic_timestamp(
+    q_path: str, reader: HeaderReader | None = None
+) -> datetime | None:
+    """
+    Returns the created datetime from the Exif item of a HEIC file, falling back
+    to its XMP item.
+    """
+    exif, xmp = get_heic_metadata(q_path, reader)
+    if exif is not None and len(exif) >= 4:
+        # the item starts with the offset to the TIFF header, after a 4 byte field
+        tiff_offset = 4 + struct.unpack(">I", exif[:4])[0]
+        created_date = parse_tiff_datetime(buffer_reader(exif, tiff_offset))
+        if created_date is not None:
+            return created_date
+    if xmp is not None:
+        return parse_xmp_datetime(xmp)
+    return None
@@ -1,43 +1,162 @@
-"""UNDER CONSTRUCTION"""
-
-import re
+import mmap
+from collections.abc import Iterator
 from datetime import datetime
+from typing import NamedTuple
 
+from lib.reader import HeaderReader, ReadAt
+from lib.tiff import parse_tiff_datetime
+from lib.xmp import parse_xmp_datetime
+
+SOI = b"\xff\xd8"
+MARKER_SOS = 0xDA
+MARKER_EOI = 0xD9
+MARKER_APP0 = 0xE0
+MARKER_APP1 = 0xE1
+# markers without a length field
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+JFIF_HEADER = b"JFIF\x00"
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+
+Buffer = bytes | mmap.mmap
 
-def get_jfif_app0_segment(q_path: str):
-    with open(q_path, "rb") as f:
-        data = f.read()
 
-    i = 0
-    while i < len(data):
-        if data[i] == 0xFF:
-            print("====", data[i + 1] == 0xE0)
-        if data[i] == 0xFF and data[i + 1] == 0xE0:  # APP0 marker
-            length = int.from_bytes(data[i + 2 : i + 4], "big")
-            segment_data = data[i + 4 : i + 2 + length]
+class JpegSegment(NamedTuple):
+    marker: int
+    # offset and length of the segment payload, excluding the marker and length
+    offset: int
+    length: int
 
-            if segment_data.startswith(b"JFIF\0"):
-                return segment_data
 
-        i += 1
+def iter_jpeg_segments(data: Buffer) -> Iterator[JpegSegment]:
+    """
+    Yields the metadata segments of a JPEG, jumping from marker to marker using
+    the segment lengths. Stops at the start of the image data (SOS), so only the
+    header of the file is touched.
 
+    Raises ValueError if the data isn't a JPEG or a segment runs past the end.
+    """
+    if data[0:2] != SOI:
+        raise ValueError("Not a JPEG file")
+
+    i = 2
+    while i + 2 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError(f"Expected a JPEG marker at offset {i}")
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # fill byte before a marker
+            i += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            i += 2
+            continue
+        if marker == MARKER_SOS or marker == MARKER_EOI:
+            return
+
+        length = int.from_bytes(data[i + 2 : i + 4], "big")
+        if length < 2 or i + 2 + length > len(data):
+            raise ValueError(f"Truncated JPEG segment at offset {i}")
+        yield JpegSegment(marker, i + 4, length - 2)
+        i += 2 + length
+
+
+def find_app_segment(data: Buffer, marker: int, header: bytes) -> JpegSegment | None:
+    """Returns the first APPn segment whose payload starts with header."""
+    for segment in iter_jpeg_segments(data):
+        if (
+            segment.marker == marker
+            and data[segment.offset : segment.offset + len(header)] == header
+        ):
+            return segment
     return None
 
 
-def get_jpg_timestamp(q_path: str) -> datetime | None:
-    with open(q_path, "rb") as f:
-        data = f.read()
+def _segment_reader(data: Buffer, segment: JpegSegment, skip: int) -> ReadAt:
+    """
+    Returns a ReadAt over the payload of a segment, after its first skip bytes.
+    Reads are clamped to the segment so offsets can't escape into the image data.
+    """
+    base = segment.offset + skip
+    end = segment.offset + segment.length
 
-    date_patterns = [
-        rb"\d{4}[:\-]\d{2}[:\-]\d{2} \d{2}:\d{2}:\d{2}",
-        rb"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}",
-    ]
+    def read_at(offset: int, length: int) -> bytes:
+        if offset < 0 or length < 0:
+            raise ValueError("Negative offset or length")
+        start = base + offset
+        return data[start : min(start + length, end)]
 
-    for pattern in date_patterns:
-        matches = re.findall(pattern, data)
-        if matches:
-            datestring = matches[0].decode("utf-8")
+    return read_at
 
-            datetime.strptime(datestring, "%Y-%m-%dThh:mm:ss")
 
+def get_jpg_datetime(data: Buffer) -> datetime | None:
+    """
+    Returns the created datetime from the APP1 Exif segment of a JPEG, falling
+    back to the XMP packet. Only the matching segments are read.
+    """
+    exif = None
+    xmp = None
+    for segment in iter_jpeg_segments(data):
+        if segment.marker != MARKER_APP1:
+            continue
+        if exif is None and data[segment.offset : segment.offset + 6] == EXIF_HEADER:
+            exif = segment
+        elif xmp is None and (
+            data[segment.offset : segment.offset + len(XMP_HEADER)] == XMP_HEADER
+        ):
+            xmp = segment
+
+    if exif is not None:
+        created_date = parse_tiff_datetime(
+            _segment_reader(data, exif, len(EXIF_HEADER))
+        )
+        if created_date is not None:
+            return created_date
+
+    if xmp is not None:
+        start = xmp.offset + len(XMP_HEADER)
+        return parse_xmp_datetime(data[start : xmp.offset + xmp.length])
     return None
+
+
+def get_jfif_app0_segment(q_path: str) -> bytes | None:
+    """Returns the payload of the JFIF APP0 segment of a JPEG, if it has one."""
+    with open(q_path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as m:
+        segment = find_app_segment(m, MARKER_APP0, JFIF_HEADER)
+        if segment is None:
+            return None
+        return m[segment.offset : segment.offset + segment.length]
+
+
+def get_jpg_timestamp(
+    q_path: str, reader: HeaderReader | None = None
+) -> datetime | None:
+    """
+    Returns the created datetime of a JPEG. The file is memory mapped, so only
+    the pages holding the metadata segments are actually read from disk.
+
+    If an open reader over the file is passed in, the file is read through it
+    and never opened by name: its prefetched header is tried first, and if the
+    segments run past it, twice as much of the file is read until they fit.
+    """
+    if reader is not None:
+        data = reader.header
+        while True:
+            try:
+                return get_jpg_datetime(data)
+            except ValueError:
+                if len(data) >= reader.size:
+                    raise
+            longer = reader.read_at(0, min(2 * len(data), reader.size))
+            if len(longer) <= len(data):
+                raise ValueError("JPEG ends before its header")
+            data = longer
+
+    with open(q_path, "rb") as f:
+        if f.seek(0, 2) == 0:
+            raise ValueError("Empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return get_jpg_datetime(m)
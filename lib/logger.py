@@ -1,6 +1,189 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any
+
 import structlog
+from structlog.typing import EventDict, WrappedLogger
+
+# context key that marks the events of a per-file logger, see get_logger
+PER_FILE_KEY = "per_file"
+# per-file events handed to the background writer at once
+EVENT_BATCH_SIZE = 1024
+# batches queued for the writer before logging waits for it
+EVENT_QUEUE_BATCHES = 16
+
+_CONSOLE_LEVELS = {"warning", "warn", "error", "critical", "exception", "fatal"}
+
+
+class Timestamp:
+    """A POSIX time that is only formatted if its log line is written."""
+
+    __slots__ = ("seconds",)
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def __str__(self) -> str:
+        return datetime.fromtimestamp(self.seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+    __repr__ = __str__
+
+
+class EventWriter:
+    """
+    Writes events as JSON lines to a file from a background thread. Events
+    are batched, so the logging thread only appends to a list. If writing
+    fails, e.g. on a full disk, the remaining events are dropped and close
+    reports the error.
+    """
+
+    def __init__(self, path: str, batch_size: int = EVENT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._file = open(path, "a", encoding="utf-8")
+        self._batch: list[dict[str, Any]] = []
+        self.error: Exception | None = None
+        self.dropped = 0
+        self._queue: queue.Queue[list[dict[str, Any]] | None] = queue.Queue(
+            EVENT_QUEUE_BATCHES
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="photo-utils-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, level: str, event_dict: Mapping[str, Any]):
+        event = dict(event_dict)
+        event["level"] = level
+        event["timestamp"] = time.time()
+        self._batch.append(event)
+        if len(self._batch) >= self.batch_size:
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def _run(self):
+        # keeps taking batches after an error, so the logging thread never
+        # waits on a full queue
+        while (batch := self._queue.get()) is not None:
+            if self.error is not None:
+                self.dropped += len(batch)
+                continue
+            try:
+                self._file.write(
+                    "".join(json.dumps(event, default=str) + "\n" for event in batch)
+                )
+            except Exception as e:
+                self.error = e
+                self.dropped += len(batch)
+
+    def close(self):
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._file.close()
+        except OSError as e:
+            self.error = self.error or e
+        if self.error is not None:
+            structlog.get_logger().warning(
+                "Failed to write per-file events",
+                events_path=self.path,
+                e=self.error,
+                dropped=self.dropped,
+            )
+
+
+class _FileEventRouter:
+    """
+    First processor of the chain. Sends the events of per-file loggers to the
+    event writer, if there is one, and drops all but every sample_every-th
+    of them (per event name) from the console. Warnings always go through.
+    """
+
+    def __init__(self):
+        self.writer: EventWriter | None = None
+        self.sample_every = 1
+        self.counts: Counter[str] = Counter()
+
+    def __call__(
+        self, logger: WrappedLogger, method_name: str, event_dict: EventDict
+    ) -> EventDict:
+        if not event_dict.pop(PER_FILE_KEY, False):
+            return event_dict
+        if self.writer is None and self.sample_every == 1:
+            return event_dict
+        event = event_dict.get("event", "")
+        self.counts[event] += 1
+        if self.writer is not None:
+            self.writer.write(method_name, event_dict)
+        if method_name in _CONSOLE_LEVELS:
+            return event_dict
+        if self.sample_every and (self.counts[event] - 1) % self.sample_every == 0:
+            return event_dict
+        raise structlog.DropEvent
+
+
+_router = _FileEventRouter()
+structlog.configure(processors=[_router, *structlog.get_config()["processors"]])
+
+
+def get_logger(per_file: bool = False):
+    """
+    Returns a logger. Events of per-file loggers (one event per processed
+    file, e.g. renames) are routed as set up by configure_logging.
+    """
+    if per_file:
+        return structlog.get_logger(**{PER_FILE_KEY: True})
+    return structlog.get_logger()
+
+
+def configure_logging(events_path: str | None = None, sample_every: int = 1):
+    """
+    Sets up where per-file events go. With events_path they are written to
+    that file as JSON lines by a background thread. Only every sample_every-th
+    of them is also printed, 0 prints none. Call close_logging when done.
+    """
+    close_logging()
+    _router.sample_every = max(0, sample_every)
+    if events_path is not None:
+        _router.writer = EventWriter(events_path)
+
+
+def close_logging():
+    """
+    Flushes the per-file events, logs how many of each there were if any were
+    held back from the console, and goes back to printing all of them.
+    """
+    writer, _router.writer = _router.writer, None
+    if writer is not None:
+        writer.close()
+    counts = dict(_router.counts)
+    _router.counts = Counter()
+    _router.sample_every = 1
+    # nothing is counted while every event is printed and none is written
+    if counts:
+        structlog.get_logger().info(
+            "Per-file events",
+            counts=counts,
+            events_path=writer.path if writer is not None else None,
+        )
 
 
-def get_logger():
-    logger = structlog.get_logger()
-    return logger
+def configure_worker_logging():
+    """
+    Drops everything below warnings in a worker process, so per-file debug
+    output of child processes doesn't interleave with the parent's output.
+    The writer thread of the parent doesn't exist in forked workers.
+    """
+    _router.writer = None
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING)
+    )
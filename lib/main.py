@@ -1,20 +1,88 @@
 from enum import StrEnum
-from io import BufferedReader
 import os
+import shutil
+import zipfile
 from datetime import datetime
-import random
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from itertools import chain, islice
+from concurrent.futures import Future, ThreadPoolExecutor
 import time
-import filetype
-from lib.logger import get_logger
-import hashlib
-from PIL import Image as PILImage, ExifTags, ImageFile
-from pillow_heif import register_heif_opener
+from typing import IO, TYPE_CHECKING
+from lib.logger import Timestamp, configure_worker_logging, get_logger
 
 
-from lib.isobmff import get_isobmff_timestamp
+from lib.archive import Archives, ArchiveMember, group_by_crc, is_archive
+from lib.cache import MetadataCache
+from lib.compare import split_identical
+from lib.hashing import (
+    DEFAULT_HASH_ALGORITHM,
+    MAX_READ_SIZE,
+    get_hash_factory,
+    hash_bytes,
+    hash_file,
+    hash_file_head,
+    hash_file_samples,
+)
+from lib.external import DEFAULT_SPILL_RECORDS, ExternalSorter, iter_groups
+from lib.imaging import open_image
+from lib.iosched import (
+    AUTO_WORKERS,
+    TUNE_SAMPLE_FILES,
+    IOOrder,
+    io_sort_key,
+    tune_workers,
+)
+from lib.isobmff import get_heic_timestamp, get_isobmff_timestamp
+from lib.jpg import get_jpg_timestamp
+from lib.manifest import MANIFEST_NAME, MANIFEST_TMP_NAME, Manifest
+from lib.profiler import (
+    STAGE_ENUMERATION,
+    STAGE_EXTRACTING,
+    STAGE_HASHING,
+    STAGE_METADATA,
+    STAGE_RENAME_UTIME,
+    STAGE_SNIFFING,
+    profiled,
+    profiler,
+)
+from lib.prefetch import DEFAULT_PREFETCH_PER_MOUNT, iter_prefetched
+from lib.reader import HeaderReader, PrefetchedReader
+from lib.records import SIZE, FileRecords, RecordGroups, make_stat
+from lib.rename import (
+    RENAME_JOURNAL_NAME,
+    RenameRequest,
+    apply_plan,
+    build_name,
+    check_finished,
+    get_journal_path,
+    has_target_name,
+    is_unfinished,
+    plan_renames,
+    read_journal,
+    rollback_plan,
+    write_plan,
+)
+from lib.shards import ScanHeader, ScanRow, write_scan
+from lib.similar import (
+    DEFAULT_PERCEPTUAL_HASH,
+    DEFAULT_SIMILAR_THRESHOLD,
+    SIMILAR_BATCH_SIZE,
+    get_perceptual_hash,
+    group_similar,
+    load_thumbnail,
+)
+from lib.takeout import SidecarIndex, is_sidecar
+from lib.tiff import TAG_EXIF_IFD, get_tiff_timestamp, pick_exif_datetime
+from lib.walk import FileEntry, iter_files
+from lib.xmp import parse_xmp_datetime
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import ImageFile
 
 logger = get_logger()
+file_logger = get_logger(per_file=True)
 
 DuplicateFileMap = dict[int, list[str]]
 
@@ -32,8 +100,58 @@ class FileExtensions(StrEnum):
     GIF = "gif"
 
 
-EXCLUDED_FILES = [".DS_Store"]
+class HashStage(StrEnum):
+    SMALL = "small"
+    SAMPLED = "sampled"
+    FULL = "full"
+
+
+class DuplicateConfirmation(StrEnum):
+    """How candidate duplicates are confirmed, see Utils._report_duplicates."""
+
+    HASH = "hash"
+    COMPARE = "compare"
+
+
+class ManifestSection(StrEnum):
+    """Commands whose processed files are recorded in the manifest."""
+
+    FILE_DATES = "correct-file-dates"
+    FILE_NAMES = "normalize-file-names"
+
+
+class MetadataKind(StrEnum):
+    FILE_TYPE = "file_type"
+    CREATED_DATE = "created_date"
+
+
+TIFF_EXTENSIONS = [FileExtensions.NEF, FileExtensions.TIF, FileExtensions.TIFF]
+VIDEO_EXTENSIONS = [FileExtensions.MOV, FileExtensions.MP4]
+
+EXCLUDED_FILES = [
+    ".DS_Store",
+    RENAME_JOURNAL_NAME,
+    MANIFEST_NAME,
+    MANIFEST_TMP_NAME,
+]
 DEFAULT_HASH_CHUNK_SIZE = 1024
+# Date part of normalized file names
+DATE_NAME_FORMAT = "%Y-%m-%dT%H-%M-%S"
+# Bytes read from the start of each file by organize, enough for the file type,
+# the JPEG Exif segment or the TIFF IFDs, and the small hash
+ORGANIZE_HEADER_SIZE = 64 * 1024
+# Bytes read ahead per file in prefetch mode, same as organize
+HEADER_PREFETCH_SIZE = ORGANIZE_HEADER_SIZE
+# Evenly spaced blocks hashed in the sampled stage, on top of head, middle and tail
+DEFAULT_SAMPLE_BLOCKS = 4
+# How many hashing tasks each worker may have queued ahead of the consumer
+HASH_QUEUE_DEPTH_PER_WORKER = 2
+# Upper bound on the read buffers held by all hashing workers together
+MAX_HASH_BYTES_IN_FLIGHT = 64 * 1024 * 1024
+# Files sent to a metadata worker process per task, to amortize the IPC overhead
+METADATA_BATCH_SIZE = 32
+# How many batches each metadata worker process may have queued ahead
+METADATA_QUEUE_DEPTH_PER_JOB = 2
 
 
 class Utils:
@@ -41,29 +159,116 @@ class Utils:
     Wrapper class for all the utility functions that are used in the CLI.
     """
 
-    def __init__(self, base_dir: str, is_dry_run: bool = False):
+    def __init__(
+        self,
+        base_dir: str,
+        is_dry_run: bool = False,
+        workers: int = 1,
+        cache: MetadataCache | None = None,
+        recursive: bool = False,
+        hash_name: str = DEFAULT_HASH_ALGORITHM,
+        sample_blocks: int | None = DEFAULT_SAMPLE_BLOCKS,
+        sampled_only: bool = False,
+        jobs: int = 1,
+        prefetch: int = 0,
+        prefetch_per_mount: int = DEFAULT_PREFETCH_PER_MOUNT,
+        incremental: bool = False,
+        confirm: DuplicateConfirmation = DuplicateConfirmation.HASH,
+        spill: bool = False,
+        spill_dir: str | None = None,
+        spill_records: int = DEFAULT_SPILL_RECORDS,
+        io_order: IOOrder = IOOrder.LISTING,
+        sidecars: bool = True,
+    ):
         self.base_dir = base_dir
-        register_heif_opener()
+        self.sidecars = sidecars
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.spill_records = max(1, spill_records)
+        self.confirm = DuplicateConfirmation(confirm)
+        self.recursive = recursive
+        self.incremental = incremental
+        # fail early on an unknown algorithm
+        get_hash_factory(hash_name)
+        self.hash_name = hash_name
+        self.sample_blocks = sample_blocks
+        self.sampled_only = sampled_only
+        if self.sampled_only and self.sample_blocks is None:
+            raise ValueError("sampled_only requires the sampled stage to be enabled")
         self.is_dry_run = is_dry_run
+        # AUTO_WORKERS is replaced by a measured number before the first hash
+        self.auto_workers = workers == AUTO_WORKERS
+        self.workers = max(1, workers)
+        self.io_order = IOOrder(io_order)
+        self.jobs = max(1, jobs)
+        if prefetch > 0 and self.jobs > 1:
+            raise ValueError("prefetch can't be combined with more than one job")
+        self.prefetch = max(0, prefetch)
+        self.prefetch_per_mount = max(1, prefetch_per_mount)
+        self.cache = cache
+        # files whose date couldn't be parsed, kept out of the manifest so
+        # incremental runs try them again
+        self._date_failures: set[str] = set()
         self.log = logger.bind(is_dry_run=self.is_dry_run)
+        self.file_log = file_logger.bind(is_dry_run=self.is_dry_run)
         if self.is_dry_run:
             self.log.info("Running in dry-run mode.")
         else:
             self.log.warning("Running in live mode.")
 
-    def get_clean_file_list(self) -> list[str]:
-        """Returns the fully qualified path of all files in the base directory."""
+    def iter_clean_files(self) -> Iterator[FileEntry]:
+        """
+        Lazily yields all files in the base directory (and its sub-directories in
+        recursive mode) along with their stat results.
+
+        Raises ValueError if the base directory is a zip archive, only
+        find_duplicates and extract_archives read those.
+        """
+        if is_archive(self.base_dir):
+            raise ValueError(
+                f"{self.base_dir} is a zip archive, extract it with extract-archive first"
+            )
+        count = 0
         try:
-            all_files = [
-                os.path.join(self.base_dir, x)
-                for x in os.listdir(self.base_dir)
-                if x not in EXCLUDED_FILES
-            ]
-            self.log.info("Found files", count=len(all_files))
-            return all_files
+            for entry in profiler.iterate(
+                STAGE_ENUMERATION,
+                iter_files(self.base_dir, self.recursive, EXCLUDED_FILES),
+            ):
+                count += 1
+                yield entry
         except FileNotFoundError:
             logger.warning("Base path not found", base_dir=self.base_dir)
-            return []
+            return
+        self.log.info("Found files", count=count)
+
+    def _open_manifest(self, section: ManifestSection) -> Manifest | None:
+        """Returns the manifest of the base directory in incremental mode."""
+        if not self.incremental:
+            return None
+        return Manifest(self.base_dir, section)
+
+    def _iter_changed_files(
+        self, manifest: Manifest | None, sidecars: SidecarIndex | None = None
+    ) -> Iterator[FileEntry]:
+        """
+        Like iter_clean_files, but leaves out files the manifest marks as done.
+        With a sidecar index, Takeout sidecars are added to it instead of being
+        yielded.
+        """
+        entries = self.iter_clean_files()
+        if sidecars is not None:
+            entries = sidecars.split(entries)
+        if manifest is None:
+            return entries
+        return manifest.iter_changed(entries)
+
+    def _save_manifest(self, manifest: Manifest | None):
+        if manifest is not None and not self.is_dry_run:
+            manifest.save()
+
+    def get_clean_file_list(self) -> list[str]:
+        """Returns the fully qualified path of all files in the base directory."""
+        return [entry.path for entry in self.iter_clean_files()]
 
     def get_extension(self, q_path: str) -> FileExtensions:
         """Given a qualified path of a file, this returns the extension of the file."""
@@ -74,72 +279,110 @@ class Utils:
         """Given a qualified path of a file, this returns everything but the extension."""
         return os.path.splitext(q_path)[0]
 
-    def get_file_type(self, q_path: str) -> FileExtensions:
+    def _cache_stat(
+        self, q_path: str, st: os.stat_result | None = None
+    ) -> os.stat_result | None:
+        """
+        Returns the stat result used to key the cache, or None if caching is off.
+        A stat result the caller already has is reused instead of stat'ing again.
+        """
+        if self.cache is None or st is not None:
+            return st
+        try:
+            return os.stat(q_path)
+        except OSError:
+            return None
+
+    def get_file_type(
+        self,
+        q_path: str,
+        st: os.stat_result | None = None,
+        header: bytes | None = None,
+    ) -> FileExtensions:
         """
         Given a qualified path of a file, this returns the best guess actual
-        file type extension based on the header data.
+        file type extension based on the header data. The header can be passed in
+        if it was already read.
         """
-        guessed_ext = filetype.guess(q_path)
+        st = self._cache_stat(q_path, st)
+        if self.cache is not None and st is not None:
+            cached_type = self.cache.get_file_type(st)
+            if cached_type is not None:
+                return FileExtensions(cached_type)
+
+        file_type = self._guess_file_type(q_path, header)
+        if self.cache is not None and st is not None:
+            self.cache.set_file_type(q_path, st, file_type)
+        return file_type
+
+    @profiled(STAGE_SNIFFING)
+    def _guess_file_type(
+        self, q_path: str, header: bytes | None = None
+    ) -> FileExtensions:
+        import filetype
+
+        guessed_ext = filetype.guess(header if header is not None else q_path)
         if guessed_ext and guessed_ext.extension:
             return FileExtensions(str(guessed_ext.extension).lower())
 
         self.log.debug("Failed to guess file type", q_path=q_path)
         return self.get_extension(q_path)
 
+    @profiled(STAGE_RENAME_UTIME)
     def _rename(self, src: str, dst: str):
         """
         Renames a file from src to dst. If dry-run mode is enabled, it will log instead
         """
         if self.is_dry_run:
-            self.log.info("[DRY RUN] Renamed", src=src, dst=dst)
+            self.file_log.info("[DRY RUN] Renamed", src=src, dst=dst)
             return
-        self.log.info("Renamed", src=src, dst=dst)
+        self.file_log.info("Renamed", src=src, dst=dst)
         os.rename(src, dst)
 
+    @profiled(STAGE_RENAME_UTIME)
     def _utime(
         self,
         path: str,
         times: tuple[int, int] | tuple[float, float] | None = None,
+        st: os.stat_result | None = None,
     ):
         """
         Wrap the os.utime function to allow for dry-run mode.
         """
-        time = (
-            datetime.fromtimestamp(times[0]).strftime("%Y-%m-%d %H:%M:%S")
-            if times is not None
-            else None
-        )
+        st = self._cache_stat(path, st)
+        # formatted only if the event is printed or written
+        time = Timestamp(times[0]) if times is not None else None
         if self.is_dry_run:
-            self.log.info(
+            self.file_log.info(
                 "[DRY RUN] Updating time",
                 time=time,
                 path=path,
             )
             return
-        self.log.info(
+        self.file_log.info(
             "Updating time",
             path=path,
             time=time,
         )
         os.utime(path, times)
+        if self.cache is not None and st is not None:
+            # only the mtime changed, so the cached metadata is still valid
+            self.cache.refresh(path, st)
 
     def make_ext_lowercase(self, file: str):
         curr_ext = self.get_extension(file)
         if curr_ext == os.path.splitext(file)[1].replace(".", ""):
             return
 
-        self._rename(
-            file,
-            os.path.join(self.base_dir, f"{self.strip_extension(file)}.{curr_ext}"),
-        )
+        self._rename(file, f"{self.strip_extension(file)}.{curr_ext}")
 
     def correct_file_types(self):
         """
         Corrects the file extensions based on the actual file type from the header data.
         If dry-run mode is enabled, it will log instead.
         """
-        for file in self.get_clean_file_list():
-            real_ext = self.get_file_type(file)
+        for entry, real_ext in self._iter_file_types(self.iter_clean_files()):
+            file = entry.path
             curr_ext = self.get_extension(file)
 
             if curr_ext == FileExtensions.NEF or curr_ext == FileExtensions.MOV:
@@ -149,34 +392,27 @@ class Utils:
                 continue
 
             if real_ext != curr_ext:
-                self._rename(
-                    file,
-                    os.path.join(
-                        self.base_dir, f"{self.strip_extension(file)}.{real_ext}"
-                    ),
-                )
+                self._rename(file, f"{self.strip_extension(file)}.{real_ext}")
             else:
                 self.make_ext_lowercase(file)
 
     def get_datetime_from_image_xml(
         self,
-        parsed_file_data: ImageFile.ImageFile,
+        parsed_file_data: "ImageFile.ImageFile",
     ) -> datetime | None:
         """
         Attempts to parse image metadata XML to find a created datetime.
         If it cannot find one, it returns None.
         """
-        xml_data = parsed_file_data.info["xmp"].decode("utf-8")
-        start_index = xml_data.find("<photoshop:DateCreated>")
-        end_index = xml_data.find("</photoshop:DateCreated>")
-
-        if start_index == -1 or end_index == -1:
+        if "xmp" not in parsed_file_data.info:
             return None
-        return datetime.fromisoformat(xml_data[start_index + 23 : end_index])
+        return parse_xmp_datetime(parsed_file_data.info["xmp"])
 
     def get_file_created_date(
         self,
         q_path: str,
+        st: os.stat_result | None = None,
+        reader: HeaderReader | None = None,
     ) -> datetime | None:
         """
         First gets the EXIF data from the file. If there is EXIF data
@@ -186,60 +422,344 @@ class Utils:
         then it falls back to format specific parsing.
 
         If that fails it returns None
-        """
-        try:
-            if (
-                self.get_extension(q_path) == FileExtensions.MOV
-                or self.get_extension(q_path) == FileExtensions.MP4
-            ):
-                return get_isobmff_timestamp(q_path)
 
-            parsed_file_data = PILImage.open(q_path)
-
-            exif_data_dict = {
-                ExifTags.TAGS[k]: v
-                for k, v in parsed_file_data.getexif().items()
-                if k in ExifTags.TAGS and type(v) is not bytes
-            }
-
-            if "DateTime" in exif_data_dict:
-                return datetime.strptime(
-                    exif_data_dict["DateTime"], "%Y:%m:%d %H:%M:%S"
-                )
+        An open reader over the file can be passed in so the format specific
+        parsers reuse its prefetched header.
+        """
+        st = self._cache_stat(q_path, st)
+        if self.cache is not None and st is not None:
+            found, created_date = self.cache.get_created_date(st)
+            if found:
+                return created_date
 
-            return self.get_datetime_from_image_xml(parsed_file_data)
+        try:
+            created_date = self._parse_file_created_date(q_path, reader)
         except Exception as e:
             self.log.warning(
                 "Failed to parse image metadata for datetime", q_path=q_path, e=e
             )
+            self._date_failures.add(q_path)
             return None
 
+        if self.cache is not None and st is not None:
+            self.cache.set_created_date(q_path, st, created_date)
+        return created_date
+
+    @profiled(STAGE_METADATA)
+    def _parse_file_created_date(
+        self,
+        q_path: str,
+        reader: HeaderReader | None = None,
+        image_file: IO[bytes] | None = None,
+    ) -> datetime | None:
+        """
+        Reads the created date from the file contents, see get_file_created_date.
+        With an image_file, Pillow decodes that instead of opening q_path, e.g.
+        for zip members, whose names aren't paths on disk.
+        """
+        ext = self.get_extension(q_path)
+        if ext == FileExtensions.MOV or ext == FileExtensions.MP4:
+            return get_isobmff_timestamp(q_path, reader)
+
+        if ext == FileExtensions.JPG or ext == FileExtensions.JPEG:
+            # fast path that only reads the Exif and XMP segments; its answer is
+            # final unless the file turns out not to be a JPEG
+            try:
+                return get_jpg_timestamp(q_path, reader)
+            except ValueError as e:
+                self.log.debug("Failed to parse JPEG segments", q_path=q_path, e=e)
+
+        if ext == FileExtensions.HEIC:
+            # fast path that reads the Exif and XMP items without decoding the image
+            try:
+                return get_heic_timestamp(q_path, reader)
+            except ValueError as e:
+                self.log.debug("Failed to parse HEIC boxes", q_path=q_path, e=e)
+
+        if ext in TIFF_EXTENSIONS:
+            # fast path that only reads the IFDs holding the date tags and XMP
+            try:
+                return get_tiff_timestamp(q_path, reader)
+            except ValueError as e:
+                self.log.debug("Failed to parse TIFF header", q_path=q_path, e=e)
+
+        if image_file is not None:
+            image_file.seek(0)
+        parsed_file_data = open_image(q_path if image_file is None else image_file)
+
+        exif = parsed_file_data.getexif()
+        created_date = pick_exif_datetime(exif, exif.get_ifd(TAG_EXIF_IFD))
+        if created_date is not None:
+            return created_date
+
+        return self.get_datetime_from_image_xml(parsed_file_data)
+
+    def _iter_file_types(
+        self, entries: Iterable[FileEntry]
+    ) -> Iterator[tuple[FileEntry, FileExtensions]]:
+        """Yields every entry along with its file type, see _iter_metadata."""
+        for entry, file_type in self._iter_metadata(entries, MetadataKind.FILE_TYPE):
+            yield entry, FileExtensions(file_type)
+
+    def _iter_parsed_dates(
+        self, entries: Iterable[FileEntry]
+    ) -> Iterator[tuple[FileEntry, datetime | None]]:
+        """Yields every entry along with its created date, see _iter_metadata."""
+        for entry, created_date in self._iter_metadata(
+            entries, MetadataKind.CREATED_DATE
+        ):
+            yield entry, created_date if isinstance(created_date, datetime) else None
+
+    def _iter_created_dates(
+        self, entries: Iterable[FileEntry], sidecars: SidecarIndex | None = None
+    ) -> Iterator[tuple[FileEntry, datetime | None]]:
+        """
+        Yields every entry along with its created date, see _iter_parsed_dates.
+        Entries with a Takeout sidecar in the index get the date taken from it
+        and their media file is never opened. They are yielded as soon as they
+        are reached, so the order of entries isn't kept.
+        """
+        if sidecars is None:
+            yield from self._iter_parsed_dates(entries)
+            return
+
+        index = sidecars
+        dated: deque[tuple[FileEntry, datetime]] = deque()
+
+        def without_sidecar() -> Iterator[FileEntry]:
+            for entry in entries:
+                taken_time = index.taken_time(entry.path)
+                if taken_time is None:
+                    yield entry
+                else:
+                    dated.append((entry, taken_time))
+
+        count = 0
+        for item in self._iter_parsed_dates(without_sidecar()):
+            count += len(dated)
+            while dated:
+                yield dated.popleft()
+            yield item
+        count += len(dated)
+        yield from dated
+        if count:
+            self.log.info("Dated from sidecars", count=count)
+
+    def _iter_metadata(
+        self, entries: Iterable[FileEntry], kind: MetadataKind
+    ) -> Iterator[tuple[FileEntry, FileExtensions | datetime | None]]:
+        """
+        Yields every entry along with its file type or created date, in input
+        order. With more than one job, cache misses are parsed in batches by a
+        pool of worker processes while the caller applies the results of earlier
+        batches, so side effects still happen in the parent in a fixed order.
+
+        With an I/O order other than the listing, the files are read in that
+        order, but nothing is yielded until all of them are parsed, so results
+        still come in input order.
+        """
+        if self.io_order == IOOrder.LISTING:
+            yield from self._parse_metadata(entries, kind)
+            return
+        listed = list(entries)
+        order = self._io_order(
+            listed, lambda entry: self._get_cached_metadata(entry, kind)[0]
+        )
+        values: list[FileExtensions | datetime | None] = [None] * len(listed)
+        parsed = self._parse_metadata((listed[k] for k in order), kind)
+        for k, (_, value) in zip(order, parsed):
+            values[k] = value
+        yield from zip(listed, values)
+
+    def _parse_metadata(
+        self, entries: Iterable[FileEntry], kind: MetadataKind
+    ) -> Iterator[tuple[FileEntry, FileExtensions | datetime | None]]:
+        """Like _iter_metadata, but reads the files in input order."""
+        if self.prefetch > 0:
+            yield from self._iter_prefetched_metadata(entries, kind)
+            return
+        if self.jobs == 1:
+            for entry in entries:
+                if kind == MetadataKind.FILE_TYPE:
+                    yield entry, self.get_file_type(entry.path, entry.stat)
+                else:
+                    yield entry, self.get_file_created_date(entry.path, entry.stat)
+            return
+
+        # multiprocessing is only imported by runs that use it
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=_init_metadata_worker,
+            initargs=(self.base_dir,),
+        ) as executor:
+            pending: deque[
+                tuple[
+                    list[FileEntry], dict[int, FileExtensions | datetime | None], Future
+                ]
+            ] = deque()
+            batch: list[FileEntry] = []
+
+            def submit(batch_entries: list[FileEntry]):
+                # the cache is only used from this thread, workers just parse files
+                cached = {}
+                misses = []
+                for i, entry in enumerate(batch_entries):
+                    found, value = self._get_cached_metadata(entry, kind)
+                    if found:
+                        cached[i] = value
+                    else:
+                        misses.append(entry.path)
+                future = executor.submit(_extract_metadata_batch, misses, kind)
+                pending.append((batch_entries, cached, future))
+
+            def drain() -> Iterator[tuple[FileEntry, FileExtensions | datetime | None]]:
+                batch_entries, cached, future = pending.popleft()
+                results = iter(future.result())
+                for i, entry in enumerate(batch_entries):
+                    if i in cached:
+                        yield entry, cached[i]
+                        continue
+                    value, error = next(results)
+                    if error is None:
+                        self._set_cached_metadata(entry, kind, value)
+                    elif kind == MetadataKind.FILE_TYPE:
+                        raise ValueError(error)
+                    else:
+                        self.log.warning(
+                            "Failed to parse image metadata for datetime",
+                            q_path=entry.path,
+                            e=error,
+                        )
+                        self._date_failures.add(entry.path)
+                    yield entry, value
+
+            for entry in entries:
+                batch.append(entry)
+                if len(batch) < METADATA_BATCH_SIZE:
+                    continue
+                submit(batch)
+                batch = []
+                if len(pending) >= self.jobs * METADATA_QUEUE_DEPTH_PER_JOB:
+                    yield from drain()
+            if batch:
+                submit(batch)
+            while pending:
+                yield from drain()
+
+    def _iter_prefetched_metadata(
+        self, entries: Iterable[FileEntry], kind: MetadataKind
+    ) -> Iterator[tuple[FileEntry, FileExtensions | datetime | None]]:
+        """
+        Like the single job mode of _iter_metadata, but the headers of the next
+        self.prefetch files are read in the background while earlier ones are
+        parsed, see lib.prefetch.iter_prefetched.
+        """
+        for entry, header in iter_prefetched(
+            entries,
+            HEADER_PREFETCH_SIZE,
+            self.prefetch,
+            self.prefetch_per_mount,
+            skip=lambda entry: self._get_cached_metadata(entry, kind)[0],
+        ):
+            if not isinstance(header, bytes):
+                # cached, or the read failed and the parser reports it as usual
+                if kind == MetadataKind.FILE_TYPE:
+                    yield entry, self.get_file_type(entry.path, entry.stat)
+                else:
+                    yield entry, self.get_file_created_date(entry.path, entry.stat)
+                continue
+            if kind == MetadataKind.FILE_TYPE:
+                yield entry, self.get_file_type(entry.path, entry.stat, header)
+                continue
+            reader = PrefetchedReader(entry.path, header, entry.stat.st_size)
+            try:
+                created_date = self.get_file_created_date(
+                    entry.path, entry.stat, reader
+                )
+            finally:
+                reader.close()
+            yield entry, created_date
+
+    def _get_cached_metadata(
+        self, entry: FileEntry, kind: MetadataKind
+    ) -> tuple[bool, FileExtensions | datetime | None]:
+        if self.cache is None:
+            return False, None
+        if kind == MetadataKind.FILE_TYPE:
+            cached_type = self.cache.get_file_type(entry.stat)
+            if cached_type is None:
+                return False, None
+            return True, FileExtensions(cached_type)
+        return self.cache.get_created_date(entry.stat)
+
+    def _set_cached_metadata(
+        self,
+        entry: FileEntry,
+        kind: MetadataKind,
+        value: FileExtensions | datetime | None,
+    ):
+        if self.cache is None:
+            return
+        if kind == MetadataKind.FILE_TYPE and isinstance(value, FileExtensions):
+            self.cache.set_file_type(entry.path, entry.stat, value)
+        elif kind == MetadataKind.CREATED_DATE and not isinstance(
+            value, FileExtensions
+        ):
+            self.cache.set_created_date(entry.path, entry.stat, value)
+
     def update_dates_from_metadata(self):
-        """Update the file created date based on the metadata."""
-        for q_path in self.get_clean_file_list():
-            parsed_datetime = self.get_file_created_date(q_path)
-            creation_time = os.path.getmtime(q_path)
+        """
+        Update the file created date based on the metadata, or on the photo
+        taken time of Google Takeout sidecars where there are any, see
+        lib.takeout.
+
+        In incremental mode only files that are new or changed since the last
+        run are parsed, see lib.manifest. Files whose date couldn't be parsed
+        are tried again on the next run.
+        """
+        manifest = self._open_manifest(ManifestSection.FILE_DATES)
+        # sidecars are never media files, even when their dates aren't used
+        sidecars = SidecarIndex()
+        for entry, parsed_datetime in self._iter_created_dates(
+            self._iter_changed_files(manifest, sidecars),
+            sidecars if self.sidecars else None,
+        ):
+            q_path = entry.path
+            creation_time = entry.stat.st_mtime
             ext = self.get_extension(q_path=q_path)
 
+            if q_path in self._date_failures:
+                self._date_failures.discard(q_path)
+                continue
             if parsed_datetime is None or parsed_datetime == datetime.fromtimestamp(
                 creation_time
             ):
+                if manifest is not None:
+                    manifest.record(q_path, "unchanged", entry.stat)
                 continue
 
             try:
                 correct_file_name = self.build_file_datestring(parsed_datetime, ext)
                 if correct_file_name in q_path.split("/")[-1].split("R")[0]:
+                    if manifest is not None:
+                        manifest.record(q_path, "unchanged", entry.stat)
                     continue
 
                 unixtime = time.mktime(parsed_datetime.timetuple())
 
-                self._utime(q_path, (unixtime, unixtime))
+                self._utime(q_path, (unixtime, unixtime), entry.stat)
+                if manifest is not None and not self.is_dry_run:
+                    # the new mtime is what the next run will see
+                    manifest.record(q_path, "updated")
             except Exception:
                 self.log.warning("Failed to update", q_path=q_path)
                 continue
+        self._save_manifest(manifest)
 
     def build_file_datestring(
-        self, dt: datetime, ext: str, prevent_duplicates: bool = True
+        self, dt: datetime, ext: str, sequence: int | None = None
     ) -> str:
         """
         Given a datetime and an extension, this returns a formatted string in the standard
@@ -248,124 +768,927 @@ class Utils:
         This format is as follows:
         YYYY-MM-DDTHH-MM-SSRXXXX.EXT
 
-        In which XXXX is a random number between 1000 and 9999 to avoid name clashes
+        In which XXXX is a sequence number that tells apart files with the same
+        date, see lib.rename.plan_renames. Without a sequence it's left out.
         """
-        formatted_date = dt.strftime("%Y-%m-%dT%H-%M-%S")
-        normalized_ext = ext.lower()
-        if not prevent_duplicates:
-            return f"{formatted_date}.{normalized_ext}"
-        return f"{formatted_date}R{random.randint(1000, 9999)}.{normalized_ext}"
+        return build_name(dt.strftime(DATE_NAME_FORMAT), ext.lower(), sequence)
 
     def convert_names_to_dates(self, prevent_duplicates: bool):
         """
         Normalizes filenames in the standard format based on
         the created date for the file
+
+        All new names are planned before the first rename, see _apply_renames.
+        In incremental mode only files that are new or changed since the last
+        run are renamed, see lib.manifest.
         """
-        for q_path in self.get_clean_file_list():
-            dt = datetime.fromtimestamp(os.path.getmtime(q_path))
-            ext = self.get_extension(q_path)
-            new_path = os.path.join(
-                self.base_dir,
-                self.build_file_datestring(dt, ext, prevent_duplicates),
+        if not self.is_dry_run:
+            check_finished(get_journal_path(self.base_dir))
+        manifest = self._open_manifest(ManifestSection.FILE_NAMES)
+        entries = list(self._iter_changed_files(manifest))
+        requests = [
+            RenameRequest(
+                entry.path,
+                datetime.fromtimestamp(entry.stat.st_mtime).strftime(DATE_NAME_FORMAT),
+                self.get_extension(entry.path),
             )
+            for entry in entries
+        ]
+        renamed = self._apply_renames(requests, prevent_duplicates)
+        if manifest is None or self.is_dry_run:
+            return
 
-            # If the file already has the correct name, skip it
-            if q_path.split("R")[0] == new_path.split("R")[0]:
-                continue
+        for entry, request in zip(entries, requests):
+            new_path = renamed.get(entry.path, entry.path)
+            if new_path != entry.path:
+                manifest.move(entry.path, new_path)
+            # conflicts and failed renames are retried by the next run
+            if has_target_name(
+                os.path.basename(new_path),
+                request.stem,
+                request.ext,
+                prevent_duplicates,
+            ):
+                # renaming keeps the stat result apart from ctime
+                manifest.record(
+                    new_path,
+                    "renamed" if new_path != entry.path else "unchanged",
+                    entry.stat,
+                )
+        manifest.save()
+
+    def _apply_renames(
+        self, requests: list[RenameRequest], prevent_duplicates: bool
+    ) -> dict[str, str]:
+        """
+        Plans the new names of all files at once, with deterministic sequence
+        suffixes, then applies the plan through the rename journal so that an
+        interrupted run can be resumed or rolled back.
 
-            self._rename(
-                q_path,
-                new_path,
+        Returns: a dictionary mapping the old path of each renamed file to its
+        new path (empty in dry-run mode)
+        """
+        plan, conflicts = plan_renames(self.base_dir, requests, prevent_duplicates)
+        for request in conflicts:
+            self.log.warning(
+                "Name already taken",
+                q_path=request.path,
+                name=build_name(request.stem, request.ext),
             )
+        if self.is_dry_run:
+            for rename in plan:
+                dir_path = os.path.normpath(os.path.join(self.base_dir, rename.dir))
+                self._rename(
+                    os.path.join(dir_path, rename.src),
+                    os.path.join(dir_path, rename.dst),
+                )
+            return {}
+        if not plan:
+            # keep the journal of the last run that renamed something
+            return {}
 
-    def _read_chunks(
-        self, file_obj: BufferedReader, chunk_size_bytes: int = DEFAULT_HASH_CHUNK_SIZE
-    ):
-        """Generator that reads a file in chunks of bytes"""
-        while True:
-            chunk = file_obj.read(chunk_size_bytes)
-            if not chunk:
-                return
-            yield chunk
+        journal_path = get_journal_path(self.base_dir)
+        write_plan(journal_path, self.base_dir, plan)
+        # the journal holds absolute paths, callers know files by their listed path
+        abs_base_dir = os.path.abspath(self.base_dir)
+        return {
+            os.path.join(
+                self.base_dir, os.path.relpath(old, abs_base_dir)
+            ): os.path.join(self.base_dir, os.path.relpath(new, abs_base_dir))
+            for old, new in apply_plan(journal_path)
+        }
+
+    def resume_renames(self):
+        """Applies the rest of the renames of an interrupted run."""
+        journal_path = get_journal_path(self.base_dir)
+        state = read_journal(journal_path)
+        if not is_unfinished(state):
+            self.log.info("No unfinished renames", journal=journal_path)
+            return
+        assert state is not None
+        if self.is_dry_run:
+            for i, rename in enumerate(state.plan):
+                if i not in state.done:
+                    dir_path = os.path.join(state.base_dir, rename.dir)
+                    self._rename(
+                        os.path.join(dir_path, rename.src),
+                        os.path.join(dir_path, rename.dst),
+                    )
+            return
+        apply_plan(journal_path)
+
+    def rollback_renames(self):
+        """Renames the files of the last (finished or interrupted) run back."""
+        journal_path = get_journal_path(self.base_dir)
+        state = read_journal(journal_path)
+        if state is None or state.rolled_back:
+            self.log.info("No renames to roll back", journal=journal_path)
+            return
+        if self.is_dry_run:
+            for i in sorted(state.done, reverse=True):
+                rename = state.plan[i]
+                dir_path = os.path.join(state.base_dir, rename.dir)
+                self._rename(
+                    os.path.join(dir_path, rename.dst),
+                    os.path.join(dir_path, rename.src),
+                )
+            return
+        count = rollback_plan(journal_path)
+        self.log.info("Rolled back renames", count=count)
 
     def _get_hash(self, filename: str, first_chunk_only: bool = False) -> bytes:
         """
-        Given a file path, return the hash of the file.
-        Optionally only hash the first chunk of the file.
+        Given a file path, return the hash of the file using the configured
+        algorithm. Optionally only hash the first chunk of the file.
         """
-        hashobj = hashlib.sha1()
-        with open(filename, "rb") as f:
-            if first_chunk_only:
-                hashobj.update(f.read(DEFAULT_HASH_CHUNK_SIZE))
-            else:
-                for chunk in self._read_chunks(f):
-                    hashobj.update(chunk)
-        return hashobj.digest()
+        if first_chunk_only:
+            return hash_file_head(filename, self.hash_name, DEFAULT_HASH_CHUNK_SIZE)
+        return hash_file(
+            filename,
+            self.hash_name,
+            max_read_size=MAX_HASH_BYTES_IN_FLIGHT // self.workers,
+        )
+
+    def _get_sample_hash(self, filename: str) -> bytes:
+        """
+        Given a file path, return the hash of a few blocks sampled from the head,
+        middle and tail of the file.
+        """
+        return hash_file_samples(filename, self.hash_name, self.sample_blocks or 0)
+
+    @profiled(STAGE_HASHING)
+    def _hash_stage(self, filename: str, stage: HashStage) -> bytes:
+        if stage == HashStage.SAMPLED:
+            return self._get_sample_hash(filename)
+        return self._get_hash(filename, first_chunk_only=stage == HashStage.SMALL)
+
+    def _hash_many(
+        self, entries: Iterable[FileEntry], stage: HashStage
+    ) -> Iterator[tuple[FileEntry, bytes]]:
+        """
+        Hashes every file entry and yields (entry, hash) pairs in input order.
+        Files that can't be read are skipped. Hashes are read from and written to
+        the cache, if there is one, on the calling thread.
+
+        With more than one worker the hashing runs on a thread pool. Only a bounded
+        window of tasks is queued, and the read size of each worker is capped so
+        at most MAX_HASH_BYTES_IN_FLIGHT bytes are buffered at any time.
+        """
+        if self.auto_workers:
+            entries = iter(entries)
+            sample = list(islice(entries, TUNE_SAMPLE_FILES))
+            self.workers = tune_workers([entry.path for entry in sample])
+            self.auto_workers = False
+            entries = chain(sample, entries)
+
+        kind = self._hash_kind(stage)
+        max_pending = self.workers * HASH_QUEUE_DEPTH_PER_WORKER
+        pending: deque[tuple[FileEntry, Future[bytes] | bytes]] = deque()
+
+        def drain(keep: int) -> Iterator[tuple[FileEntry, bytes]]:
+            while len(pending) > keep:
+                entry, result = pending.popleft()
+                if isinstance(result, bytes):
+                    yield entry, result
+                    continue
+                try:
+                    digest = result.result()
+                except OSError:
+                    # the file access might've changed till the exec point got here
+                    continue
+                if self.cache is not None:
+                    self.cache.set_hash(entry.path, entry.stat, kind, digest)
+                yield entry, digest
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for entry in entries:
+                cached = (
+                    self.cache.get_hash(entry.stat, kind)
+                    if self.cache is not None
+                    else None
+                )
+                if cached is not None:
+                    pending.append((entry, cached))
+                elif self.workers == 1:
+                    future: Future[bytes] = Future()
+                    try:
+                        future.set_result(self._hash_stage(entry.path, stage))
+                    except OSError as e:
+                        future.set_exception(e)
+                    pending.append((entry, future))
+                else:
+                    future = pool.submit(self._hash_stage, entry.path, stage)
+                    pending.append((entry, future))
+                yield from drain(max_pending - 1)
+            yield from drain(0)
 
     def find_duplicates(self) -> DuplicateFileMap:
         """
         Finds files that are duplicates by hashing their contents
 
         Returns: a dictionary mapping a file size to a list
-        of files names that have that size
+        of files names that have that size (empty in spill mode, see
+        _find_duplicates_spilled)
         """
-        paths = self.get_clean_file_list()
-        files_by_size: defaultdict[int, list[str]] = defaultdict(list)
-        files_by_small_hash: defaultdict[tuple[int, bytes], list[str]] = defaultdict(
-            list
-        )
-        files_by_full_hash: dict[bytes, str] = dict()
+        if is_archive(self.base_dir):
+            return self._find_archive_duplicates()
+        self._warn_if_sampled_only()
+        if self.spill:
+            self._find_duplicates_spilled()
+            return {}
 
-        for path in paths:
-            full_path = path
-            try:
-                # if the target is a symlink (soft one), this will
-                # dereference it - change the value to the actual target file
-                full_path = os.path.realpath(full_path)
-                file_size = os.path.getsize(full_path)
-            except OSError:
-                # not accessible (permissions, etc) - pass on
-                self.log.warning("Insufficient permissions", path=full_path)
-                continue
-            files_by_size[file_size].append(full_path)
+        records = FileRecords()
+        for entry in self.iter_clean_files():
+            path = entry.path
+            if entry.is_symlink:
+                # if the target is a symlink (soft one), dereference it - change
+                # the value to the actual target file
+                path = os.path.realpath(entry.path)
+            records.append(path, entry.stat)
 
         # For all files with the same file size, get their hash on the first 1024 bytes
-        for file_size, files in files_by_size.items():
-            if len(files) < 2:
-                continue  # this file size is unique, no need to spend cpu cycles on it
+        # (unique file sizes are skipped, no need to spend cpu cycles on them)
+        size_groups = records.group([SIZE])
+        for i, small_hash in self._hash_records(
+            records, size_groups.indices, HashStage.SMALL
+        ):
+            records.set_digest(HashStage.SMALL, i, small_hash)
+        self._report_duplicates(records, records.group([SIZE, HashStage.SMALL]))
+
+        return _names_by_size(records, size_groups)
+
+    def _find_duplicates_spilled(self):
+        """
+        find_duplicates for libraries whose file list doesn't fit in memory.
+        (size, path) records and then (size, small hash, path) records of the
+        candidates go to sorted runs on disk (see lib.external), and each stage
+        streams the groups out of the merged runs. Groups that share a small
+        hash are confirmed as usual, a bounded batch at a time.
+        """
+        by_size = ExternalSorter(self.spill_dir, self.spill_records)
+        by_small_hash = ExternalSorter(self.spill_dir, self.spill_records)
+        # records carry their listing position, so groups keep the file order
+        # find_duplicates reports in memory
+        with by_size, by_small_hash:
+            for position, entry in enumerate(self.iter_clean_files()):
+                path = entry.path
+                if entry.is_symlink:
+                    path = os.path.realpath(entry.path)
+                st = entry.stat
+                by_size.add(
+                    (st.st_size, position, path, st.st_dev, st.st_ino, st.st_mtime_ns)
+                )
+
+            # unique sizes are skipped, like in find_duplicates
+            candidates = (
+                (position, FileEntry(path, make_stat(device, inode, size, mtime_ns)))
+                for group in iter_groups(by_size.sorted(), 1)
+                for size, position, path, device, inode, mtime_ns in group
+            )
+            for position, entry, small_hash in self._hash_numbered(
+                candidates, HashStage.SMALL
+            ):
+                st = entry.stat
+                by_small_hash.add(
+                    (
+                        st.st_size,
+                        small_hash,
+                        position,
+                        entry.path,
+                        st.st_dev,
+                        st.st_ino,
+                        st.st_mtime_ns,
+                    )
+                )
+            self.log.debug(
+                "Spilled sorted runs",
+                size_runs=by_size.run_count,
+                small_hash_runs=by_small_hash.run_count,
+            )
+
+            records = FileRecords()
+            for group in iter_groups(by_small_hash.sorted(), 2):
+                for size, small_hash, _, path, device, inode, mtime_ns in group:
+                    i = records.append(path, make_stat(device, inode, size, mtime_ns))
+                    records.set_digest(HashStage.SMALL, i, small_hash)
+                if len(records) >= self.spill_records:
+                    self._report_duplicates(
+                        records, records.group([SIZE, HashStage.SMALL])
+                    )
+                    records = FileRecords()
+            self._report_duplicates(records, records.group([SIZE, HashStage.SMALL]))
+
+    def _warn_if_sampled_only(self):
+        if self.sampled_only:
+            self.log.warning(
+                "Sampled-only mode: duplicates are probable, not verified by a full hash"
+            )
+
+    def _find_archive_duplicates(self) -> DuplicateFileMap:
+        """
+        find_duplicates for a zip archive, reading the members in place. See
+        _archive_duplicates, the hash stages and spill mode don't apply.
+        """
+        with Archives([self.base_dir]) as archives:
+            members = archives.members()
+            self.log.info("Found files", count=len(members))
+            for group in self._archive_duplicates(archives, members):
+                for member in group[1:]:
+                    self.log.info(
+                        "Duplicate found",
+                        filename=archives.path(member),
+                        duplicate=archives.path(group[0]),
+                    )
+        names_by_size: defaultdict[int, list[str]] = defaultdict(list)
+        for member in members:
+            names_by_size[member.size].append(os.path.basename(member.name))
+        return {
+            size: sorted(names)
+            for size, names in names_by_size.items()
+            if len(names) > 1
+        }
+
+    def _archive_duplicates(
+        self, archives: Archives, members: list[ArchiveMember]
+    ) -> list[list[ArchiveMember]]:
+        """
+        Returns the groups of identical members, in the order of members.
+        Only members that share their size and CRC32 with another one are
+        candidates (see lib.archive.group_by_crc), and those are confirmed by
+        hashing their contents, read in the order they are stored in. Members
+        that can't be read are left out.
+        """
+        candidates = group_by_crc(members)
+        digests: dict[tuple[int, int], bytes] = {}
+        for member in sorted(
+            chain.from_iterable(candidates),
+            key=lambda m: (m.archive, m.info.header_offset),
+        ):
+            key = (member.archive, member.info.header_offset)
+            try:
+                digests[key] = archives.hash(member, self.hash_name)
+            except (OSError, zipfile.BadZipFile) as e:
+                self.log.warning(
+                    "Failed to read archive member", q_path=archives.path(member), e=e
+                )
+
+        groups: list[list[ArchiveMember]] = []
+        for candidate_group in candidates:
+            by_digest: dict[bytes, list[ArchiveMember]] = {}
+            for member in candidate_group:
+                digest = digests.get((member.archive, member.info.header_offset))
+                if digest is not None:
+                    by_digest.setdefault(digest, []).append(member)
+            groups += [group for group in by_digest.values() if len(group) > 1]
+        return groups
+
+    def extract_archives(self, archive_paths: list[str]) -> int:
+        """
+        Extracts the media files of zip archives, e.g. the parts of a Google
+        Takeout export, into the base directory, without extracting the
+        archives first:
+        - duplicates are found across all archives like find_duplicates does,
+          and only the first copy is extracted
+        - files are named YYYY-MM-DDTHH-MM-SSRXXXX.ext after their date, see
+          convert_names_to_dates, and get it as their modification time
+        - the date comes from the Takeout sidecar, wherever in the archives it
+          is, or else from the metadata in the member's first bytes
+        - the extension comes from the file type sniffed from those bytes
+
+        Files without a date keep their name. Sidecars and files of unknown
+        types aren't extracted. Returns the number of files extracted.
+        """
+        with Archives(archive_paths) as archives:
+            sidecars = SidecarIndex(archives.open_name)
+            media: list[ArchiveMember] = []
+            for member in archives.members():
+                if is_sidecar(member.name):
+                    sidecars.add(member.name)
+                else:
+                    media.append(member)
+            self.log.info("Found files", count=len(media), sidecars=len(sidecars))
+
+            skipped: set[tuple[int, int]] = set()
+            for group in self._archive_duplicates(archives, media):
+                for member in group[1:]:
+                    skipped.add((member.archive, member.info.header_offset))
+                    self.log.info(
+                        "Duplicate found",
+                        filename=archives.path(member),
+                        duplicate=archives.path(group[0]),
+                    )
 
-            for filename in files:
+            if not self.is_dry_run:
+                os.makedirs(self.base_dir, exist_ok=True)
+            taken = (
+                set(os.listdir(self.base_dir))
+                if os.path.isdir(self.base_dir)
+                else set()
+            )
+            count = 0
+            for member in media:
+                if (member.archive, member.info.header_offset) in skipped:
+                    continue
                 try:
-                    small_hash = self._get_hash(filename, first_chunk_only=True)
-                except OSError:
-                    # the file access might've changed till the exec point got here
+                    extracted = self._extract_member(archives, member, sidecars, taken)
+                except (OSError, zipfile.BadZipFile) as e:
+                    self.log.warning(
+                        "Failed to extract", q_path=archives.path(member), e=e
+                    )
                     continue
-                files_by_small_hash[(file_size, small_hash)].append(filename)
+                count += extracted
+        self.log.info("Extracted files", count=count, skipped_duplicates=len(skipped))
+        return count
 
-        # For all files with the hash on the first 1024 bytes, get their hash on the full
-        # file - collisions will be duplicates
-        for files in files_by_small_hash.values():
-            if len(files) < 2:
-                # the hash of the first 1k bytes is unique -> skip this file
-                continue
+    def _extract_member(
+        self,
+        archives: Archives,
+        member: ArchiveMember,
+        sidecars: SidecarIndex,
+        taken: set[str],
+    ) -> bool:
+        """
+        Extracts one member under its new name, see extract_archives. Names
+        that get used are added to taken. Returns False for files of unknown
+        types.
+        """
+        q_path = archives.path(member)
+        with archives.open(member) as f:
+            header = _read_header(f, ORGANIZE_HEADER_SIZE)
+            try:
+                real_ext = self._guess_file_type(member.name, header)
+            except ValueError:
+                self.log.warning("Skipped file of unknown type", q_path=q_path)
+                return False
+            curr_ext = os.path.splitext(member.name)[1].lstrip(".").lower()
+            if curr_ext in (FileExtensions.NEF, FileExtensions.MOV):
+                # the type guess tends to get these wrong, see correct_file_types
+                real_ext = FileExtensions(curr_ext)
 
-            for filename in files:
+            created_date = sidecars.taken_time(member.name)
+            if created_date is None:
+                reader = HeaderReader(f, header=header, size=member.size)
                 try:
-                    full_hash = self._get_hash(filename, first_chunk_only=False)
-                except OSError:
-                    # the file access might've changed till the exec point got here
-                    continue
+                    created_date = self._parse_file_created_date(
+                        member.name, reader, image_file=f
+                    )
+                except Exception as e:
+                    self.log.debug(
+                        "Failed to parse member metadata", q_path=q_path, e=e
+                    )
+
+            if created_date is not None:
+                stem = created_date.strftime(DATE_NAME_FORMAT)
+                sequence: int | None = 1
+            else:
+                stem = self.strip_extension(os.path.basename(member.name))
+                sequence = None
+            name = build_name(stem, real_ext, sequence)
+            while name in taken:
+                sequence = (sequence or 0) + 1
+                name = build_name(stem, real_ext, sequence)
+            taken.add(name)
+            dst = os.path.join(self.base_dir, name)
+
+            if self.is_dry_run:
+                self.file_log.info("[DRY RUN] Extracted", src=q_path, dst=dst)
+                return True
+            self.file_log.info("Extracted", src=q_path, dst=dst)
+            # written next to its name first, so a failed run leaves no partial files
+            tmp_path = dst + ".part"
+            f.seek(len(header))
+            _write_member(f, header, tmp_path)
+        if created_date is not None:
+            unixtime = time.mktime(created_date.timetuple())
+            os.utime(tmp_path, (unixtime, unixtime))
+        os.replace(tmp_path, dst)
+        return True
+
+    def scan(self, out_path: str, host: str) -> int:
+        """
+        Hashes every file (small and full hash) and writes them to a scan
+        manifest sorted by size and hashes, so manifests of other drives or
+        hosts can be merged with lib.shards.merge_scans.
+
+        Returns: the number of files written to the manifest
+        """
+        out_path = os.path.abspath(out_path)
+        skipped = {out_path, out_path + ".tmp"}
+        records = FileRecords()
+        for entry in self.iter_clean_files():
+            path = os.path.abspath(entry.path)
+            if path in skipped:
+                continue
+            if entry.is_symlink:
+                path = os.path.realpath(entry.path)
+            records.append(path, entry.stat)
+
+        for stage in (HashStage.SMALL, HashStage.FULL):
+            for i, digest in self._hash_records(records, range(len(records)), stage):
+                records.set_digest(stage, i, digest)
+
+        def row(i: int) -> ScanRow:
+            small_hash = records.get_digest(HashStage.SMALL, i)
+            full_hash = records.get_digest(HashStage.FULL, i)
+            # sort leaves out the files that couldn't be hashed
+            assert small_hash is not None and full_hash is not None
+            return ScanRow(
+                records.sizes[i],
+                small_hash.hex(),
+                full_hash.hex(),
+                host,
+                records.path(i),
+            )
+
+        order = records.sort([SIZE, HashStage.SMALL, HashStage.FULL])
+        write_scan(
+            out_path,
+            ScanHeader(host, os.path.abspath(self.base_dir), self.hash_name),
+            (row(int(i)) for i in order),
+        )
+        self.log.info("Wrote scan manifest", path=out_path, count=len(order))
+        return len(order)
+
+    def _hash_records(
+        self, records: FileRecords, indices: Iterable[int], stage: HashStage
+    ) -> Iterator[tuple[int, bytes]]:
+        """
+        Like _hash_many, but for records of the table, see lib.records. The
+        records are hashed in the configured I/O order.
+        """
+        # entries are numbered by record index, so the order can change
+        numbered: Iterable[tuple[int, FileEntry]] = (
+            (i, records.entry(i)) for i in indices
+        )
+        if self.io_order != IOOrder.LISTING:
+            listed = list(numbered)
+            kind = self._hash_kind(stage)
+            order = self._io_order(
+                [entry for _, entry in listed],
+                lambda entry: (
+                    self.cache is not None
+                    and self.cache.get_hash(entry.stat, kind) is not None
+                ),
+            )
+            numbered = [listed[k] for k in order]
+        for i, _, digest in self._hash_numbered(numbered, stage):
+            yield i, digest
+
+    def _hash_kind(self, stage: HashStage) -> str:
+        """Returns the cache kind of the hashes of a stage, see MetadataCache."""
+        kind = f"{self.hash_name}-{stage}"
+        if stage == HashStage.SAMPLED:
+            kind += str(self.sample_blocks)
+        return kind
+
+    def _io_order(
+        self, entries: list[FileEntry], is_cached: Callable[[FileEntry], bool]
+    ) -> list[int]:
+        """
+        Returns the positions of entries in the configured I/O order, so
+        spinning disks read them with few seeks. Cached entries aren't read
+        and come first, in input order, so their location is never looked up.
+        """
+        cached = []
+        missed = []
+        for k, entry in enumerate(entries):
+            (cached if is_cached(entry) else missed).append(k)
+        missed.sort(
+            key=lambda k: io_sort_key(entries[k].path, entries[k].stat, self.io_order)
+        )
+        return cached + missed
+
+    def _hash_numbered(
+        self, numbered: Iterable[tuple[int, FileEntry]], stage: HashStage
+    ) -> Iterator[tuple[int, FileEntry, bytes]]:
+        """
+        Like _hash_many, but keeps the number (e.g. a record index) that comes
+        with every entry.
+        """
+        queued: deque[tuple[int, FileEntry]] = deque()
+
+        def entries() -> Iterator[FileEntry]:
+            for number, entry in numbered:
+                queued.append((number, entry))
+                yield entry
+
+        for entry, digest in self._hash_many(entries(), stage):
+            # _hash_many skips unreadable files, but yields the entries it was given
+            number, queued_entry = queued.popleft()
+            while queued_entry is not entry:
+                number, queued_entry = queued.popleft()
+            yield number, entry, digest
+
+    def _report_duplicates(self, records: FileRecords, groups: RecordGroups):
+        """
+        Confirms which files that share a size and small hash (the records of
+        each group) are duplicates and logs them. Candidates go through the
+        sampled stage (if enabled) and then the full hash, unless running in
+        sampled-only mode. With the compare confirmation, the files of each
+        group are compared byte by byte instead of hashed in full, see
+        lib.compare.split_identical.
+        """
+        candidates = groups
+
+        # For all files with the same hash on the first 1024 bytes, hash a few blocks
+        # spread over the file, so large files that only share a header are
+        # rejected without reading them in full
+        if self.sample_blocks is not None:
+            for i, sample_hash in self._hash_records(
+                records, groups.indices, HashStage.SAMPLED
+            ):
+                records.set_digest(HashStage.SAMPLED, i, sample_hash)
+            candidates = records.group(
+                [SIZE, HashStage.SMALL, HashStage.SAMPLED], groups.indices
+            )
 
-                if full_hash in files_by_full_hash:
-                    duplicate = files_by_full_hash[full_hash]
+        if self.sampled_only:
+            for group in candidates:
+                for i in group[1:]:
                     self.log.info(
-                        "Duplicate found", filename=filename, duplicate=duplicate
+                        "Probable duplicate found",
+                        filename=records.path(i),
+                        duplicate=records.path(group[0]),
+                        probabilistic=True,
                     )
+        elif self.confirm == DuplicateConfirmation.COMPARE:
+            for paths in self._compare_groups(records, candidates):
+                for path in paths[1:]:
+                    self.log.info("Duplicate found", filename=path, duplicate=paths[0])
+        else:
+            # For all remaining candidates, get their hash on the full file -
+            # collisions will be duplicates
+            for i, full_hash in self._hash_records(
+                records, candidates.indices, HashStage.FULL
+            ):
+                records.set_digest(HashStage.FULL, i, full_hash)
+            for group in records.group([SIZE, HashStage.FULL], candidates.indices):
+                for i in group[1:]:
+                    self.log.info(
+                        "Duplicate found",
+                        filename=records.path(i),
+                        duplicate=records.path(group[0]),
+                    )
+
+    def _compare_groups(
+        self, records: FileRecords, candidates: RecordGroups
+    ) -> Iterator[list[str]]:
+        """
+        Yields the groups of identical files among each set of candidates. With
+        more than one worker, several candidate sets are compared at once.
+        """
+        max_bytes = MAX_HASH_BYTES_IN_FLIGHT // self.workers
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for identical in pool.map(
+                lambda group: split_identical(
+                    [records.path(i) for i in group], max_bytes
+                ),
+                candidates,
+            ):
+                yield from identical
+
+    def find_similar(
+        self,
+        threshold: int = DEFAULT_SIMILAR_THRESHOLD,
+        algorithm: str = DEFAULT_PERCEPTUAL_HASH,
+    ) -> DuplicateFileMap:
+        """
+        Finds images that look alike (re-encoded, resized, converted) by
+        comparing perceptual hashes, grouping images whose hashes differ in at
+        most threshold bits. Videos and files that can't be decoded are skipped.
+
+        Returns: a dictionary mapping the hash of the first image of each group
+        to the names of the files in that group
+        """
+        entries: list[FileEntry] = []
+        hashes: list[int] = []
+        for entry, hash_value in self._perceptual_hashes(
+            self.iter_clean_files(), algorithm
+        ):
+            entries.append(entry)
+            hashes.append(hash_value)
+
+        similar: DuplicateFileMap = {}
+        for group in group_similar(hashes, threshold):
+            files = [entries[i].path for i in group]
+            self.log.info("Similar files found", files=files)
+            similar[hashes[group[0]]] = sorted(os.path.basename(f) for f in files)
+        return similar
+
+    def _perceptual_hashes(
+        self, entries: Iterable[FileEntry], algorithm: str
+    ) -> Iterator[tuple[FileEntry, int]]:
+        """
+        Yields the perceptual hash of every image, in input order. Thumbnails of a
+        batch are decoded by the worker threads and hashed with one NumPy call.
+        """
+        import numpy as np
+
+        width, height, hash_batch = get_perceptual_hash(algorithm)
+        kind = f"perceptual-{algorithm}"
+
+        def load(q_path: str) -> "np.ndarray | None":
+            try:
+                return load_thumbnail(q_path, width, height)
+            except Exception as e:
+                self.log.debug("Failed to load image", q_path=q_path, e=e)
+                return None
+
+        def hash_batch_entries(
+            batch: list[FileEntry],
+        ) -> Iterator[tuple[FileEntry, int]]:
+            cached: dict[int, int] = {}
+            misses: list[FileEntry] = []
+            for i, entry in enumerate(batch):
+                digest = (
+                    self.cache.get_hash(entry.stat, kind)
+                    if self.cache is not None
+                    else None
+                )
+                if digest is not None:
+                    cached[i] = int.from_bytes(digest, "big")
                 else:
-                    files_by_full_hash[full_hash] = filename
+                    misses.append(entry)
 
-        return {
-            k: sorted([x.split("/")[-1] for x in v])
-            for k, v in files_by_size.items()
-            if len(v) > 1
-        }
+            loaded = [
+                (entry, thumbnail)
+                for entry, thumbnail in zip(
+                    misses, executor.map(load, [e.path for e in misses])
+                )
+                if thumbnail is not None
+            ]
+            computed: dict[str, int] = {}
+            if loaded:
+                new_hashes = hash_batch(np.stack([t for _, t in loaded]))
+                for (entry, _), hash_value in zip(loaded, new_hashes):
+                    computed[entry.path] = hash_value
+                    if self.cache is not None:
+                        self.cache.set_hash(
+                            entry.path, entry.stat, kind, hash_value.to_bytes(8, "big")
+                        )
+
+            for i, entry in enumerate(batch):
+                if i in cached:
+                    yield entry, cached[i]
+                elif entry.path in computed:
+                    yield entry, computed[entry.path]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            batch: list[FileEntry] = []
+            for entry in entries:
+                if entry.is_symlink:
+                    continue
+                try:
+                    if self.get_extension(entry.path) in VIDEO_EXTENSIONS:
+                        continue
+                except ValueError:
+                    # not a media type this tool knows about
+                    continue
+                batch.append(entry)
+                if len(batch) == SIMILAR_BATCH_SIZE:
+                    yield from hash_batch_entries(batch)
+                    batch = []
+            if batch:
+                yield from hash_batch_entries(batch)
+
+    def organize(self, prevent_duplicates: bool = True) -> DuplicateFileMap:
+        """
+        Does the work of correct_file_types, update_dates_from_metadata and
+        convert_names_to_dates in a single pass, then reports duplicates like
+        find_duplicates does.
+
+        Every file is opened once: its first ORGANIZE_HEADER_SIZE bytes feed the
+        file type guess, the metadata date parsers and the small hash. The new
+        modification time and the new name are computed together, so each file is
+        touched at most once. All renames are planned and applied together at
+        the end, like convert_names_to_dates does.
+
+        Returns: a dictionary mapping a file size to a list
+        of files names that have that size
+        """
+        if not self.is_dry_run:
+            check_finished(get_journal_path(self.base_dir))
+        organized: list[tuple[FileEntry, bytes]] = []
+        rename_requests: list[RenameRequest] = []
+
+        for entry in self.iter_clean_files():
+            if entry.is_symlink:
+                # organizing the link would rename the link, not the media file
+                continue
+            try:
+                entry, small_hash, rename_request = self._organize_file(entry)
+            except (OSError, ValueError) as e:
+                self.log.warning("Failed to organize", q_path=entry.path, e=e)
+                continue
+            organized.append((entry, small_hash))
+            rename_requests.append(rename_request)
+
+        renamed = self._apply_renames(rename_requests, prevent_duplicates)
+        self._warn_if_sampled_only()
+        records = FileRecords()
+        for entry, small_hash in organized:
+            i = records.append(renamed.get(entry.path, entry.path), entry.stat)
+            records.set_digest(HashStage.SMALL, i, small_hash)
+        self._report_duplicates(records, records.group([SIZE, HashStage.SMALL]))
+
+        return _names_by_size(records, records.group([SIZE]))
+
+    def _organize_file(
+        self, entry: FileEntry
+    ) -> tuple[FileEntry, bytes, RenameRequest]:
+        """
+        Fixes the date of one file and works out its new name, see organize.
+        Returns the entry as it is after the changes along with its small hash
+        and the name it should get.
+        """
+        q_path = entry.path
+        curr_ext = self.get_extension(q_path)
+        small_hash_kind = f"{self.hash_name}-{HashStage.SMALL}"
+
+        small_hash: bytes | None = None
+        real_ext: str | None = None
+        found_date = False
+        created_date: datetime | None = None
+        if self.cache is not None:
+            small_hash = self.cache.get_hash(entry.stat, small_hash_kind)
+            real_ext = self.cache.get_file_type(entry.stat)
+            found_date, created_date = self.cache.get_created_date(entry.stat)
+        if small_hash is None or real_ext is None or not found_date:
+            with open(q_path, "rb") as f:
+                header = _read_header(f, ORGANIZE_HEADER_SIZE)
+                reader = HeaderReader(f, header=header, size=entry.stat.st_size)
+                real_ext = self.get_file_type(q_path, entry.stat, header)
+                created_date = self.get_file_created_date(q_path, entry.stat, reader)
+            small_hash = hash_bytes(header[:DEFAULT_HASH_CHUNK_SIZE], self.hash_name)
+            if self.cache is not None:
+                self.cache.set_hash(q_path, entry.stat, small_hash_kind, small_hash)
+
+        if curr_ext == FileExtensions.NEF or curr_ext == FileExtensions.MOV:
+            # the type guess tends to get these wrong, see correct_file_types
+            new_ext = curr_ext
+        else:
+            new_ext = FileExtensions(real_ext)
+
+        mtime = entry.stat.st_mtime
+        if created_date is not None and created_date != datetime.fromtimestamp(mtime):
+            mtime = time.mktime(created_date.timetuple())
+            self._utime(q_path, (mtime, mtime), entry.stat)
+
+        if mtime != entry.stat.st_mtime and not self.is_dry_run:
+            entry = FileEntry(q_path, os.stat(q_path))
+        rename_request = RenameRequest(
+            q_path, datetime.fromtimestamp(mtime).strftime(DATE_NAME_FORMAT), new_ext
+        )
+        return entry, small_hash, rename_request
+
+
+@profiled(STAGE_SNIFFING)
+def _read_header(f: IO[bytes], size: int) -> bytes:
+    return f.read(size)
+
+
+@profiled(STAGE_EXTRACTING)
+def _write_member(f: IO[bytes], header: bytes, path: str):
+    """Writes out an archive member whose first bytes were already read."""
+    with open(path, "wb") as out:
+        out.write(header)
+        shutil.copyfileobj(f, out, MAX_READ_SIZE)
+
+
+def _names_by_size(records: FileRecords, size_groups: RecordGroups) -> DuplicateFileMap:
+    """Maps the size of every group of same-sized files to their sorted names."""
+    return {
+        records.sizes[group[0]]: sorted(records.name(i) for i in group)
+        for group in size_groups
+    }
+
+
+# Utils instance of a metadata worker process, see _init_metadata_worker
+_worker_utils: "Utils | None" = None
+
+
+def _init_metadata_worker(base_dir: str):
+    global _worker_utils
+    configure_worker_logging()
+    _worker_utils = Utils(base_dir=base_dir, is_dry_run=True)
+
+
+def _extract_metadata_batch(
+    paths: list[str], kind: MetadataKind
+) -> list[tuple[FileExtensions | datetime | None, str | None]]:
+    """
+    Parses the file type or created date of a batch of files in a worker process.
+    Returns a (value, error) pair per file. Errors are passed back as strings so
+    the parent can report them in order, and because not every exception pickles.
+    """
+    assert _worker_utils is not None
+    results: list[tuple[FileExtensions | datetime | None, str | None]] = []
+    for q_path in paths:
+        try:
+            if kind == MetadataKind.FILE_TYPE:
+                results.append((_worker_utils._guess_file_type(q_path), None))
+            else:
+                results.append((_worker_utils._parse_file_created_date(q_path), None))
+        except Exception as e:
+            results.append((None, repr(e)))
+    return results
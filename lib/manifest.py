@@ -0,0 +1,147 @@
+import json
+import os
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+from lib.logger import get_logger
+from lib.walk import FileEntry
+
+logger = get_logger()
+
+MANIFEST_NAME = ".photo-utils-manifest.jsonl"
+MANIFEST_TMP_NAME = MANIFEST_NAME + ".tmp"
+MANIFEST_VERSION = 1
+
+
+class ManifestEntry(NamedTuple):
+    """The state a file was left in by a command, and what the command did."""
+
+    size: int
+    mtime_ns: int
+    inode: int
+    action: str
+
+
+def get_manifest_path(base_dir: str) -> str:
+    return os.path.join(base_dir, MANIFEST_NAME)
+
+
+def _matches(entry: ManifestEntry, st: os.stat_result) -> bool:
+    return (entry.size, entry.mtime_ns, entry.inode) == (
+        st.st_size,
+        st.st_mtime_ns,
+        st.st_ino,
+    )
+
+
+class Manifest:
+    """
+    Per base directory record of the files each command already processed,
+    keyed by path relative to the base directory. A file whose size, mtime and
+    inode still match its record is unchanged and can be skipped.
+
+    The whole manifest is read into memory and rewritten atomically on save,
+    so an interrupted run leaves the previous manifest in place.
+    """
+
+    def __init__(self, base_dir: str, command: str):
+        self.base_dir = base_dir
+        self.path = get_manifest_path(base_dir)
+        self.command = command
+        # relative path -> command -> entry
+        self.files: dict[str, dict[str, ManifestEntry]] = {}
+        self.seen: set[str] = set()
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path)
+        except FileNotFoundError:
+            return
+        with f:
+            header = f.readline()
+            try:
+                version = json.loads(header).get("version")
+            except json.JSONDecodeError:
+                version = None
+            if version != MANIFEST_VERSION:
+                logger.warning("Ignoring unreadable manifest", path=self.path)
+                return
+            for line in f:
+                record = json.loads(line)
+                self.files.setdefault(record["path"], {})[record["command"]] = (
+                    ManifestEntry(
+                        record["size"],
+                        record["mtime_ns"],
+                        record["inode"],
+                        record["action"],
+                    )
+                )
+
+    def _rel_path(self, path: str) -> str:
+        return os.fsdecode(os.path.relpath(path, self.base_dir))
+
+    def iter_changed(self, entries: Iterable[FileEntry]) -> Iterator[FileEntry]:
+        """
+        Yields the entries that are new or changed since the command last
+        processed them. Only the stat results of the listing are compared.
+        """
+        skipped = 0
+        for entry in entries:
+            rel_path = self._rel_path(entry.path)
+            self.seen.add(rel_path)
+            recorded = self.files.get(rel_path, {}).get(self.command)
+            if recorded is not None and _matches(recorded, entry.stat):
+                skipped += 1
+                continue
+            yield entry
+        logger.info("Skipped unchanged files", count=skipped, command=self.command)
+
+    def record(self, path: str, action: str, st: os.stat_result | None = None):
+        """
+        Records that the command processed the file at path. The file is stat'ed
+        unless the caller passes a stat result that is still current.
+        """
+        rel_path = self._rel_path(path)
+        if st is None:
+            st = os.stat(path)
+        self.seen.add(rel_path)
+        self.files.setdefault(rel_path, {})[self.command] = ManifestEntry(
+            st.st_size, st.st_mtime_ns, st.st_ino, action
+        )
+
+    def move(self, src: str, dst: str):
+        """Carries the records of every command over to a renamed file."""
+        rel_src = self._rel_path(src)
+        records = self.files.pop(rel_src, None)
+        if records is not None:
+            rel_dst = self._rel_path(dst)
+            self.files[rel_dst] = records
+            self.seen.add(rel_dst)
+
+    def save(self):
+        """
+        Writes the manifest, dropping this command's records of files that
+        weren't listed by this run (e.g. deleted ones).
+        """
+        for rel_path in list(self.files):
+            if rel_path not in self.seen:
+                records = self.files[rel_path]
+                records.pop(self.command, None)
+                if not records:
+                    del self.files[rel_path]
+
+        tmp_path = os.path.join(self.base_dir, MANIFEST_TMP_NAME)
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"version": MANIFEST_VERSION}) + "\n")
+            for rel_path, records in self.files.items():
+                for command, entry in records.items():
+                    f.write(
+                        json.dumps(
+                            {"path": rel_path, "command": command, **entry._asdict()}
+                        )
+                        + "\n"
+                    )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
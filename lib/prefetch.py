@@ -0,0 +1,98 @@
+import asyncio
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.walk import FileEntry
+
+DEFAULT_PREFETCH_PER_MOUNT = 8
+
+# a prefetched header, None if it wasn't needed, or the error that reading it hit
+Prefetched = bytes | OSError | None
+
+
+def read_header(path: str, size: int) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+
+async def _prefetch(
+    entries: Iterable[FileEntry],
+    header_size: int,
+    depth: int,
+    per_mount: int,
+    skip: Callable[[FileEntry], bool],
+) -> AsyncIterator[tuple[FileEntry, Prefetched]]:
+    mount_limits: defaultdict[int, asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(per_mount)
+    )
+
+    async def fetch(entry: FileEntry) -> bytes:
+        async with mount_limits[entry.stat.st_dev]:
+            return await asyncio.to_thread(read_header, entry.path, header_size)
+
+    iterator = iter(entries)
+    pending: deque[tuple[FileEntry, asyncio.Task[bytes] | None]] = deque()
+
+    def fill():
+        while len(pending) < depth:
+            entry = next(iterator, None)
+            if entry is None:
+                return
+            task = None if skip(entry) else asyncio.create_task(fetch(entry))
+            pending.append((entry, task))
+
+    try:
+        fill()
+        while pending:
+            entry, task = pending.popleft()
+            header: Prefetched = None
+            if task is not None:
+                try:
+                    header = await task
+                except OSError as e:
+                    header = e
+            fill()
+            yield entry, header
+    finally:
+        for _, task in pending:
+            if task is not None:
+                task.cancel()
+
+
+def iter_prefetched(
+    entries: Iterable[FileEntry],
+    header_size: int,
+    depth: int,
+    per_mount: int = DEFAULT_PREFETCH_PER_MOUNT,
+    skip: Callable[[FileEntry], bool] = lambda entry: False,
+) -> Iterator[tuple[FileEntry, Prefetched]]:
+    """
+    Yields every entry along with the first header_size bytes of the file, in
+    input order, while the headers of the next depth files are read in the
+    background. Meant for network mounts, where every open and read waits for a
+    round trip but many of them can be in flight at once.
+
+    Reads go through asyncio.to_thread, with at most per_mount of them running
+    against the same device (st_dev). Entries for which skip returns True (e.g.
+    cached ones) aren't read and come with None. Read errors are yielded in
+    place of the header.
+
+    The event loop only runs while the caller asks for the next entry, so the
+    caller's own work (and skip) stays on the calling thread.
+    """
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch")
+    )
+    agen = _prefetch(entries, header_size, depth, per_mount, skip)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
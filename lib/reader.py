@@ -0,0 +1,73 @@
+import os
+from collections.abc import Callable
+from typing import IO
+
+# Reads `length` bytes at `offset`. Returns fewer bytes at the end of the data.
+ReadAt = Callable[[int, int], bytes]
+
+DEFAULT_HEADER_SIZE = 8192
+
+
+class HeaderReader:
+    """
+    Random access reader over a file that serves reads from the file's first
+    header_size bytes, which are fetched with a single read. Only data past the
+    header costs an extra seek and read.
+
+    A header that was already read (e.g. to sniff the file type) can be passed in
+    so that several parsers share one read.
+    """
+
+    def __init__(
+        self,
+        f: IO[bytes],
+        header_size: int = DEFAULT_HEADER_SIZE,
+        header: bytes | None = None,
+        size: int | None = None,
+    ):
+        self.f = f
+        self.header = header if header is not None else f.read(header_size)
+        self.size = size if size is not None else os.fstat(f.fileno()).st_size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        if offset < 0 or length < 0:
+            raise ValueError("Negative offset or length")
+        end = offset + length
+        if end <= len(self.header):
+            return self.header[offset:end]
+        self.f.seek(offset)
+        return self.f.read(length)
+
+
+class PrefetchedReader(HeaderReader):
+    """
+    HeaderReader over a header that was read ahead of time (see lib.prefetch).
+    The file is only opened if a parser reads past the header.
+    """
+
+    def __init__(self, path: str, header: bytes, size: int):
+        self.path = path
+        self.f = None
+        self.header = header
+        self.size = size
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        if self.f is None and offset + length > len(self.header):
+            self.f = open(self.path, "rb")
+        return super().read_at(offset, length)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def buffer_reader(buffer: bytes | memoryview, base: int = 0) -> ReadAt:
+    """Returns a ReadAt over an in-memory buffer, with offsets relative to base."""
+
+    def read_at(offset: int, length: int) -> bytes:
+        if offset < 0 or length < 0:
+            raise ValueError("Negative offset or length")
+        return bytes(buffer[base + offset : base + offset + length])
+
+    return read_at
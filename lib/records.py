@@ -0,0 +1,248 @@
+import os
+from array import array
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
+
+from lib.walk import FileEntry
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# key of the size column in FileRecords.group, digests are keyed by their name
+SIZE = "size"
+
+
+def make_stat(device: int, inode: int, size: int, mtime_ns: int) -> os.stat_result:
+    """
+    Builds a stat result from the fields that identify a file's contents, the
+    ones the cache is keyed by. The other fields are zero.
+    """
+    return os.stat_result(
+        (0, inode, device, 0, 0, 0, size, 0, 0, 0), {"st_mtime_ns": mtime_ns}
+    )
+
+
+class _DigestColumn:
+    """Fixed-width digests of some of the records, e.g. only the candidates."""
+
+    def __init__(self, width: int, length: int):
+        self.width = width
+        self.data = bytearray(width * length)
+        self.present = bytearray(length)
+
+
+class RecordGroups:
+    """
+    Groups of record indices, see FileRecords.group. All groups share one
+    index array and are told apart by where each one starts, so a group
+    costs 8 bytes instead of an array object. Groups are made into lists of
+    indices only as they are iterated or looked up.
+    """
+
+    def __init__(self, indices: "np.ndarray", bounds: "np.ndarray"):
+        # indices of the grouped records, group k is indices[bounds[k]:bounds[k + 1]]
+        self.indices = indices
+        self.bounds = bounds
+
+    def __len__(self) -> int:
+        return max(0, len(self.bounds) - 1)
+
+    def __getitem__(self, k: int) -> list[int]:
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        return self.indices[self.bounds[k] : self.bounds[k + 1]].tolist()
+
+    def __iter__(self) -> Iterator[list[int]]:
+        for k in range(len(self)):
+            yield self.indices[self.bounds[k] : self.bounds[k + 1]].tolist()
+
+
+class FileRecords:
+    """
+    Append-only table of files, with one compact column per field instead of
+    a Python object per file, for scans of millions of files.
+
+    Paths are split into an interned directory and a name, and names are kept
+    in one UTF-8 blob. Stat fields are array columns and digests fixed-width
+    byte columns, so a record costs 44 bytes plus its name, and
+    digest_width bytes per digest column. Records are referred to by index.
+    """
+
+    def __init__(self):
+        self._dirs: list[str] = []
+        self._dir_ids: dict[str, int] = {}
+        self.dir_ids = array("I")
+        self._names = bytearray()
+        self._name_ends = array("Q")
+        self.sizes = array("q")
+        self.mtimes_ns = array("q")
+        self.devices = array("Q")
+        self.inodes = array("Q")
+        self._digests: dict[str, _DigestColumn] = {}
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def append(self, path: str, st: os.stat_result) -> int:
+        """Adds a file and returns its index."""
+        dir_path, name = os.path.split(path)
+        dir_id = self._dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self._dir_ids[dir_path] = len(self._dirs)
+            self._dirs.append(dir_path)
+        self.dir_ids.append(dir_id)
+        self._names += name.encode("utf-8", "surrogateescape")
+        self._name_ends.append(len(self._names))
+        self.sizes.append(st.st_size)
+        self.mtimes_ns.append(st.st_mtime_ns)
+        self.devices.append(st.st_dev)
+        self.inodes.append(st.st_ino)
+        return len(self.sizes) - 1
+
+    def name(self, i: int) -> str:
+        start = self._name_ends[i - 1] if i else 0
+        return self._names[start : self._name_ends[i]].decode(
+            "utf-8", "surrogateescape"
+        )
+
+    def path(self, i: int) -> str:
+        return os.path.join(self._dirs[self.dir_ids[i]], self.name(i))
+
+    def stat(self, i: int) -> os.stat_result:
+        """Returns a stat result holding the fields the table keeps."""
+        return make_stat(
+            self.devices[i], self.inodes[i], self.sizes[i], self.mtimes_ns[i]
+        )
+
+    def entry(self, i: int) -> FileEntry:
+        return FileEntry(self.path(i), self.stat(i))
+
+    def set_digest(self, column: str, i: int, digest: bytes):
+        """Stores a digest, all digests of a column must have the same length."""
+        digests = self._digests.get(column)
+        if digests is None:
+            digests = self._digests[column] = _DigestColumn(len(digest), len(self))
+        elif len(digests.present) < len(self):
+            # records were added after the column was created
+            missing = len(self) - len(digests.present)
+            digests.data += bytes(missing * digests.width)
+            digests.present += bytes(missing)
+        if len(digest) != digests.width:
+            raise ValueError(f"expected a {digests.width} byte digest for {column}")
+        digests.data[i * digests.width : (i + 1) * digests.width] = digest
+        digests.present[i] = 1
+
+    def get_digest(self, column: str, i: int) -> bytes | None:
+        digests = self._digests.get(column)
+        if digests is None or i >= len(digests.present) or not digests.present[i]:
+            return None
+        return bytes(digests.data[i * digests.width : (i + 1) * digests.width])
+
+    def _select(
+        self, keys: Iterable[str], indices: "Iterable[int] | np.ndarray | None"
+    ) -> "tuple[np.ndarray, list[np.ndarray]]":
+        """
+        Returns the ascending indices of the records that have every key, and
+        numpy views of the key columns.
+        """
+        import numpy as np
+
+        if indices is None:
+            idx = np.arange(len(self), dtype=np.int64)
+        elif isinstance(indices, np.ndarray):
+            idx = np.sort(indices)
+        else:
+            idx = np.sort(np.fromiter(indices, dtype=np.int64))
+        columns = []
+        for key in keys:
+            if key == SIZE:
+                column = np.frombuffer(self.sizes, dtype=np.int64)
+            else:
+                digests = self._digests.get(key)
+                if digests is None:
+                    return idx[:0], []
+                present = np.frombuffer(digests.present, dtype=np.uint8)
+                idx = idx[idx < len(present)]
+                idx = idx[present[idx] == 1]
+                column = np.frombuffer(digests.data, dtype=f"S{digests.width}")
+            columns.append(column)
+        return idx, columns
+
+    def sort(
+        self, keys: Iterable[str], indices: "Iterable[int] | np.ndarray | None" = None
+    ) -> "np.ndarray":
+        """
+        Returns the indices of the records (all, or the given ones) ordered by
+        the key columns. Records missing a digest of the keys are left out, and
+        ties keep their order.
+        """
+        idx, columns = self._select(keys, indices)
+        if len(idx) < 2:
+            return idx
+        return idx[_order([column[idx] for column in columns])]
+
+    def group(
+        self, keys: Iterable[str], indices: "Iterable[int] | np.ndarray | None" = None
+    ) -> RecordGroups:
+        """
+        Groups records (all, or the given indices) with equal values in every
+        key column by sorting, and returns the groups with more than one member.
+        Records missing a digest of the keys are left out. Groups are ordered
+        by key and hold indices in ascending order.
+
+        Sorting needs about 35 bytes per record on top of the table, and the
+        groups keep 8 bytes per grouped record and 8 per group.
+        """
+        import numpy as np
+
+        idx, columns = self._select(keys, indices)
+        if len(idx) < 2:
+            return RecordGroups(idx[:0], idx[:0])
+
+        values = [column[idx] for column in columns]
+        order = _order(values)
+        idx = idx[order]
+        # starts[k] is set where the k-th sorted record starts a new group
+        starts = np.ones(len(idx), dtype=bool)
+        same = np.ones(len(idx) - 1, dtype=bool)
+        while values:
+            value = values.pop()[order]
+            same &= value[1:] == value[:-1]
+            del value
+        del order
+        starts[1:] = ~same
+        # keep only records that equal a neighbour, most records are unique
+        grouped = np.zeros(len(idx), dtype=bool)
+        grouped[1:] = same
+        grouped[:-1] |= same
+        del same
+        idx = idx[grouped]
+        starts = starts[grouped]
+        bounds = np.flatnonzero(starts)
+        return RecordGroups(idx, np.append(bounds, len(idx)) if len(idx) else bounds)
+
+    def nbytes(self) -> int:
+        """Returns the memory held by the columns, not counting the directories."""
+        columns = [
+            self.dir_ids,
+            self._name_ends,
+            self.sizes,
+            self.mtimes_ns,
+            self.devices,
+            self.inodes,
+        ]
+        return (
+            sum(column.itemsize * len(column) for column in columns)
+            + len(self._names)
+            + sum(len(d.data) + len(d.present) for d in self._digests.values())
+        )
+
+
+def _order(values: "list[np.ndarray]") -> "np.ndarray":
+    """Returns the stable sort order of rows made of the given key columns."""
+    import numpy as np
+
+    if len(values) == 1:
+        return np.argsort(values[0], kind="stable")
+    # lexsort is stable too and sorts by its last key first
+    return np.lexsort(values[::-1])
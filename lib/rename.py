@@ -0,0 +1,337 @@
+import json
+import os
+import re
+from collections import defaultdict
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+from typing import NamedTuple, TextIO
+
+from lib.logger import get_logger
+from lib.profiler import STAGE_RENAME_UTIME, profiled
+
+logger = get_logger()
+file_logger = get_logger(per_file=True)
+
+RENAME_JOURNAL_NAME = ".photo-utils-renames.jsonl"
+JOURNAL_VERSION = 1
+# renames applied between two journal syncs
+RENAME_BATCH_SIZE = 256
+SEQUENCE_PREFIX = "R"
+SEQUENCE_DIGITS = 4
+
+
+class IncompleteRenameError(Exception):
+    """Raised when a new plan would overwrite the journal of an unfinished run."""
+
+
+class RenameRequest(NamedTuple):
+    """A file that should be named after stem and ext, e.g. a date."""
+
+    path: str
+    stem: str
+    ext: str
+
+
+class PlannedRename(NamedTuple):
+    # directory relative to the base directory, and names within it
+    dir: str
+    src: str
+    dst: str
+
+
+class JournalState(NamedTuple):
+    base_dir: str
+    plan: list[PlannedRename]
+    done: set[int]
+    complete: bool
+    rolled_back: bool
+
+
+def build_name(stem: str, ext: str, sequence: int | None = None) -> str:
+    if sequence is None:
+        return f"{stem}.{ext}"
+    return f"{stem}{SEQUENCE_PREFIX}{sequence:0{SEQUENCE_DIGITS}d}.{ext}"
+
+
+def has_target_name(name: str, stem: str, ext: str, with_sequence: bool) -> bool:
+    """
+    Whether name already is a valid target name. Any sequence suffix counts, so
+    files named by earlier runs (including old random suffixes) keep their name.
+    """
+    if not with_sequence:
+        return name == build_name(stem, ext)
+    pattern = (
+        rf"{re.escape(stem)}{SEQUENCE_PREFIX}\d{{{SEQUENCE_DIGITS},}}\.{re.escape(ext)}"
+    )
+    return re.fullmatch(pattern, name) is not None
+
+
+def plan_renames(
+    base_dir: str, requests: Iterable[RenameRequest], prevent_duplicates: bool
+) -> tuple[list[PlannedRename], list[RenameRequest]]:
+    """
+    Computes the new name of every file in memory, without touching the files.
+
+    Files that already have a valid target name keep it. The others get the
+    lowest free sequence number for their stem, in the order of their current
+    names, and never a name that is currently in use. The same files always get
+    the same plan, and planning again after applying a plan renames nothing.
+
+    Returns the renames and the requests that couldn't be given their name,
+    which can only happen without prevent_duplicates.
+    """
+    requests_by_dir: defaultdict[str, list[RenameRequest]] = defaultdict(list)
+    for request in requests:
+        requests_by_dir[os.path.dirname(request.path)].append(request)
+
+    plan: list[PlannedRename] = []
+    conflicts: list[RenameRequest] = []
+    for dir_path in sorted(requests_by_dir):
+        rel_dir = os.fsdecode(os.path.relpath(dir_path, base_dir))
+        taken = set(os.listdir(dir_path))
+        pending: list[tuple[str, RenameRequest]] = []
+        for request in sorted(requests_by_dir[dir_path]):
+            name = os.path.basename(request.path)
+            if not has_target_name(name, request.stem, request.ext, prevent_duplicates):
+                pending.append((name, request))
+
+        next_sequence: dict[tuple[str, str], int] = {}
+        for name, request in pending:
+            if not prevent_duplicates:
+                new_name = build_name(request.stem, request.ext)
+                if new_name in taken:
+                    conflicts.append(request)
+                    continue
+            else:
+                key = (request.stem, request.ext)
+                sequence = next_sequence.get(key, 1)
+                while build_name(request.stem, request.ext, sequence) in taken:
+                    sequence += 1
+                next_sequence[key] = sequence + 1
+                new_name = build_name(request.stem, request.ext, sequence)
+            taken.add(new_name)
+            plan.append(PlannedRename(rel_dir, name, new_name))
+    return plan, conflicts
+
+
+def get_journal_path(base_dir: str) -> str:
+    return os.path.join(base_dir, RENAME_JOURNAL_NAME)
+
+
+def _append(journal: TextIO, records: Iterable[dict]):
+    for record in records:
+        journal.write(json.dumps(record) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def read_journal(journal_path: str) -> JournalState | None:
+    """Returns the state recorded in a journal, or None if there is no journal."""
+    try:
+        f = open(journal_path)
+    except FileNotFoundError:
+        return None
+    base_dir = ""
+    plan: list[PlannedRename] = []
+    done: set[int] = set()
+    complete = rolled_back = False
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line torn by a crash while appending
+                continue
+            op = record["op"]
+            if op == "plan":
+                base_dir = record["base_dir"]
+            elif op == "rename":
+                plan.append(PlannedRename(record["dir"], record["src"], record["dst"]))
+            elif op == "done":
+                done.update(record["ids"])
+            elif op == "undone":
+                done.difference_update(record["ids"])
+            elif op == "complete":
+                complete = True
+            elif op == "rolled_back":
+                rolled_back = True
+    return JournalState(base_dir, plan, done, complete, rolled_back)
+
+
+def is_unfinished(state: JournalState | None) -> bool:
+    return state is not None and not state.complete and not state.rolled_back
+
+
+def check_finished(journal_path: str):
+    """Raises IncompleteRenameError if the journal belongs to an unfinished run."""
+    if is_unfinished(read_journal(journal_path)):
+        raise IncompleteRenameError(
+            f"{journal_path} belongs to an unfinished run, resume or roll it back first"
+        )
+
+
+def write_plan(journal_path: str, base_dir: str, plan: list[PlannedRename]):
+    """
+    Starts a new journal holding the whole plan. The journal of a finished run
+    is replaced, an unfinished one has to be resumed or rolled back first.
+    """
+    check_finished(journal_path)
+    with open(journal_path, "w") as journal:
+        _append(
+            journal,
+            [
+                {
+                    "op": "plan",
+                    "version": JOURNAL_VERSION,
+                    "base_dir": os.path.abspath(base_dir),
+                }
+            ]
+            + [
+                {"op": "rename", "id": i, **rename._asdict()}
+                for i, rename in enumerate(plan)
+            ],
+        )
+
+
+class _DirFds(dict[str, int]):
+    """Directory fds keyed by directory relative to base_dir, opened on first use."""
+
+    def __init__(self, base_dir: str):
+        super().__init__()
+        self.base_dir = base_dir
+
+    def __missing__(self, rel_dir: str) -> int:
+        fd = os.open(os.path.join(self.base_dir, rel_dir), os.O_RDONLY | os.O_DIRECTORY)
+        self[rel_dir] = fd
+        return fd
+
+    def close(self):
+        for fd in self.values():
+            os.close(fd)
+        self.clear()
+
+
+@contextmanager
+def _open_for_append(journal_path: str) -> Generator[TextIO]:
+    """Opens the journal for appending, after ending a line torn by a crash."""
+    with open(journal_path, "a+") as journal:
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != "\n":
+                journal.write("\n")
+        yield journal
+
+
+def _exists(name: str, dir_fd: int) -> bool:
+    try:
+        os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@profiled(STAGE_RENAME_UTIME)
+def _run(
+    journal_path: str,
+    base_dir: str,
+    moves: list[tuple[int, str, str, str]],
+    done_op: str,
+    batch_size: int,
+) -> int:
+    """
+    Moves (id, dir, src, dst) entries relative to directory fds, in batches. Each
+    batch is synced (directories, then journal) before the next one starts.
+    A move whose destination already exists while its source is gone was applied
+    before a crash and is only recorded. Returns the number of files moved.
+    """
+    moved = 0
+    fds = _DirFds(base_dir)
+    with _open_for_append(journal_path) as journal:
+        try:
+            for start in range(0, len(moves), batch_size):
+                batch_ids = []
+                touched = set()
+                for rename_id, rel_dir, src, dst in moves[start : start + batch_size]:
+                    fd = fds[rel_dir]
+                    if _exists(dst, fd):
+                        if not _exists(src, fd):
+                            batch_ids.append(rename_id)
+                        else:
+                            logger.warning(
+                                "Rename target already exists",
+                                src=os.path.join(base_dir, rel_dir, src),
+                                dst=os.path.join(base_dir, rel_dir, dst),
+                            )
+                        continue
+                    try:
+                        os.rename(src, dst, src_dir_fd=fd, dst_dir_fd=fd)
+                    except FileNotFoundError:
+                        logger.warning(
+                            "Rename source is missing",
+                            src=os.path.join(base_dir, rel_dir, src),
+                        )
+                        continue
+                    file_logger.info(
+                        "Renamed",
+                        src=os.path.join(base_dir, rel_dir, src),
+                        dst=os.path.join(base_dir, rel_dir, dst),
+                    )
+                    batch_ids.append(rename_id)
+                    touched.add(rel_dir)
+                    moved += 1
+                for rel_dir in touched:
+                    os.fsync(fds[rel_dir])
+                if batch_ids:
+                    _append(journal, [{"op": done_op, "ids": batch_ids}])
+        finally:
+            fds.close()
+    return moved
+
+
+def apply_plan(
+    journal_path: str, batch_size: int = RENAME_BATCH_SIZE
+) -> list[tuple[str, str]]:
+    """
+    Applies the renames of the journal that aren't done yet, which resumes an
+    interrupted run. Returns the (old path, new path) of every applied rename.
+    """
+    state = read_journal(journal_path)
+    if state is None or state.complete or state.rolled_back:
+        return []
+    moves = [
+        (i, rename.dir, rename.src, rename.dst)
+        for i, rename in enumerate(state.plan)
+        if i not in state.done
+    ]
+    _run(journal_path, state.base_dir, moves, "done", batch_size)
+
+    state = read_journal(journal_path)
+    assert state is not None
+    with _open_for_append(journal_path) as journal:
+        _append(journal, [{"op": "complete"}])
+    return [
+        (
+            os.path.normpath(os.path.join(state.base_dir, rename.dir, rename.src)),
+            os.path.normpath(os.path.join(state.base_dir, rename.dir, rename.dst)),
+        )
+        for i, rename in enumerate(state.plan)
+        if i in state.done
+    ]
+
+
+def rollback_plan(journal_path: str, batch_size: int = RENAME_BATCH_SIZE) -> int:
+    """
+    Undoes the applied renames of the journal, newest first, whether or not the
+    run finished. Returns the number of files renamed back.
+    """
+    state = read_journal(journal_path)
+    if state is None or state.rolled_back:
+        return 0
+    moves = [
+        (i, state.plan[i].dir, state.plan[i].dst, state.plan[i].src)
+        for i in sorted(state.done, reverse=True)
+    ]
+    moved = _run(journal_path, state.base_dir, moves, "undone", batch_size)
+    with _open_for_append(journal_path) as journal:
+        _append(journal, [{"op": "rolled_back"}])
+    return moved
@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import os
+from collections.abc import Iterable, Iterator
+from typing import IO, NamedTuple
+
+SCAN_FORMAT = "photo-utils-scan"
+SCAN_VERSION = 1
+
+# escapes for the characters that would break a tab separated line
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+_UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+
+
+class ScanRow(NamedTuple):
+    """One file of a scan manifest. Rows are sorted by size and hashes."""
+
+    size: int
+    small_hash: str
+    full_hash: str
+    host: str
+    path: str
+
+    @property
+    def key(self) -> tuple[int, str, str]:
+        return (self.size, self.small_hash, self.full_hash)
+
+
+class ScanHeader(NamedTuple):
+    host: str
+    root: str
+    hash_name: str
+
+
+def escape_field(value: str) -> str:
+    return "".join(_ESCAPES.get(c, c) for c in value)
+
+
+def unescape_field(value: str) -> str:
+    if "\\" not in value:
+        return value
+    chars: list[str] = []
+    escaped = False
+    for c in value:
+        if escaped:
+            chars.append(_UNESCAPES.get(c, c))
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        else:
+            chars.append(c)
+    return "".join(chars)
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    # file names that aren't valid UTF-8 survive the round trip
+    return open(path, mode, encoding="utf-8", errors="surrogateescape", newline="\n")
+
+
+def write_scan(out_path: str, header: ScanHeader, rows: Iterable[ScanRow]):
+    """
+    Writes a scan manifest: a header line followed by one tab separated line
+    per file. rows must already be sorted by ScanRow.key. The file is written
+    next to out_path and moved into place once complete.
+    """
+    tmp_path = out_path + ".tmp"
+    with _open(tmp_path, "w") as f:
+        f.write(
+            "\t".join(
+                [
+                    f"#{SCAN_FORMAT}",
+                    str(SCAN_VERSION),
+                    escape_field(header.host),
+                    escape_field(header.root),
+                    header.hash_name,
+                ]
+            )
+            + "\n"
+        )
+        for row in rows:
+            f.write(
+                f"{row.size}\t{row.small_hash}\t{row.full_hash}\t"
+                f"{escape_field(row.host)}\t{escape_field(row.path)}\n"
+            )
+    os.replace(tmp_path, out_path)
+
+
+def read_scan_header(path: str) -> ScanHeader:
+    with _open(path, "r") as f:
+        return _parse_header(path, f.readline())
+
+
+def _parse_header(path: str, line: str) -> ScanHeader:
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) != 5 or fields[0] != f"#{SCAN_FORMAT}":
+        raise ValueError(f"{path} is not a scan manifest")
+    if fields[1] != str(SCAN_VERSION):
+        raise ValueError(f"{path} has unsupported scan version {fields[1]}")
+    return ScanHeader(unescape_field(fields[2]), unescape_field(fields[3]), fields[4])
+
+
+def iter_scan(path: str) -> Iterator[ScanRow]:
+    """
+    Lazily reads the rows of a scan manifest. Raises ValueError on a malformed
+    or unsorted manifest.
+    """
+    with _open(path, "r") as f:
+        _parse_header(path, f.readline())
+        previous: tuple[int, str, str] | None = None
+        for line_number, line in enumerate(f, start=2):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 5:
+                raise ValueError(f"{path}:{line_number} is malformed")
+            row = ScanRow(
+                int(fields[0]),
+                fields[1],
+                fields[2],
+                unescape_field(fields[3]),
+                unescape_field(fields[4]),
+            )
+            if previous is not None and row.key < previous:
+                raise ValueError(f"{path}:{line_number} is out of order")
+            previous = row.key
+            yield row
+
+
+def merge_scans(paths: list[str]) -> Iterator[list[ScanRow]]:
+    """
+    Streams the groups of identical files (same size and hashes, two or more
+    files) across any number of scan manifests. The manifests are k-way
+    merged, so only one row per manifest and the rows of the current group
+    are held in memory at a time. A file listed by several manifests counts
+    once.
+
+    Raises ValueError if the manifests were hashed with different algorithms.
+    """
+    hash_names = {read_scan_header(path).hash_name for path in paths}
+    if len(hash_names) > 1:
+        raise ValueError(
+            f"manifests use different hash algorithms: {', '.join(sorted(hash_names))}"
+        )
+    merged = heapq.merge(*(iter_scan(path) for path in paths), key=lambda r: r.key)
+    for _, group in itertools.groupby(merged, key=lambda r: r.key):
+        # a manifest passed twice, or rescans that overlap, list a file again
+        rows = list({(row.host, row.path): row for row in group}.values())
+        if len(rows) > 1:
+            yield rows
@@ -0,0 +1,185 @@
+import functools
+from collections.abc import Callable, Iterable, Iterator
+from typing import TYPE_CHECKING
+
+from lib.imaging import open_image
+from lib.profiler import STAGE_THUMBNAILS, profiled
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# NumPy and Pillow are imported by the functions that use them, so the CLI can
+# import this module for its defaults without loading them
+
+# Side of the hash grid, hashes have HASH_SIZE * HASH_SIZE = 64 bits
+HASH_SIZE = 8
+# pHash runs its DCT over a larger thumbnail and keeps the low frequencies
+PHASH_IMAGE_SIZE = 32
+# Images downscaled and hashed together per NumPy call
+SIMILAR_BATCH_SIZE = 256
+DEFAULT_SIMILAR_THRESHOLD = 6
+
+
+@profiled(STAGE_THUMBNAILS)
+def load_thumbnail(path: str, width: int, height: int) -> "np.ndarray":
+    """
+    Returns a width x height grayscale thumbnail of an image as a float array.
+    JPEGs are decoded at a reduced scale with draft, so full size pixels are
+    never materialized for them.
+    """
+    import numpy as np
+    from PIL import Image as PILImage, ImageOps
+
+    with open_image(path) as image:
+        image.draft("L", (width * 4, height * 4))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize((width, height), PILImage.Resampling.BOX)
+        return np.asarray(image, dtype=np.float32)
+
+
+def _pack_bits(bits: "np.ndarray") -> list[int]:
+    """Packs an (n, 64) boolean array into n 64 bit ints, first bit highest."""
+    import numpy as np
+
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int(value) for value in packed.view(">u8").ravel()]
+
+
+def dhash_batch(thumbnails: "np.ndarray") -> list[int]:
+    """
+    Difference hashes of a stack of HASH_SIZE x (HASH_SIZE + 1) thumbnails:
+    one bit per pixel, set if it's brighter than its right neighbour.
+    """
+    return _pack_bits(thumbnails[:, :, 1:] > thumbnails[:, :, :-1])
+
+
+@functools.cache
+def _dct_matrix(size: int) -> "np.ndarray":
+    import numpy as np
+
+    k = np.arange(size)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    matrix[0] *= np.sqrt(1 / size)
+    matrix[1:] *= np.sqrt(2 / size)
+    return matrix
+
+
+def phash_batch(thumbnails: "np.ndarray") -> list[int]:
+    """
+    Perceptual hashes of a stack of PHASH_IMAGE_SIZE x PHASH_IMAGE_SIZE
+    thumbnails: one bit per low frequency DCT coefficient, set if it's above
+    the median of those coefficients.
+    """
+    import numpy as np
+
+    dct = _dct_matrix(PHASH_IMAGE_SIZE)
+    coefficients = dct @ thumbnails @ dct.T
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE]
+    medians = np.median(low.reshape(len(low), -1), axis=1)
+    return _pack_bits(low > medians[:, None, None])
+
+
+HashBatch = Callable[["np.ndarray"], list[int]]
+
+# name -> (thumbnail width, thumbnail height, batch hash function)
+PERCEPTUAL_HASHES: dict[str, tuple[int, int, HashBatch]] = {
+    "dhash": (HASH_SIZE + 1, HASH_SIZE, dhash_batch),
+    "phash": (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE, phash_batch),
+}
+DEFAULT_PERCEPTUAL_HASH = "dhash"
+
+
+def get_perceptual_hash(name: str) -> tuple[int, int, HashBatch]:
+    try:
+        return PERCEPTUAL_HASHES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown perceptual hash {name}, expected one of {', '.join(PERCEPTUAL_HASHES)}"
+        ) from None
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64 bit hashes with the Hamming distance as metric.
+    A query for everything within a small threshold only visits the children
+    whose edge distance is within threshold of the query's distance to their
+    parent, instead of comparing against every hash.
+    """
+
+    def __init__(self):
+        # node: (hash, values stored under that hash, children keyed by distance)
+        self.root: tuple[int, list[int], dict[int, tuple]] | None = None
+
+    def add(self, hash_value: int, value: int):
+        if self.root is None:
+            self.root = (hash_value, [value], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (hash_value, [value], {})
+                return
+            node = child
+
+    def query(self, hash_value: int, threshold: int) -> Iterator[tuple[int, int]]:
+        """Yields (value, distance) for every stored hash within threshold."""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_hash, values, children = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= threshold:
+                for value in values:
+                    yield value, distance
+            for edge, child in children.items():
+                if distance - threshold <= edge <= distance + threshold:
+                    stack.append(child)
+
+
+def group_similar(hashes: Iterable[int], threshold: int) -> list[list[int]]:
+    """
+    Groups the indices of hashes that are within threshold of each other,
+    transitively. Identical hashes are only inserted into the tree once, and
+    every distinct hash is queried once. Groups are sorted by their first index.
+    """
+    indices_by_hash: dict[int, list[int]] = {}
+    for i, hash_value in enumerate(hashes):
+        indices_by_hash.setdefault(hash_value, []).append(i)
+
+    distinct = list(indices_by_hash)
+    tree = BKTree()
+    for i, hash_value in enumerate(distinct):
+        tree.add(hash_value, i)
+
+    parents = list(range(len(distinct)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    if threshold > 0:
+        for i, hash_value in enumerate(distinct):
+            for j, _ in tree.query(hash_value, threshold):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups: dict[int, list[int]] = {}
+    for i, hash_value in enumerate(distinct):
+        groups.setdefault(find(i), []).extend(indices_by_hash[hash_value])
+    return sorted(
+        (sorted(group) for group in groups.values() if len(group) > 1),
+        key=lambda group: group[0],
+    )
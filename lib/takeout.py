@@ -0,0 +1,175 @@
+import io
+import json
+import os
+import re
+import zipfile
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
+from itertools import groupby
+from typing import IO, BinaryIO
+
+from lib.walk import FileEntry
+
+SIDECAR_EXTENSION = ".json"
+# Takeout cuts sidecar names down to this many characters before ".json"
+TRUNCATED_STEM_LENGTH = 46
+# newer exports add this before ".json", and it gets cut short like the rest
+SUPPLEMENTAL_SUFFIX = "supplemental-metadata"
+# edited copies share the sidecar of their original
+EDITED_SUFFIX = "-edited"
+
+_COPY_NUMBER = re.compile(r"(.*)\((\d+)\)")
+
+SidecarKey = tuple[str, int]
+Opener = Callable[[str], IO[bytes]]
+
+
+def is_sidecar(path: str) -> bool:
+    return path.lower().endswith(SIDECAR_EXTENSION)
+
+
+def _split_copy_number(name: str) -> SidecarKey:
+    """Splits "IMG(1)" into ("IMG", 1), names without a copy number get 0."""
+    match = _COPY_NUMBER.fullmatch(name)
+    if match is None:
+        return name, 0
+    return match[1], int(match[2])
+
+
+def _sidecar_key(name: str) -> tuple[SidecarKey, bool]:
+    """
+    Returns the media name and copy number a sidecar name refers to, and
+    whether the name may have been truncated, in which case the media name is
+    only a prefix of the real one.
+    """
+    stem, copy = _split_copy_number(name[: -len(SIDECAR_EXTENSION)])
+    truncated = len(stem) >= TRUNCATED_STEM_LENGTH
+    base, dot, suffix = stem.rpartition(".")
+    if dot and base and SUPPLEMENTAL_SUFFIX.startswith(suffix):
+        stem = base
+    return (stem, copy), truncated
+
+
+def _media_keys(name: str) -> list[SidecarKey]:
+    """
+    Returns the sidecar keys a media file may be found under, best first:
+    "IMG(1).jpg" for "IMG(1).jpg.json", "IMG.jpg" with copy 1 for
+    "IMG.jpg(1).json", and the same without the extension. Edited copies
+    also try the name of their original.
+    """
+    keys = [(name, 0)]
+    root, ext = os.path.splitext(name)
+    root, copy = _split_copy_number(root)
+    for original in dict.fromkeys([root, root.removesuffix(EDITED_SUFFIX)]):
+        keys += [(original + ext, copy), (original, copy)]
+    return list(dict.fromkeys(keys))
+
+
+def _open_file(path: str) -> BinaryIO:
+    # sidecars are read whole by json.load, so there is nothing to buffer
+    return io.FileIO(path)
+
+
+def read_taken_time(sidecar_path: str, opener: Opener = _open_file) -> datetime | None:
+    """Returns the photoTakenTime of a sidecar, None if it has none."""
+    try:
+        with opener(sidecar_path) as f:
+            data = json.load(f)
+        return datetime.fromtimestamp(int(data["photoTakenTime"]["timestamp"]))
+    except (
+        OSError,
+        ValueError,
+        KeyError,
+        TypeError,
+        OverflowError,
+        zipfile.BadZipFile,
+    ):
+        return None
+
+
+class _DirectorySidecars:
+    def __init__(self):
+        self.exact: dict[SidecarKey, str] = {}
+        self.truncated: dict[SidecarKey, str] = {}
+
+    def add(self, path: str):
+        key, truncated = _sidecar_key(os.path.basename(path))
+        self.exact.setdefault(key, path)
+        if truncated:
+            self.truncated.setdefault(key, path)
+
+    def find(self, name: str) -> str | None:
+        keys = _media_keys(name)
+        for key in keys:
+            if key in self.exact:
+                return self.exact[key]
+        if not self.truncated:
+            return None
+        for media_name, copy in keys:
+            for length in range(min(len(media_name), TRUNCATED_STEM_LENGTH), 0, -1):
+                sidecar = self.truncated.get((media_name[:length], copy))
+                if sidecar is not None:
+                    return sidecar
+        return None
+
+
+class SidecarIndex:
+    """
+    Maps media files to the JSON sidecars of a Google Takeout export, so
+    their dates can be read without opening the media files. Sidecars are
+    matched by name within a directory, including Takeout's quirks: names cut
+    short at 46 characters, copy numbers moved behind the extension
+    ("IMG.jpg(1).json" for "IMG(1).jpg"), "supplemental-metadata" suffixes
+    and edited copies. Each sidecar is parsed at most once.
+
+    Sidecars are opened with opener, e.g. to read them out of an archive.
+    """
+
+    def __init__(self, opener: Opener = _open_file):
+        self.opener = opener
+        self._dirs: dict[str, _DirectorySidecars] = {}
+        self._taken_times: dict[str, datetime | None] = {}
+
+    def __len__(self) -> int:
+        return sum(len(d.exact) for d in self._dirs.values())
+
+    def add(self, path: str):
+        directory = os.path.dirname(path)
+        sidecars = self._dirs.get(directory)
+        if sidecars is None:
+            sidecars = self._dirs[directory] = _DirectorySidecars()
+        sidecars.add(path)
+
+    def split(self, entries: Iterable[FileEntry]) -> Iterator[FileEntry]:
+        """
+        Adds the sidecars of a listing to the index and yields the other
+        files. Entries of a directory must be listed together, as iter_files
+        does, and are held back until the directory is done, so every
+        sidecar is known before its media file is yielded.
+        """
+        for _, directory_entries in groupby(
+            entries, key=lambda entry: os.path.dirname(entry.path)
+        ):
+            media: list[FileEntry] = []
+            for entry in directory_entries:
+                if is_sidecar(entry.path):
+                    self.add(entry.path)
+                else:
+                    media.append(entry)
+            yield from media
+
+    def find(self, path: str) -> str | None:
+        """Returns the sidecar of a media file, if there is one."""
+        sidecars = self._dirs.get(os.path.dirname(path))
+        if sidecars is None:
+            return None
+        return sidecars.find(os.path.basename(path))
+
+    def taken_time(self, path: str) -> datetime | None:
+        """Returns the photoTakenTime from the sidecar of a media file."""
+        sidecar = self.find(path)
+        if sidecar is None:
+            return None
+        if sidecar not in self._taken_times:
+            self._taken_times[sidecar] = read_taken_time(sidecar, self.opener)
+        return self._taken_times[sidecar]
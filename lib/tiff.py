@@ -1,43 +1,164 @@
-"""UNDER CONSTRUCTION"""
-
 import struct
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any
 
+from lib.reader import HeaderReader, ReadAt
+from lib.xmp import parse_xmp_datetime
+
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+TAG_XMP = 0x02BC
+
+TYPE_BYTE = 1
+TYPE_ASCII = 2
+TYPE_LONG = 4
+TYPE_UNDEFINED = 7
+TYPE_IFD = 13
+
+IFD_ENTRY_SIZE = 12
+# Real files have a few dozen entries per IFD, anything larger is corrupt
+MAX_IFD_ENTRIES = 1024
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+# Enough for the header, IFD0 and the Exif IFD of typical files
+TIFF_HEADER_READ_SIZE = 4096
+# XMP packets are a few KB, anything larger isn't worth reading for a date
+MAX_XMP_SIZE = 1 << 20
+
+
+def _read_exact(read_at: ReadAt, offset: int, length: int) -> bytes:
+    data = read_at(offset, length)
+    if len(data) != length:
+        raise ValueError(f"Truncated TIFF data at offset {offset}")
+    return data
+
+
+def _read_ifd(read_at: ReadAt, offset: int, endian: str) -> dict[int, bytes]:
+    """
+    Reads the IFD at offset and returns the raw 12 byte entries keyed by tag.
+    """
+    num_entries = struct.unpack(endian + "H", _read_exact(read_at, offset, 2))[0]
+    if num_entries > MAX_IFD_ENTRIES:
+        raise ValueError(f"Too many IFD entries ({num_entries})")
+    data = _read_exact(read_at, offset + 2, num_entries * IFD_ENTRY_SIZE)
+    return {
+        struct.unpack(endian + "H", data[i : i + 2])[0]: data[i : i + IFD_ENTRY_SIZE]
+        for i in range(0, len(data), IFD_ENTRY_SIZE)
+    }
+
+
+def _read_ascii(read_at: ReadAt, entry: bytes, endian: str) -> str | None:
+    _, type_, count = struct.unpack(endian + "HHI", entry[:8])
+    if type_ != TYPE_ASCII or count == 0:
+        return None
+    if count <= 4:
+        value = entry[8 : 8 + count]
+    else:
+        offset = struct.unpack(endian + "I", entry[8:12])[0]
+        value = _read_exact(read_at, offset, count)
+    return value.split(b"\x00")[0].decode("ascii", errors="replace").strip()
+
+
+def _read_xmp(read_at: ReadAt, entry: bytes, endian: str) -> bytes | None:
+    _, type_, count = struct.unpack(endian + "HHI", entry[:8])
+    if type_ not in (TYPE_BYTE, TYPE_UNDEFINED) or count == 0 or count > MAX_XMP_SIZE:
+        return None
+    if count <= 4:
+        return entry[8 : 8 + count]
+    offset = struct.unpack(endian + "I", entry[8:12])[0]
+    return _read_exact(read_at, offset, count)
 
-def get_tiff_timestamp(q_path: str):
-    with open(q_path, "rb") as f:
-        header = f.read(8)
-        print(header)
-
-        # Detect byte order (II = Intel / little-endian, MM = Motorola / big-endian)
-        byte_order = header[0:2]
-        endian = "<" if byte_order == b"II" else ">"
-
-        # Confirm TIFF format (should be 42 as uint16)
-        tiff_id = struct.unpack(endian + "H", header[2:4])[0]
-        print(tiff_id)
-        if tiff_id != 42:
-            raise ValueError("Not a valid TIFF file.")
-
-        # Offset to first IFD (Image File Directory)
-        ifd_offset = struct.unpack(endian + "I", header[4:8])[0]
-        f.seek(ifd_offset)
-
-        # Number of directory entries
-        num_entries = struct.unpack(endian + "H", f.read(2))[0]
-        print(num_entries)
-
-        for _ in range(num_entries):
-            entry = f.read(12)
-            print(entry)
-            tag, type_, count, value_offset = struct.unpack(endian + "HHII", entry)
-            print(tag)
-            if tag == 0x0132:  # DateTime tag
-                print(tag)
-                if type_ == 2:  # ASCII
-                    f.seek(value_offset)
-                    datetime_str = f.read(count).split(b"\x00")[0].decode("ascii")
-                    print(datetime_str)
-                    return None
-                    return datetime_str
 
+def _parse_datetime(value: str | None) -> datetime | None:
+    if not value:
         return None
+    try:
+        return datetime.strptime(value[:19], EXIF_DATETIME_FORMAT)
+    except ValueError:
+        # unset dates are often written as "0000:00:00 00:00:00" or blanks
+        return None
+
+
+def parse_tiff_datetime(read_at: ReadAt) -> datetime | None:
+    """
+    Walks the IFDs of TIFF structured data (TIFF, NEF, or the Exif payload of
+    JPEG/HEIC files) and returns DateTimeOriginal from the Exif IFD, falling back
+    to DateTimeDigitized, the DateTime tag of IFD0 and then the XMP packet
+    of IFD0.
+
+    Offsets given to read_at are relative to the start of the TIFF header.
+    Returns None if the data has no usable date and raises ValueError if it
+    isn't valid TIFF data.
+    """
+    header = _read_exact(read_at, 0, 8)
+    if header[0:2] == b"II":
+        endian = "<"
+    elif header[0:2] == b"MM":
+        endian = ">"
+    else:
+        raise ValueError("Not a valid TIFF byte order")
+
+    tiff_id, ifd_offset = struct.unpack(endian + "HI", header[2:8])
+    if tiff_id != 42:
+        raise ValueError("Not a valid TIFF file.")
+
+    ifd0 = _read_ifd(read_at, ifd_offset, endian)
+    candidates: list[datetime | None] = []
+
+    exif_entry = ifd0.get(TAG_EXIF_IFD)
+    if exif_entry is not None:
+        _, type_, _, exif_offset = struct.unpack(endian + "HHII", exif_entry)
+        if type_ in (TYPE_LONG, TYPE_IFD):
+            exif_ifd = _read_ifd(read_at, exif_offset, endian)
+            for tag in (TAG_DATETIME_ORIGINAL, TAG_DATETIME_DIGITIZED):
+                if tag in exif_ifd:
+                    candidates.append(
+                        _parse_datetime(_read_ascii(read_at, exif_ifd[tag], endian))
+                    )
+
+    if TAG_DATETIME in ifd0:
+        candidates.append(
+            _parse_datetime(_read_ascii(read_at, ifd0[TAG_DATETIME], endian))
+        )
+
+    created_date = next((dt for dt in candidates if dt is not None), None)
+    if created_date is None and TAG_XMP in ifd0:
+        xmp = _read_xmp(read_at, ifd0[TAG_XMP], endian)
+        if xmp is not None:
+            return parse_xmp_datetime(xmp)
+    return created_date
+
+
+def pick_exif_datetime(
+    ifd0: Mapping[int, Any], exif_ifd: Mapping[int, Any]
+) -> datetime | None:
+    """
+    Returns the date parse_tiff_datetime would pick from IFDs that were
+    already parsed, e.g. by Pillow's getexif.
+    """
+    for value in (
+        exif_ifd.get(TAG_DATETIME_ORIGINAL),
+        exif_ifd.get(TAG_DATETIME_DIGITIZED),
+        ifd0.get(TAG_DATETIME),
+    ):
+        if isinstance(value, str):
+            created_date = _parse_datetime(value.split("\x00")[0].strip())
+            if created_date is not None:
+                return created_date
+    return None
+
+
+def get_tiff_timestamp(
+    q_path: str, reader: HeaderReader | None = None
+) -> datetime | None:
+    """
+    Returns the created datetime of a TIFF based file (tif, nef, ...) by reading
+    only its header and the IFDs that hold the date tags. An open reader over the
+    file can be passed in to reuse its prefetched header.
+    """
+    if reader is not None:
+        return parse_tiff_datetime(reader.read_at)
+    with open(q_path, "rb") as f:
+        return parse_tiff_datetime(HeaderReader(f, TIFF_HEADER_READ_SIZE).read_at)
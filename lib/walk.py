@@ -0,0 +1,62 @@
+import os
+from collections.abc import Iterator
+from typing import NamedTuple
+
+from lib.logger import get_logger
+
+logger = get_logger()
+
+
+class FileEntry(NamedTuple):
+    """A file found while walking a directory, along with its stat result."""
+
+    path: str
+    stat: os.stat_result
+    is_symlink: bool = False
+
+
+def iter_files(
+    base_dir: str, recursive: bool = False, excluded: list[str] | None = None
+) -> Iterator[FileEntry]:
+    """
+    Lazily yields every file in base_dir using os.scandir, so callers can start
+    working before the listing is finished. Sub-directories are only descended
+    into if recursive is set, and symlinked directories are never followed.
+
+    Raises FileNotFoundError if base_dir doesn't exist. Entries that can't be
+    stat'ed are logged and skipped.
+    """
+    excluded = excluded or []
+    pending_dirs = [base_dir]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            scanner = os.scandir(current_dir)
+        except OSError:
+            if current_dir == base_dir:
+                raise
+            logger.warning("Failed to list directory", path=current_dir)
+            continue
+
+        sub_dirs: list[str] = []
+        with scanner:
+            for entry in scanner:
+                if entry.name in excluded:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.path)
+                        continue
+                    # follows symlinks, so linked files report the target's size
+                    st = entry.stat()
+                except OSError:
+                    # not accessible (permissions, broken symlink, etc) - pass on
+                    logger.warning("Insufficient permissions", path=entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                yield FileEntry(entry.path, st, entry.is_symlink())
+
+        if recursive:
+            # reversed so sub-directories are visited in listing order
+            pending_dirs.extend(reversed(sub_dirs))
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+XMP_DATE_TAGS = [b"photoshop:DateCreated", b"xmp:CreateDate"]
+
+
+def parse_xmp_datetime(xmp: bytes) -> datetime | None:
+    """
+    Returns the created datetime from an XMP packet, or None if it has none.
+    Both element (<tag>value</tag>) and attribute (tag="value") forms are read.
+    """
+    for tag in XMP_DATE_TAGS:
+        start = xmp.find(b"<" + tag + b">")
+        if start != -1:
+            start += len(tag) + 2
+            end = xmp.find(b"</" + tag + b">", start)
+        else:
+            start = xmp.find(tag + b'="')
+            if start == -1:
+                continue
+            start += len(tag) + 2
+            end = xmp.find(b'"', start)
+        if end == -1:
+            continue
+        try:
+            return datetime.fromisoformat(xmp[start:end].decode("utf-8").strip())
+        except ValueError:
+            continue
+    return None
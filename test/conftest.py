@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def make_files(tmp_path):
+    """
+    Returns a function that creates files in tmp_path and returns their paths.
+    Every file holds its name, repeated up to size bytes if a size is given,
+    so no two files have the same contents.
+    """
+
+    def make(
+        names: list[str], size: int | None = None, mtime: float | None = None
+    ) -> list[str]:
+        paths = []
+        for name in names:
+            path = tmp_path / name
+            data = name.encode()
+            if size is not None:
+                data = (data * (size // len(data) + 1))[:size]
+            path.write_bytes(data)
+            if mtime is not None:
+                os.utime(path, (mtime, mtime))
+            paths.append(str(path))
+        return paths
+
+    return make
@@ -0,0 +1,183 @@
+import json
+import os
+import time
+import zipfile
+from datetime import datetime
+
+import pytest
+from cli import app
+from PIL import Image
+from lib.archive import Archives, group_by_crc, is_archive
+from lib.main import Utils
+from typer.testing import CliRunner
+
+TAKEN = 1563192000
+
+
+def make_archive(path, members, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, "w", compression) as archive:
+        for name, source in members.items():
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                archive.write(source, name)
+    return str(path)
+
+
+def sidecar(timestamp=TAKEN) -> bytes:
+    return json.dumps({"photoTakenTime": {"timestamp": str(timestamp)}}).encode()
+
+
+class TestArchives:
+    def test_group_by_crc(self, tmp_path):
+        path = make_archive(
+            tmp_path / "a.zip",
+            {"a": b"same", "b": b"same", "c": b"diff", "d": b"other", "dir/": b""},
+        )
+        assert is_archive(path)
+        assert not is_archive(str(tmp_path))
+        with Archives([path]) as archives:
+            members = archives.members()
+            assert [m.name for m in members] == ["a", "b", "c", "d"]
+            groups = group_by_crc(members)
+            assert [[m.name for m in group] for group in groups] == [["a", "b"]]
+            assert archives.hash(members[0], "sha1") == archives.hash(
+                members[1], "sha1"
+            )
+            with archives.open_name("c") as f:
+                assert f.read() == b"diff"
+            with pytest.raises(FileNotFoundError):
+                archives.open_name("missing")
+
+    def test_find_duplicates(self, tmp_path):
+        path = make_archive(
+            tmp_path / "a.zip",
+            {
+                "x/dup1.png": "test/files/dup1.png",
+                "y/dup2.png": "test/files/dup2.png",
+                "jpeg_with_exif.jpeg": "test/files/jpeg_with_exif.jpeg",
+            },
+            zipfile.ZIP_STORED,
+        )
+        duplicates = Utils(base_dir=path).find_duplicates()
+        assert list(duplicates.values()) == [["dup1.png", "dup2.png"]]
+
+    def test_cli_rejects_unsupported_options(self, tmp_path):
+        path = make_archive(tmp_path / "a.zip", {"a.jpg": b"data"})
+        result = CliRunner().invoke(
+            app, ["find-duplicates", "--path", path, "--workers", "4", "--spill"]
+        )
+        assert result.exit_code == 2
+        assert "--workers, --spill" in result.output
+
+    def test_mutating_commands_reject_archives(self, tmp_path):
+        path = make_archive(tmp_path / "a.zip", {"a.jpg": b"data"})
+        with pytest.raises(ValueError, match="zip archive"):
+            Utils(base_dir=path).update_dates_from_metadata()
+        with pytest.raises(ValueError, match="zip archive"):
+            Utils(base_dir=path).correct_file_types()
+
+
+class TestExtractArchives:
+    def make_export(self, tmp_path):
+        first = make_archive(
+            tmp_path / "takeout-001.zip",
+            {
+                "Takeout/Google Photos/A/IMG_1.jpg": "test/files/jpeg_with_exif.jpeg",
+                "Takeout/Google Photos/A/IMG_2.jpg": "test/files/jpeg_without_exif.jpeg",
+                "Takeout/Google Photos/A/dup1.png": "test/files/dup1.png",
+                "Takeout/archive_browser.html": b"<html></html>",
+            },
+        )
+        # Takeout may put a sidecar in another part than its media file
+        second = make_archive(
+            tmp_path / "takeout-002.zip",
+            {
+                "Takeout/Google Photos/A/IMG_2.jpg.json": sidecar(),
+                "Takeout/Google Photos/B/IMG_1(1).jpg": "test/files/jpeg_with_exif.jpeg",
+                "Takeout/Google Photos/B/dup2.png": "test/files/dup2.png",
+            },
+        )
+        return [first, second]
+
+    def test_extract(self, tmp_path):
+        out = tmp_path / "out"
+        count = Utils(base_dir=str(out)).extract_archives(self.make_export(tmp_path))
+
+        # the duplicates and the html page are left out
+        assert count == 3
+        taken_name = datetime.fromtimestamp(TAKEN).strftime(
+            "%Y-%m-%dT%H-%M-%SR0001.jpg"
+        )
+        assert sorted(os.listdir(out)) == sorted(
+            [taken_name, "2024-07-27T18-07-51R0001.jpg", "dup1.png"]
+        )
+        assert os.stat(out / taken_name).st_mtime == TAKEN
+        with open(out / taken_name, "rb") as f, open(
+            "test/files/jpeg_without_exif.jpeg", "rb"
+        ) as original:
+            assert f.read() == original.read()
+        assert os.stat(out / "2024-07-27T18-07-51R0001.jpg").st_mtime == time.mktime(
+            datetime(2024, 7, 27, 18, 7, 51).timetuple()
+        )
+
+    def test_names_dont_collide(self, tmp_path):
+        out = tmp_path / "out"
+        out.mkdir()
+        (out / "2024-07-27T18-07-51R0001.jpg").write_bytes(b"")
+        Utils(base_dir=str(out)).extract_archives(self.make_export(tmp_path))
+        assert (out / "2024-07-27T18-07-51R0002.jpg").exists()
+
+    def test_dry_run(self, tmp_path):
+        out = tmp_path / "out"
+        count = Utils(base_dir=str(out), is_dry_run=True).extract_archives(
+            self.make_export(tmp_path)
+        )
+        assert count == 3
+        assert not out.exists()
+
+    def test_members_are_never_opened_by_path(self, tmp_path, monkeypatch):
+        def png(date: str) -> bytes:
+            exif = Image.Exif()
+            exif[0x0132] = date
+            path = tmp_path / "image.png"
+            Image.new("RGB", (1, 1)).save(path, exif=exif)
+            return path.read_bytes()
+
+        archive = make_archive(
+            tmp_path / "a.zip", {"photos/a.png": png("2019:05:06 07:08:09")}
+        )
+        # a local file where the member name points, relative to the cwd
+        (tmp_path / "photos").mkdir()
+        (tmp_path / "photos" / "a.png").write_bytes(png("2001:01:01 00:00:00"))
+        monkeypatch.chdir(tmp_path)
+
+        out = tmp_path / "out"
+        Utils(base_dir=str(out)).extract_archives([archive])
+        assert os.listdir(out) == ["2019-05-06T07-08-09R0001.png"]
+
+    def test_jpeg_segments_past_the_header_are_read_from_the_member(
+        self, tmp_path, monkeypatch
+    ):
+        def jpeg(date: str) -> bytes:
+            exif = Image.Exif()
+            exif[0x0132] = date
+            path = tmp_path / "image.jpeg"
+            Image.new("RGB", (1, 1)).save(path, exif=exif)
+            data = path.read_bytes()
+            # APP15 segments in front of the Exif one push it past the header
+            # read for organizing (ORGANIZE_HEADER_SIZE)
+            padding = 2 * (b"\xff\xef" + (40_002).to_bytes(2, "big") + bytes(40_000))
+            return data[:2] + padding + data[2:]
+
+        archive = make_archive(
+            tmp_path / "a.zip", {"photos/a.jpg": jpeg("2019:05:06 07:08:09")}
+        )
+        # a local file where the member name points, relative to the cwd
+        (tmp_path / "photos").mkdir()
+        (tmp_path / "photos" / "a.jpg").write_bytes(jpeg("2001:01:01 00:00:00"))
+        monkeypatch.chdir(tmp_path)
+
+        out = tmp_path / "out"
+        Utils(base_dir=str(out)).extract_archives([archive])
+        assert os.listdir(out) == ["2019-05-06T07-08-09R0001.jpg"]
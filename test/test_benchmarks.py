@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from benchmarks.corpus import CorpusConfig, generate_corpus
+from benchmarks.run import run_benchmarks
+from lib.main import Utils
+
+CONFIG = CorpusConfig(files=25, median_size=16 * 1024, duplicate_ratio=0.2)
+
+
+def read_corpus(path) -> dict[str, str]:
+    return {
+        name: hashlib.sha1((path / name).read_bytes()).hexdigest()
+        for name in sorted(os.listdir(path))
+    }
+
+
+class TestCorpus:
+    def test_reproducible(self, tmp_path):
+        stats = generate_corpus(str(tmp_path / "a"), CONFIG)
+        generate_corpus(str(tmp_path / "b"), CONFIG)
+        assert read_corpus(tmp_path / "a") == read_corpus(tmp_path / "b")
+        assert stats.files == 25
+        assert stats.bytes == sum(
+            os.path.getsize(tmp_path / "a" / name)
+            for name in os.listdir(tmp_path / "a")
+        )
+
+    def test_parsable(self, tmp_path):
+        generate_corpus(
+            str(tmp_path), CONFIG._replace(mislabel_ratio=0, metadata_ratio=1)
+        )
+        utils = Utils(base_dir=str(tmp_path), is_dry_run=True)
+        for q_path in utils.get_clean_file_list():
+            assert utils.get_file_created_date(q_path) is not None, q_path
+
+    def test_run_benchmarks(self, tmp_path):
+        corpus = str(tmp_path / "corpus")
+        generate_corpus(corpus, CONFIG)
+        report = run_benchmarks(corpus, ["find_duplicates"], repeat=1)
+        [result] = report["results"]
+        assert report["corpus"]["files"] == 25
+        assert result["command"] == "find_duplicates"
+        assert result["files_per_second"] > 0
+        assert result["peak_rss_bytes"] > 0
@@ -0,0 +1,58 @@
+import datetime
+import os
+from unittest.mock import patch
+
+from lib.cache import MetadataCache
+from lib.main import Utils
+
+
+class TestMetadataCache:
+    def test_round_trip(self, tmp_path):
+        file = tmp_path / "a.jpg"
+        file.write_bytes(b"abc")
+        st = os.stat(file)
+        cache = MetadataCache(str(tmp_path / "cache.sqlite3"))
+
+        assert cache.get_hash(st, "full") is None
+        assert cache.get_created_date(st) == (False, None)
+
+        cache.set_hash(str(file), st, "full", b"digest")
+        cache.set_file_type(str(file), st, "jpg")
+        cache.set_created_date(str(file), st, None)
+
+        assert cache.get_hash(st, "full") == b"digest"
+        assert cache.get_file_type(st) == "jpg"
+        assert cache.get_created_date(st) == (True, None)
+
+        cache.set_created_date(str(file), st, datetime.datetime(2024, 7, 27))
+        assert cache.get_created_date(st) == (True, datetime.datetime(2024, 7, 27))
+
+    def test_stale_entries_are_dropped(self, tmp_path):
+        file = tmp_path / "a.jpg"
+        file.write_bytes(b"abc")
+        cache = MetadataCache(str(tmp_path / "cache.sqlite3"))
+        cache.set_hash(str(file), os.stat(file), "full", b"digest")
+
+        file.write_bytes(b"abcd")
+        assert cache.get_hash(os.stat(file), "full") is None
+        assert cache.info()["entries"] == 0
+
+    def test_prune(self, tmp_path):
+        cache = MetadataCache(str(tmp_path / "cache.sqlite3"))
+        for name in ["a.jpg", "b.jpg", "c.jpg"]:
+            file = tmp_path / name
+            file.write_bytes(name.encode())
+            cache.set_file_type(str(file), os.stat(file), "jpg")
+
+        os.remove(tmp_path / "a.jpg")
+        assert cache.prune(max_entries=1) == 2
+        assert cache.info()["entries"] == 1
+
+    def test_find_duplicates_uses_cache(self, tmp_path):
+        cache = MetadataCache(str(tmp_path / "cache.sqlite3"))
+        utils = Utils(base_dir="./test/files", is_dry_run=True, cache=cache)
+        expected = utils.find_duplicates()
+
+        with patch.object(Utils, "_get_hash") as mock_get_hash:
+            assert utils.find_duplicates() == expected
+            mock_get_hash.assert_not_called()
@@ -0,0 +1,65 @@
+import os
+from unittest.mock import patch
+
+from lib import compare
+from lib.compare import split_identical
+from lib.hashing import MIN_READ_SIZE
+from lib.main import DuplicateConfirmation, Utils
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestSplitIdentical:
+    def test_groups(self, tmp_path):
+        block = b"x" * MIN_READ_SIZE
+        a = write(tmp_path / "a", block * 3)
+        b = write(tmp_path / "b", block * 2 + b"y" * MIN_READ_SIZE)
+        c = write(tmp_path / "c", block * 3)
+        d = write(tmp_path / "d", block * 2 + b"y" * MIN_READ_SIZE)
+        e = write(tmp_path / "e", b"z" * MIN_READ_SIZE * 3)
+        assert split_identical([a, b, c, d, e]) == [[a, c], [b, d]]
+
+    def test_stops_at_first_difference(self, tmp_path):
+        size = MIN_READ_SIZE * 10
+        a = write(tmp_path / "a", b"a" + bytes(size - 1))
+        b = write(tmp_path / "b", b"b" + bytes(size - 1))
+        reads = []
+        original = compare._GroupMember.read
+
+        def read(self, offset, size):
+            reads.append((self.path, offset))
+            return original(self, offset, size)
+
+        with patch.object(compare._GroupMember, "read", read):
+            assert split_identical([a, b], max_bytes_in_flight=0) == []
+        assert reads == [(a, 0), (b, 0)]
+
+    def test_unreadable_and_closed_files(self, tmp_path):
+        a = write(tmp_path / "a", b"same")
+        b = write(tmp_path / "b", b"same")
+        missing = str(tmp_path / "missing")
+        with patch.object(compare, "MAX_OPEN_FILES", 1):
+            assert split_identical([a, missing, b]) == [[a, b]]
+        assert split_identical([a]) == []
+
+
+class TestCompareConfirmation:
+    def test_same_duplicates_as_hashing(self):
+        base_dir = os.path.join(".", "test", "files")
+        logged = {}
+        for confirm in DuplicateConfirmation:
+            utils = Utils(base_dir=base_dir, is_dry_run=True, confirm=confirm)
+            with patch.object(utils, "log") as log:
+                utils.find_duplicates()
+            logged[confirm] = sorted(
+                (call.kwargs["filename"], call.kwargs["duplicate"])
+                for call in log.info.call_args_list
+                if call.args == ("Duplicate found",)
+            )
+        assert logged[DuplicateConfirmation.COMPARE]
+        assert (
+            logged[DuplicateConfirmation.COMPARE] == logged[DuplicateConfirmation.HASH]
+        )
@@ -0,0 +1,64 @@
+import os
+import random
+import shutil
+from unittest.mock import patch
+
+from lib.external import ExternalSorter, iter_groups
+from lib.main import Utils
+
+
+def logged_duplicates(utils):
+    with patch.object(utils, "log") as log:
+        utils.find_duplicates()
+    return sorted(
+        (call.kwargs["filename"], call.kwargs["duplicate"])
+        for call in log.info.call_args_list
+        if call.args[0] in ("Duplicate found", "Probable duplicate found")
+    )
+
+
+class TestExternalSorter:
+    def test_sorts_across_runs(self, tmp_path):
+        rng = random.Random(0)
+        records = [
+            (rng.randrange(20), f"path{i}\udce9", bytes([i % 7])) for i in range(100)
+        ]
+        with ExternalSorter(str(tmp_path), max_records=8) as sorter:
+            for record in records:
+                sorter.add(record)
+            assert sorter.run_count == 12
+            assert list(sorter.sorted()) == sorted(records)
+        assert os.listdir(tmp_path) == []
+
+    def test_iter_groups(self):
+        records = [(1, "a"), (1, "b"), (2, "c"), (3, "d"), (3, "e"), (3, "f")]
+        assert list(iter_groups(records, 1)) == [
+            [(1, "a"), (1, "b")],
+            [(3, "d"), (3, "e"), (3, "f")],
+        ]
+
+
+class TestSpill:
+    def test_same_duplicates_as_in_memory(self, tmp_path):
+        base_dir = tmp_path / "files"
+        shutil.copytree(os.path.join("test", "files"), base_dir)
+        shutil.copy(base_dir / "dup1.png", base_dir / "dup3.png")
+        expected = logged_duplicates(Utils(base_dir=str(base_dir), is_dry_run=True))
+        assert len(expected) == 3
+
+        spilled = Utils(
+            base_dir=str(base_dir),
+            is_dry_run=True,
+            spill=True,
+            spill_dir=str(tmp_path),
+            spill_records=2,
+        )
+        assert logged_duplicates(spilled) == expected
+        assert sorted(os.listdir(tmp_path)) == ["files"]
+
+    def test_sampled_only(self):
+        base_dir = os.path.join(".", "test", "files")
+        spilled = Utils(base_dir=base_dir, sampled_only=True, spill=True)
+        assert logged_duplicates(spilled) == logged_duplicates(
+            Utils(base_dir=base_dir, sampled_only=True)
+        )
@@ -0,0 +1,94 @@
+import hashlib
+import zlib
+
+import pytest
+from unittest.mock import patch
+
+from lib.hashing import (
+    HASH_ALGORITHMS,
+    MAX_READ_SIZE,
+    MIN_READ_SIZE,
+    get_read_size,
+    get_sample_offsets,
+    hash_file,
+    register_hash_algorithm,
+)
+from lib.main import Utils
+
+
+class Crc32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, "big")
+
+
+class TestHashing:
+    @pytest.mark.parametrize("algorithm", ["sha1", "sha256", "blake2b"])
+    def test_hash_file(self, algorithm):
+        path = "./test/files/jpeg_with_exif.jpeg"
+        with open(path, "rb") as f:
+            expected = hashlib.new(algorithm, f.read()).digest()
+        assert hash_file(path, algorithm, max_read_size=MIN_READ_SIZE) == expected
+
+    def test_get_read_size(self):
+        assert get_read_size(0) == MIN_READ_SIZE
+        assert get_read_size(4 * 1024**3) == MAX_READ_SIZE
+        assert get_read_size(4 * 1024**3, max_read_size=1024**2) == 1024**2
+
+    def test_register_hash_algorithm(self):
+        register_hash_algorithm("crc32", Crc32)
+        try:
+            path = "./test/files/dup1.png"
+            with open(path, "rb") as f:
+                expected = zlib.crc32(f.read()).to_bytes(4, "big")
+            assert hash_file(path, "crc32") == expected
+            assert (
+                Utils(base_dir="./test/files", hash_name="crc32").find_duplicates()
+                == Utils(base_dir="./test/files").find_duplicates()
+            )
+        finally:
+            del HASH_ALGORITHMS["crc32"]
+
+    def test_unknown_algorithm(self):
+        with pytest.raises(ValueError):
+            Utils(base_dir="./test/files", hash_name="md9")
+
+    def test_get_sample_offsets(self):
+        assert get_sample_offsets(10_000, 1, 1000) == [0, 4500, 9000]
+        assert get_sample_offsets(10_000, 2, 1000) == [0, 3000, 4500, 6000, 9000]
+
+    def test_sampled_stage_rejects_same_header(self, tmp_path):
+        header = b"\x00" * 64 * 1024
+        (tmp_path / "a.mp4").write_bytes(header + b"a" * 1024 * 1024)
+        (tmp_path / "b.mp4").write_bytes(header + b"b" * 1024 * 1024)
+
+        with patch("lib.main.hash_file") as mock_hash_file:
+            assert Utils(base_dir=str(tmp_path)).find_duplicates() == {
+                len(header) + 1024 * 1024: ["a.mp4", "b.mp4"]
+            }
+            mock_hash_file.assert_not_called()
+
+    @pytest.mark.parametrize("sampled_only", [False, True])
+    def test_sampled_stage_keeps_duplicates(self, sampled_only):
+        utils = Utils(base_dir="./test/files", sampled_only=sampled_only)
+        with patch.object(utils, "log") as mock_log:
+            utils.find_duplicates()
+        duplicates = [
+            sorted(
+                [
+                    c.kwargs["filename"].split("/")[-1],
+                    c.kwargs["duplicate"].split("/")[-1],
+                ]
+            )
+            for c in mock_log.info.call_args_list
+            if "duplicate" in c.kwargs
+        ]
+        assert sorted(duplicates) == [
+            ["dup1.png", "dup2.png"],
+            ["png.jpeg", "png_without_exif.png"],
+        ]
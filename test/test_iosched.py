@@ -0,0 +1,98 @@
+import os
+from unittest.mock import patch
+
+from lib import iosched
+from lib.cache import MetadataCache
+from lib.iosched import IOOrder, io_sort_key, physical_offset, tune_workers
+from lib.main import HashStage, MetadataKind, Utils
+from lib.walk import FileEntry
+
+
+def numbered(count):
+    return [f"{i:03d}.bin" for i in range(count)]
+
+
+class TestOrder:
+    def test_physical_offset(self, tmp_path, make_files):
+        (path,) = make_files(numbered(1), size=5000)
+        os.sync()
+        offset = physical_offset(path)
+        assert offset is None or offset >= 0
+        (tmp_path / "empty").write_bytes(b"")
+        assert physical_offset(str(tmp_path / "empty")) is None
+        assert physical_offset(str(tmp_path / "missing")) is None
+
+    def test_sort_keys(self, make_files):
+        (path,) = make_files(numbered(1), size=5000)
+        st = os.stat(path)
+        assert io_sort_key(path, st, IOOrder.LISTING) == ()
+        assert io_sort_key(path, st, IOOrder.INODE) == (st.st_dev, st.st_ino)
+        assert io_sort_key(path, st, IOOrder.EXTENT)[0] == st.st_dev
+
+    def test_hashes_in_inode_order(self, tmp_path, make_files):
+        make_files(numbered(6), size=5000)
+        hashed = []
+        original = Utils._hash_stage
+
+        def record(self, filename, stage):
+            if stage == HashStage.SMALL:
+                hashed.append(filename)
+            return original(self, filename, stage)
+
+        with patch.object(Utils, "_hash_stage", record):
+            Utils(base_dir=str(tmp_path), io_order=IOOrder.INODE).find_duplicates()
+        assert len(hashed) == 6
+        assert hashed == sorted(hashed, key=lambda path: os.stat(path).st_ino)
+
+    def test_metadata_in_listing_order(self, tmp_path, make_files):
+        # listed in reverse inode order
+        paths = sorted(
+            make_files(numbered(6), size=5000),
+            key=lambda path: os.stat(path).st_ino,
+            reverse=True,
+        )
+        entries = [FileEntry(path, os.stat(path)) for path in paths]
+        cache = MetadataCache(str(tmp_path / "cache.sqlite3"))
+        cache.set_created_date(paths[0], entries[0].stat, None)
+        utils = Utils(base_dir=str(tmp_path), io_order=IOOrder.INODE, cache=cache)
+
+        parsed = []
+        with patch.object(
+            Utils,
+            "_parse_file_created_date",
+            autospec=True,
+            side_effect=lambda self, path, reader=None: parsed.append(path),
+        ), patch("lib.main.io_sort_key", wraps=io_sort_key) as sort_key:
+            results = list(utils._iter_metadata(entries, MetadataKind.CREATED_DATE))
+        assert [entry.path for entry, _ in results] == paths
+        assert parsed == paths[:0:-1]
+        # the cached file isn't read, so its location isn't needed
+        assert sorted(call.args[0] for call in sort_key.call_args_list) == sorted(
+            paths[1:]
+        )
+
+
+class TestTuneWorkers:
+    def test_rotational_disks_get_one_worker(self, make_files):
+        paths = make_files(numbered(8), size=5000)
+        with patch.object(iosched, "is_rotational", return_value=True):
+            assert tune_workers(paths) == 1
+
+    def test_stops_when_more_workers_stop_paying_off(self, make_files):
+        paths = make_files(numbered(64), size=10)
+        rates = {1: 100.0, 2: 190.0, 4: 400.0, 8: 420.0, 16: 1000.0}
+        measure = lambda sample, workers: rates[workers]  # noqa: E731
+        with patch.object(iosched, "is_rotational", return_value=False), patch.object(
+            iosched, "_measure", measure
+        ):
+            assert tune_workers(paths) == 4
+            # not enough files to measure past 2 workers
+            assert tune_workers(paths[:8]) == 2
+
+    def test_utils_tunes_once(self, tmp_path, make_files):
+        make_files(numbered(4), size=5000)
+        utils = Utils(base_dir=str(tmp_path), workers=0)
+        with patch("lib.main.tune_workers", return_value=3) as tune:
+            utils.find_duplicates()
+        tune.assert_called_once()
+        assert utils.workers == 3
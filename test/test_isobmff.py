@@ -0,0 +1,78 @@
+import datetime
+import struct
+from unittest.mock import patch
+
+import pytest
+from lib.isobmff import EPOCH_ADJUSTER, get_heic_timestamp, get_isobmff_timestamp
+from lib.main import Utils
+
+
+def build_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def build_mp4(created: datetime.datetime, version: int) -> bytes:
+    timestamp = int(created.timestamp()) + EPOCH_ADJUSTER
+    times = (
+        struct.pack(">QQ", timestamp, timestamp)
+        if version == 1
+        else struct.pack(">II", timestamp, timestamp)
+    )
+    mvhd = build_box(b"mvhd", bytes([version, 0, 0, 0]) + times + b"\x00" * 80)
+    return (
+        build_box(b"ftyp", b"isom\x00\x00\x02\x00")
+        + build_box(b"mdat", b"\x00" * 100)
+        + build_box(b"moov", mvhd)
+    )
+
+
+class TestIsobmff:
+    @pytest.mark.parametrize("version", [0, 1])
+    def test_mvhd_versions(self, tmp_path, version):
+        created = datetime.datetime(2023, 1, 2, 3, 4, 5)
+        path = tmp_path / "video.mp4"
+        path.write_bytes(build_mp4(created, version))
+        assert get_isobmff_timestamp(str(path)) == created
+
+    def test_truncated_file(self, tmp_path):
+        path = tmp_path / "video.mp4"
+        path.write_bytes(build_mp4(datetime.datetime(2023, 1, 2), 0)[:-20])
+        with pytest.raises(ValueError):
+            get_isobmff_timestamp(str(path))
+
+    def test_missing_moov(self, tmp_path):
+        path = tmp_path / "video.mp4"
+        path.write_bytes(build_box(b"ftyp", b"isom\x00\x00\x02\x00"))
+        assert get_isobmff_timestamp(str(path)) is None
+        path.write_bytes(b"")
+        assert get_isobmff_timestamp(str(path)) is None
+
+    @pytest.mark.parametrize("infe", [b"", b"\x02\x00\x00\x00\x00"])
+    def test_truncated_infe(self, tmp_path, infe):
+        iinf = build_box(
+            b"iinf", b"\x00\x00\x00\x00\x00\x01" + build_box(b"infe", infe)
+        )
+        iloc = build_box(b"iloc", b"\x00" * 8)
+        path = tmp_path / "image.heic"
+        path.write_bytes(build_box(b"meta", b"\x00\x00\x00\x00" + iinf + iloc))
+        with pytest.raises(ValueError):
+            get_heic_timestamp(str(path))
+
+    @pytest.mark.parametrize(
+        "file_path, expected_date",
+        [
+            (
+                "./test/files/heic_with_exif.heic",
+                datetime.datetime(2024, 7, 27, 18, 7, 51),
+            ),
+            ("./test/files/heic_without_exif.heic", None),
+        ],
+    )
+    def test_heic_skips_pil(self, file_path, expected_date):
+        assert get_heic_timestamp(file_path) == expected_date
+        with patch("lib.main.open_image") as mock_open:
+            assert (
+                Utils(base_dir="./test/files").get_file_created_date(file_path)
+                == expected_date
+            )
+            mock_open.assert_not_called()
@@ -0,0 +1,61 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+from lib.jpg import (
+    MARKER_APP1,
+    get_jfif_app0_segment,
+    get_jpg_datetime,
+    iter_jpeg_segments,
+)
+from lib.main import Utils
+
+
+def build_segment(marker: int, payload: bytes) -> bytes:
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+class TestJpg:
+    def test_iter_jpeg_segments(self):
+        with open("./test/files/jpeg_with_exif.jpeg", "rb") as f:
+            data = f.read()
+        segments = list(iter_jpeg_segments(data))
+        assert segments[0].marker == MARKER_APP1
+        assert data[segments[0].offset : segments[0].offset + 6] == b"Exif\x00\x00"
+
+    def test_truncated_segment(self):
+        data = b"\xff\xd8" + build_segment(MARKER_APP1, b"Exif\x00\x00" + b"\x00" * 20)
+        with pytest.raises(ValueError):
+            list(iter_jpeg_segments(data[:-4]))
+
+    def test_xmp_fallback(self):
+        xmp = (
+            b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta>"
+            b"<photoshop:DateCreated>2021-03-04T05:06:07</photoshop:DateCreated>"
+            b"</x:xmpmeta>"
+        )
+        data = b"\xff\xd8" + build_segment(MARKER_APP1, xmp) + b"\xff\xda"
+        assert get_jpg_datetime(data) == datetime.datetime(2021, 3, 4, 5, 6, 7)
+
+    def test_get_jfif_app0_segment(self):
+        segment = get_jfif_app0_segment("./test/files/jpeg_without_exif.jpeg")
+        assert segment is not None and segment.startswith(b"JFIF\x00")
+        assert get_jfif_app0_segment("./test/files/jpeg_with_exif.jpeg") is None
+
+    @pytest.mark.parametrize(
+        "file_path, expected_date",
+        [
+            (
+                "./test/files/jpeg_with_exif.jpeg",
+                datetime.datetime(2024, 7, 27, 18, 7, 51),
+            ),
+            ("./test/files/jpeg_without_exif.jpeg", None),
+        ],
+    )
+    def test_get_file_created_date_skips_pil(self, file_path, expected_date):
+        with patch("lib.main.open_image") as mock_open:
+            assert (
+                Utils(base_dir="./test/files").get_file_created_date(file_path)
+                == expected_date
+            )
+            mock_open.assert_not_called()
@@ -0,0 +1,90 @@
+import json
+import re
+from unittest.mock import patch
+
+import pytest
+from lib.logger import (
+    EVENT_QUEUE_BATCHES,
+    EventWriter,
+    Timestamp,
+    close_logging,
+    configure_logging,
+    get_logger,
+)
+from lib.main import Utils
+
+
+@pytest.fixture
+def restore_logging():
+    try:
+        yield
+    finally:
+        close_logging()
+
+
+class TestLogging:
+    def test_events_file(self, tmp_path, capsys, restore_logging):
+        events_path = tmp_path / "events.jsonl"
+        configure_logging(str(events_path), sample_every=0)
+        file_logger = get_logger(per_file=True)
+        for i in range(3):
+            file_logger.info("Renamed", src=f"{i}.jpg", dst=f"{i}.jpeg")
+        file_logger.warning("Rename target already exists", src="3.jpg")
+        get_logger().info("Found files", count=4)
+        close_logging()
+
+        events = [json.loads(line) for line in events_path.read_text().splitlines()]
+        assert [e["event"] for e in events] == ["Renamed"] * 3 + [
+            "Rename target already exists"
+        ]
+        assert events[0]["src"] == "0.jpg"
+        assert events[3]["level"] == "warning"
+        assert "per_file" not in events[0]
+
+        out = capsys.readouterr().out
+        assert "0.jpeg" not in out
+        assert "Rename target already exists" in out
+        assert "Found files" in out
+        assert "Per-file events" in out
+
+    def test_sampling(self, capsys, restore_logging):
+        configure_logging(sample_every=2)
+        file_logger = get_logger(per_file=True)
+        for i in range(5):
+            file_logger.info("Renamed", src=f"{i}.jpg")
+        out = capsys.readouterr().out
+        assert [i for i in range(5) if f"src={i}.jpg" in out] == [0, 2, 4]
+
+    def test_defaults_print_everything(self, capsys):
+        get_logger(per_file=True).info("Renamed", src="a.jpg")
+        out = capsys.readouterr().out
+        assert "src=a.jpg" in out
+        assert "per_file" not in out
+
+    def test_dry_run_time_updates(self, tmp_path, restore_logging):
+        events_path = tmp_path / "events.jsonl"
+        configure_logging(str(events_path), sample_every=0)
+        Utils(base_dir="./test/files", is_dry_run=True).update_dates_from_metadata()
+        close_logging()
+        events = [json.loads(line) for line in events_path.read_text().splitlines()]
+        assert events
+        assert all(e["event"] == "[DRY RUN] Updating time" for e in events)
+        assert all(e["is_dry_run"] for e in events)
+        assert re.fullmatch(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d", events[0]["time"])
+
+    def test_write_errors_drop_events(self, tmp_path, capsys):
+        writer = EventWriter(str(tmp_path / "events.jsonl"), batch_size=1)
+        with patch.object(writer._file, "write", side_effect=OSError("disk full")):
+            # more batches than the queue holds, so a dead thread would hang
+            for i in range(EVENT_QUEUE_BATCHES * 4):
+                writer.write("info", {"event": "Renamed", "src": f"{i}.jpg"})
+            writer.close()
+        assert isinstance(writer.error, OSError)
+        assert writer.dropped == EVENT_QUEUE_BATCHES * 4
+        out = capsys.readouterr().out
+        assert "Failed to write per-file events" in out
+        assert "disk full" in out
+
+    def test_timestamp_is_formatted_lazily(self):
+        assert str(Timestamp(0)) == repr(Timestamp(0))
+        assert len(str(Timestamp(0))) == len("1970-01-01 00:00:00")
@@ -1,4 +1,6 @@
 import datetime
+import os
+import shutil
 from unittest.mock import call, patch
 
 import pytest
@@ -97,14 +99,14 @@ class TestUtils:
 
         assert sorted(mock_rename.call_args_list) == sorted(
             [
-                call("./test/files/png.jpeg", "./test/files/./test/files/png.png"),
+                call("./test/files/png.jpeg", "./test/files/png.png"),
                 call(
                     "./test/files/jpeg_with_exif.jpeg",
-                    "./test/files/./test/files/jpeg_with_exif.jpg",
+                    "./test/files/jpeg_with_exif.jpg",
                 ),
                 call(
                     "./test/files/jpeg_without_exif.jpeg",
-                    "./test/files/./test/files/jpeg_without_exif.jpg",
+                    "./test/files/jpeg_without_exif.jpg",
                 ),
             ]
         )
@@ -124,3 +126,89 @@ class TestUtils:
                 ]
             ),
         }
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_find_duplicates_workers(self, workers):
+        assert (
+            Utils(
+                base_dir=self.base_dir, is_dry_run=True, workers=workers
+            ).find_duplicates()
+            == Utils(base_dir=self.base_dir, is_dry_run=True).find_duplicates()
+        )
+
+    def test_iter_clean_files_recursive(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "a.jpg").write_bytes(b"a")
+        (tmp_path / "sub" / "b.jpg").write_bytes(b"bb")
+        (tmp_path / ".DS_Store").write_bytes(b"")
+
+        flat = Utils(base_dir=str(tmp_path)).iter_clean_files()
+        assert [entry.path for entry in flat] == [str(tmp_path / "a.jpg")]
+
+        nested = Utils(base_dir=str(tmp_path), recursive=True).iter_clean_files()
+        assert sorted((entry.path, entry.stat.st_size) for entry in nested) == [
+            (str(tmp_path / "a.jpg"), 1),
+            (str(tmp_path / "sub" / "b.jpg"), 2),
+        ]
+
+    def test_organize(self, tmp_path):
+        for name in ["jpeg_with_exif.jpeg", "png.jpeg", "dup1.png", "dup2.png"]:
+            shutil.copy(os.path.join(self.base_dir, name), tmp_path / name)
+
+        duplicates = Utils(base_dir=str(tmp_path)).organize()
+
+        # leaves out the rename journal
+        names = sorted(name for name in os.listdir(tmp_path) if name[0] != ".")
+        assert len(names) == 4
+        assert sum(name.endswith(".png") for name in names) == 3
+        [jpg] = [name for name in names if name.endswith(".jpg")]
+        assert jpg == "2024-07-27T18-07-51R0001.jpg"
+        assert datetime.datetime.fromtimestamp(
+            os.path.getmtime(tmp_path / jpg)
+        ) == datetime.datetime(2024, 7, 27, 18, 7, 51)
+        assert [len(files) for files in duplicates.values()] == [2]
+
+    @patch("lib.main.METADATA_BATCH_SIZE", 2)
+    def test_metadata_jobs(self):
+        serial = Utils(base_dir=self.base_dir, is_dry_run=True)
+        parallel = Utils(base_dir=self.base_dir, is_dry_run=True, jobs=2)
+        entries = list(serial.iter_clean_files())
+
+        assert list(parallel._iter_file_types(entries)) == list(
+            serial._iter_file_types(entries)
+        )
+        assert list(parallel._iter_created_dates(entries)) == list(
+            serial._iter_created_dates(entries)
+        )
+
+        with patch.object(Utils, "_utime") as mock_utime:
+            serial.update_dates_from_metadata()
+            serial_calls = mock_utime.call_args_list
+            mock_utime.reset_mock()
+            parallel.update_dates_from_metadata()
+            assert mock_utime.call_args_list == serial_calls
+
+    def test_find_similar(self):
+        utils = Utils(base_dir=self.base_dir, is_dry_run=True)
+        groups = [
+            ["dup1.png", "dup2.png"],
+            # the same photo exported as both HEIC and JPEG
+            ["heic_with_exif.heic", "jpeg_with_exif.jpeg"],
+            ["jpeg_without_exif.jpeg", "png.jpeg", "png_without_exif.png"],
+        ]
+        assert sorted(utils.find_similar(algorithm="phash").values()) == groups
+        # pillow-heif releases decode the HEIC a few gray levels apart, which
+        # flips 2 to 7 dHash bits, while unrelated images are over 16 bits apart
+        assert sorted(utils.find_similar(threshold=8).values()) == groups
+
+    def test_metadata_prefetch(self):
+        serial = Utils(base_dir=self.base_dir, is_dry_run=True)
+        prefetching = Utils(base_dir=self.base_dir, is_dry_run=True, prefetch=3)
+        entries = list(serial.iter_clean_files())
+
+        assert list(prefetching._iter_file_types(entries)) == list(
+            serial._iter_file_types(entries)
+        )
+        assert list(prefetching._iter_created_dates(entries)) == list(
+            serial._iter_created_dates(entries)
+        )
@@ -0,0 +1,118 @@
+import os
+import shutil
+from unittest.mock import patch
+
+from lib.main import EXCLUDED_FILES, Utils
+from lib.manifest import MANIFEST_NAME, Manifest
+from lib.rename import plan_renames
+from lib.walk import iter_files
+
+
+def changed_names(manifest, path):
+    return sorted(
+        os.path.basename(entry.path)
+        for entry in manifest.iter_changed(
+            iter_files(str(path), excluded=EXCLUDED_FILES)
+        )
+    )
+
+
+class TestManifest:
+    def test_skips_recorded_files(self, tmp_path, make_files):
+        make_files(["a.jpg", "b.jpg"], mtime=0)
+        manifest = Manifest(str(tmp_path), "test")
+        assert changed_names(manifest, tmp_path) == ["a.jpg", "b.jpg"]
+        manifest.record(str(tmp_path / "a.jpg"), "unchanged")
+        manifest.save()
+
+        make_files(["c.jpg"], mtime=0)
+        manifest = Manifest(str(tmp_path), "test")
+        assert changed_names(manifest, tmp_path) == ["b.jpg", "c.jpg"]
+
+        # another command has its own records
+        other = Manifest(str(tmp_path), "other")
+        assert "a.jpg" in changed_names(other, tmp_path)
+
+    def test_modified_and_deleted_files(self, tmp_path, make_files):
+        make_files(["a.jpg", "b.jpg"], mtime=0)
+        manifest = Manifest(str(tmp_path), "test")
+        for name in ["a.jpg", "b.jpg"]:
+            manifest.record(str(tmp_path / name), "unchanged")
+        manifest.save()
+
+        os.utime(tmp_path / "a.jpg", (100, 100))
+        os.remove(tmp_path / "b.jpg")
+        manifest = Manifest(str(tmp_path), "test")
+        assert "a.jpg" in changed_names(manifest, tmp_path)
+        manifest.save()
+        assert list(Manifest(str(tmp_path), "test").files) == ["a.jpg"]
+
+    def test_move_keeps_records(self, tmp_path, make_files):
+        make_files(["a.jpg"], mtime=0)
+        manifest = Manifest(str(tmp_path), "test")
+        manifest.record(str(tmp_path / "a.jpg"), "unchanged")
+        os.rename(tmp_path / "a.jpg", tmp_path / "b.jpg")
+        manifest.move(str(tmp_path / "a.jpg"), str(tmp_path / "b.jpg"))
+        manifest.save()
+        assert list(Manifest(str(tmp_path), "test").files) == ["b.jpg"]
+
+
+class TestIncremental:
+    def copy_files(self, tmp_path):
+        for name in ["jpeg_with_exif.jpeg", "png_without_exif.png"]:
+            shutil.copy(os.path.join("test", "files", name), tmp_path / name)
+
+    def test_correct_file_dates(self, tmp_path):
+        self.copy_files(tmp_path)
+        utils = Utils(base_dir=str(tmp_path), incremental=True)
+        utils.update_dates_from_metadata()
+        assert (tmp_path / MANIFEST_NAME).exists()
+
+        with patch.object(Utils, "_parse_file_created_date") as parse:
+            utils.update_dates_from_metadata()
+        parse.assert_not_called()
+
+        shutil.copy("test/files/heic_with_exif.heic", tmp_path / "new.heic")
+        with patch.object(
+            Utils, "_parse_file_created_date", return_value=None
+        ) as parse:
+            utils.update_dates_from_metadata()
+        assert [call.args[0] for call in parse.call_args_list] == [
+            str(tmp_path / "new.heic")
+        ]
+
+    def test_correct_file_dates_retries_failures(self, tmp_path):
+        self.copy_files(tmp_path)
+        utils = Utils(base_dir=str(tmp_path), incremental=True)
+        with patch.object(
+            Utils, "_parse_file_created_date", side_effect=ValueError("corrupt")
+        ):
+            utils.update_dates_from_metadata()
+
+        with patch.object(
+            Utils, "_parse_file_created_date", return_value=None
+        ) as parse:
+            utils.update_dates_from_metadata()
+        assert parse.call_count == 2
+
+    def test_normalize_file_names(self, tmp_path, make_files):
+        make_files(["a.jpg", "b.jpg"], mtime=0)
+        utils = Utils(base_dir=str(tmp_path), incremental=True)
+        utils.convert_names_to_dates(prevent_duplicates=True)
+        names = sorted(n for n in os.listdir(tmp_path) if n.endswith(".jpg"))
+        assert len(names) == 2
+
+        make_files(["c.jpg"], mtime=0)
+        with patch("lib.main.plan_renames", wraps=plan_renames) as plan:
+            utils.convert_names_to_dates(prevent_duplicates=True)
+        requests = plan.call_args.args[1]
+        assert [os.path.basename(r.path) for r in requests] == ["c.jpg"]
+        assert len([n for n in os.listdir(tmp_path) if n.endswith(".jpg")]) == 3
+        assert "c.jpg" not in os.listdir(tmp_path)
+
+    def test_dry_run_keeps_manifest(self, tmp_path, make_files):
+        make_files(["a.jpg"], mtime=0)
+        Utils(
+            base_dir=str(tmp_path), is_dry_run=True, incremental=True
+        ).convert_names_to_dates(prevent_duplicates=True)
+        assert not (tmp_path / MANIFEST_NAME).exists()
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from lib.prefetch import iter_prefetched
+from lib.reader import PrefetchedReader
+from lib.walk import FileEntry, iter_files
+
+
+def make_entries(tmp_path, count):
+    for i in range(count):
+        (tmp_path / f"{i:03d}.bin").write_bytes(bytes([i]) * 100)
+    return sorted(iter_files(str(tmp_path)))
+
+
+class TestPrefetch:
+    def test_order_and_headers(self, tmp_path):
+        entries = make_entries(tmp_path, 20)
+        results = list(iter_prefetched(entries, header_size=10, depth=4))
+        assert [entry for entry, _ in results] == entries
+        assert [header for _, header in results] == [bytes([i]) * 10 for i in range(20)]
+
+    def test_skip_and_errors(self, tmp_path):
+        entries = make_entries(tmp_path, 3)
+        missing = FileEntry(str(tmp_path / "missing.bin"), entries[0].stat)
+        results = list(
+            iter_prefetched(
+                entries + [missing],
+                header_size=10,
+                depth=2,
+                skip=lambda entry: entry.path.endswith("001.bin"),
+            )
+        )
+        assert results[1][1] is None
+        assert isinstance(results[3][1], FileNotFoundError)
+
+    def test_per_mount_limit(self, tmp_path):
+        entries = make_entries(tmp_path, 12)
+        lock = threading.Lock()
+        counts = {"running": 0, "most_running": 0}
+
+        def slow_read(path, size):
+            with lock:
+                counts["running"] += 1
+                counts["most_running"] = max(counts["most_running"], counts["running"])
+            time.sleep(0.01)
+            with lock:
+                counts["running"] -= 1
+            return b""
+
+        with patch("lib.prefetch.read_header", slow_read):
+            list(iter_prefetched(entries, header_size=10, depth=8, per_mount=2))
+        assert counts["most_running"] == 2
+
+    def test_stops_early(self, tmp_path):
+        entries = make_entries(tmp_path, 10)
+        for entry, _ in iter_prefetched(entries, header_size=10, depth=4):
+            break
+        assert entry == entries[0]
+
+
+class TestPrefetchedReader:
+    def test_opens_file_past_header(self, tmp_path):
+        path = tmp_path / "file.bin"
+        path.write_bytes(bytes(range(100)))
+        reader = PrefetchedReader(str(path), bytes(range(10)), os.path.getsize(path))
+        assert reader.read_at(2, 3) == bytes([2, 3, 4])
+        assert reader.f is None
+        assert reader.read_at(50, 2) == bytes([50, 51])
+        reader.close()
+        assert reader.f is None
@@ -0,0 +1,64 @@
+import pstats
+
+import pytest
+import structlog
+from lib.main import Utils
+from lib.profiler import (
+    STAGE_ENUMERATION,
+    STAGE_HASHING,
+    STAGE_LOGGING,
+    STAGE_METADATA,
+    profiled,
+    profiler,
+    read_io_counters,
+)
+
+
+@pytest.fixture
+def enabled_profiler(tmp_path):
+    profiler.enable(str(tmp_path / "run.pstats"))
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+
+
+class TestProfiler:
+    def test_stages(self, enabled_profiler, tmp_path):
+        utils = Utils(base_dir="./test/files", is_dry_run=True)
+        utils.find_duplicates()
+        utils.update_dates_from_metadata()
+        enabled_profiler.disable()
+
+        stats = enabled_profiler.stats
+        # one call per file plus the call that ends the listing, per command
+        assert stats[STAGE_ENUMERATION].calls == 2 * 9
+        assert stats[STAGE_METADATA].calls == 8
+        assert stats[STAGE_HASHING].calls > 0
+        assert stats[STAGE_LOGGING].calls > 0
+        if read_io_counters() is not None:
+            assert stats[STAGE_HASHING].bytes_read > 0
+        assert "hashing" in enabled_profiler.summary()
+        assert (
+            pstats.Stats(str(tmp_path / "run.pstats")).get_stats_profile().func_profiles
+        )
+
+    def test_disable_restores_logging(self):
+        wrapper_class = structlog.get_config()["wrapper_class"]
+        profiler.enable()
+        assert structlog.get_config()["wrapper_class"] is not wrapper_class
+        profiler.disable()
+        assert structlog.get_config()["wrapper_class"] is wrapper_class
+
+    def test_disabled(self):
+        calls = []
+
+        @profiled(STAGE_METADATA)
+        def parse(value):
+            calls.append(value)
+            return value
+
+        profiler.stats = {}
+        assert parse(1) == 1
+        assert calls == [1]
+        assert profiler.stats == {}
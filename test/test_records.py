@@ -0,0 +1,63 @@
+import os
+import tracemalloc
+
+# imported up front so the import isn't counted by test_memory
+import numpy  # noqa: F401
+import pytest
+from lib.records import SIZE, FileRecords
+
+RECORDS = 100_000
+# 44 bytes of columns per record plus its name, and about 35 more while
+# grouping. A list of FileEntry objects in a dict takes over 500 bytes.
+MAX_BYTES_PER_RECORD = 110
+# the table plus the groups, 8 bytes per grouped record and 8 per group
+MAX_HELD_BYTES_PER_RECORD = 80
+
+
+def fake_stat(size, ino=1):
+    return os.stat_result((0, ino, 1, 0, 0, 0, size, 0, 0, 0), {"st_mtime_ns": 5})
+
+
+class TestFileRecords:
+    def test_round_trip(self):
+        records = FileRecords()
+        i = records.append(os.path.join("photos", "2024", "IMG_0001.jpg"), fake_stat(3))
+        records.append(os.path.join("photos", "2024", "caf\udce9.jpg"), fake_stat(4))
+        assert records.path(i) == os.path.join("photos", "2024", "IMG_0001.jpg")
+        assert records.name(1) == "caf\udce9.jpg"
+        st = records.stat(i)
+        assert (st.st_size, st.st_ino, st.st_dev, st.st_mtime_ns) == (3, 1, 1, 5)
+        assert records.get_digest("full", i) is None
+        records.set_digest("full", i, b"ab")
+        assert records.get_digest("full", i) == b"ab"
+
+    def test_group(self):
+        records = FileRecords()
+        for size, digest in [(1, b"a"), (2, b"a"), (1, b"b"), (1, b"a"), (2, None)]:
+            i = records.append(f"dir/{len(records)}", fake_stat(size))
+            if digest is not None:
+                records.set_digest("small", i, digest)
+        assert [list(g) for g in records.group([SIZE])] == [[0, 2, 3], [1, 4]]
+        assert [list(g) for g in records.group([SIZE, "small"])] == [[0, 3]]
+        assert len(records.group([SIZE], [0, 1])) == 0
+        assert len(records.group(["missing"])) == 0
+
+    # unique sizes, and pairs of same-sized files, the most groups there can be
+    @pytest.mark.parametrize("files_per_size", [1, 2])
+    def test_memory(self, files_per_size):
+        tracemalloc.start()
+        try:
+            records = FileRecords()
+            for i in range(RECORDS):
+                records.append(
+                    f"/library/{i // 1000:04d}/IMG_{i:06d}.jpg",
+                    fake_stat(i // files_per_size, i),
+                )
+            groups = records.group([SIZE])
+            held, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(groups) == (RECORDS // 2 if files_per_size == 2 else 0)
+        assert records.nbytes() < 70 * RECORDS
+        assert held < MAX_HELD_BYTES_PER_RECORD * RECORDS
+        assert peak < MAX_BYTES_PER_RECORD * RECORDS
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+from lib.main import Utils
+from lib.rename import (
+    IncompleteRenameError,
+    RenameRequest,
+    apply_plan,
+    get_journal_path,
+    plan_renames,
+    read_journal,
+    rollback_plan,
+    write_plan,
+)
+
+STEM = "2024-01-02T03-04-05"
+
+
+def requests_for(path, names, stem=STEM, ext="jpg"):
+    return [RenameRequest(str(path / name), stem, ext) for name in names]
+
+
+class TestPlan:
+    def test_sequence_suffixes(self, tmp_path, make_files):
+        make_files(["b.jpg", "a.jpg", "c.JPG"])
+        plan, conflicts = plan_renames(
+            str(tmp_path), requests_for(tmp_path, ["b.jpg", "a.jpg", "c.JPG"]), True
+        )
+        assert conflicts == []
+        assert [(r.src, r.dst) for r in plan] == [
+            ("a.jpg", f"{STEM}R0001.jpg"),
+            ("b.jpg", f"{STEM}R0002.jpg"),
+            ("c.JPG", f"{STEM}R0003.jpg"),
+        ]
+
+    def test_keeps_valid_names(self, tmp_path, make_files):
+        names = [f"{STEM}R0001.jpg", f"{STEM}R4821.jpg", "new.jpg"]
+        make_files(names)
+        plan, _ = plan_renames(str(tmp_path), requests_for(tmp_path, names), True)
+        assert [(r.src, r.dst) for r in plan] == [("new.jpg", f"{STEM}R0002.jpg")]
+
+    def test_conflicts_without_suffixes(self, tmp_path, make_files):
+        make_files(["a.jpg", "b.jpg"])
+        plan, conflicts = plan_renames(
+            str(tmp_path), requests_for(tmp_path, ["a.jpg", "b.jpg"]), False
+        )
+        assert [(r.src, r.dst) for r in plan] == [("a.jpg", f"{STEM}.jpg")]
+        assert [os.path.basename(c.path) for c in conflicts] == ["b.jpg"]
+
+
+class TestJournal:
+    def plan(self, make_files, tmp_path, names):
+        make_files(names)
+        plan, _ = plan_renames(str(tmp_path), requests_for(tmp_path, names), True)
+        journal_path = get_journal_path(str(tmp_path))
+        write_plan(journal_path, str(tmp_path), plan)
+        return journal_path
+
+    def test_apply_and_rollback(self, tmp_path, make_files):
+        journal_path = self.plan(make_files, tmp_path, ["a.jpg", "b.jpg"])
+        applied = apply_plan(journal_path, batch_size=1)
+        assert [os.path.basename(new) for _, new in applied] == [
+            f"{STEM}R0001.jpg",
+            f"{STEM}R0002.jpg",
+        ]
+        assert (tmp_path / f"{STEM}R0001.jpg").read_bytes() == b"a.jpg"
+        state = read_journal(journal_path)
+        assert state is not None and state.complete
+
+        assert rollback_plan(journal_path) == 2
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            [os.path.basename(journal_path), "a.jpg", "b.jpg"]
+        )
+
+    def test_resume_after_crash(self, tmp_path, make_files):
+        journal_path = self.plan(make_files, tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+        # crash after the first rename, before it was journaled, mid-append
+        os.rename(tmp_path / "a.jpg", tmp_path / f"{STEM}R0001.jpg")
+        with open(journal_path, "a") as journal:
+            journal.write('{"op": "do')
+
+        with pytest.raises(IncompleteRenameError):
+            write_plan(journal_path, str(tmp_path), [])
+
+        apply_plan(journal_path)
+        state = read_journal(journal_path)
+        assert state is not None
+        assert state.done == {0, 1, 2} and state.complete
+        assert (tmp_path / f"{STEM}R0003.jpg").read_bytes() == b"c.jpg"
+        with open(journal_path) as journal:
+            lines = journal.read().splitlines()
+        assert json.loads(lines[-1]) == {"op": "complete"}
+
+    def test_utils_rerun_is_stable(self, tmp_path, make_files):
+        make_files(["a.jpg", "b.jpg"], mtime=0)
+        utils = Utils(base_dir=str(tmp_path))
+        utils.convert_names_to_dates(prevent_duplicates=True)
+        names = sorted(os.listdir(tmp_path))
+        utils.convert_names_to_dates(prevent_duplicates=True)
+        assert sorted(os.listdir(tmp_path)) == names
+        assert len([n for n in names if n.endswith(".jpg")]) == 2
+
+        utils.rollback_renames()
+        assert "a.jpg" in os.listdir(tmp_path)
@@ -0,0 +1,101 @@
+import os
+import random
+
+import pytest
+from lib.main import Utils
+from lib.shards import (
+    ScanHeader,
+    ScanRow,
+    escape_field,
+    iter_scan,
+    merge_scans,
+    read_scan_header,
+    unescape_field,
+    write_scan,
+)
+
+
+def write(path, rows, host="host", hash_name="sha1"):
+    write_scan(str(path), ScanHeader(host, "/root", hash_name), rows)
+    return str(path)
+
+
+class TestScanFiles:
+    def test_escaping(self):
+        for value in ["plain", "tab\there", "new\nline", "back\\slash\\t", "\udce9"]:
+            assert "\t" not in escape_field(value)
+            assert unescape_field(escape_field(value)) == value
+
+    def test_round_trip(self, tmp_path):
+        rows = [
+            ScanRow(1, "aa", "bb", "host", "/a\tb"),
+            ScanRow(2, "aa", "bb", "host", "/c\udce9"),
+        ]
+        path = write(tmp_path / "scan.tsv", rows)
+        assert read_scan_header(path) == ScanHeader("host", "/root", "sha1")
+        assert list(iter_scan(path)) == rows
+
+    def test_rejects_unsorted(self, tmp_path):
+        path = write(
+            tmp_path / "scan.tsv",
+            [ScanRow(2, "aa", "bb", "h", "/a"), ScanRow(1, "aa", "bb", "h", "/b")],
+        )
+        with pytest.raises(ValueError, match="out of order"):
+            list(iter_scan(path))
+
+
+class TestMerge:
+    def test_groups_across_manifests(self, tmp_path):
+        a = write(
+            tmp_path / "a.tsv",
+            [ScanRow(1, "aa", "01", "a", "/1"), ScanRow(5, "aa", "02", "a", "/2")],
+            host="a",
+        )
+        b = write(
+            tmp_path / "b.tsv",
+            [ScanRow(1, "aa", "01", "b", "/1"), ScanRow(5, "aa", "03", "b", "/3")],
+            host="b",
+        )
+        c = write(tmp_path / "c.tsv", [ScanRow(5, "aa", "02", "c", "/4")], host="c")
+        groups = [[(r.host, r.path) for r in rows] for rows in merge_scans([a, b, c])]
+        assert groups == [[("a", "/1"), ("b", "/1")], [("a", "/2"), ("c", "/4")]]
+
+    def test_same_manifest_twice(self, tmp_path):
+        a = write(
+            tmp_path / "a.tsv",
+            [ScanRow(1, "aa", "01", "a", "/1"), ScanRow(5, "aa", "02", "a", "/2")],
+            host="a",
+        )
+        b = write(tmp_path / "b.tsv", [ScanRow(5, "aa", "02", "b", "/2")], host="b")
+        assert list(merge_scans([a, a])) == []
+        groups = [[(r.host, r.path) for r in rows] for rows in merge_scans([a, a, b])]
+        assert groups == [[("a", "/2"), ("b", "/2")]]
+
+    def test_rejects_mixed_hashes(self, tmp_path):
+        a = write(tmp_path / "a.tsv", [], hash_name="sha1")
+        b = write(tmp_path / "b.tsv", [], hash_name="sha256")
+        with pytest.raises(ValueError, match="different hash algorithms"):
+            list(merge_scans([a, b]))
+
+
+class TestUtilsScan:
+    def test_scan_is_sorted(self, tmp_path):
+        rng = random.Random(0)
+        root = tmp_path / "root"
+        root.mkdir()
+        for i in range(50):
+            # few distinct sizes, so the hashes decide the order
+            (root / f"{i}.jpg").write_bytes(rng.randbytes(rng.choice([10, 2000])))
+        (root / "copy.jpg").write_bytes((root / "0.jpg").read_bytes())
+        out = str(root / "scan.tsv")
+
+        count = Utils(base_dir=str(root), is_dry_run=True).scan(out, "host")
+        assert count == 51
+        rows = list(iter_scan(out))
+        assert len(rows) == 51
+        assert rows == sorted(rows, key=lambda r: r.key)
+        assert all(os.path.isabs(r.path) for r in rows)
+        groups = list(merge_scans([out]))
+        assert [sorted(os.path.basename(r.path) for r in g) for g in groups] == [
+            ["0.jpg", "copy.jpg"]
+        ]
@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from lib.similar import (
+    BKTree,
+    dhash_batch,
+    group_similar,
+    hamming_distance,
+    load_thumbnail,
+    phash_batch,
+)
+
+
+class TestHashes:
+    def test_dhash_bits(self):
+        # every pixel is brighter than its left neighbour, so every bit is set
+        thumbnails = np.tile(np.arange(9, dtype=np.float32), (1, 8, 1))
+        assert dhash_batch(thumbnails) == [2**64 - 1]
+        assert dhash_batch(thumbnails[:, :, ::-1]) == [0]
+
+    @pytest.mark.parametrize(
+        "hash_batch, width, height", [(dhash_batch, 9, 8), (phash_batch, 32, 32)]
+    )
+    def test_resized_copy_is_similar(self, tmp_path, hash_batch, width, height):
+        image = PILImage.open("./test/files/png_without_exif.png")
+        image.save(tmp_path / "original.png")
+        image.resize((image.width // 3, image.height // 3)).convert("RGB").save(
+            tmp_path / "small.jpg", quality=70
+        )
+        PILImage.effect_noise(image.size, 64).save(tmp_path / "other.png")
+
+        original, small, other = hash_batch(
+            np.stack(
+                [
+                    load_thumbnail(str(tmp_path / name), width, height)
+                    for name in ["original.png", "small.jpg", "other.png"]
+                ]
+            )
+        )
+        assert hamming_distance(original, small) <= 6
+        assert hamming_distance(original, other) > 6
+
+
+class TestBKTree:
+    def test_query_matches_linear_scan(self):
+        rng = random.Random(0)
+        hashes = [rng.getrandbits(64) for _ in range(500)]
+        # a few near copies
+        hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:20]]
+        tree = BKTree()
+        for i, h in enumerate(hashes):
+            tree.add(h, i)
+
+        for query in hashes[:50]:
+            expected = sorted(
+                (i, hamming_distance(query, h))
+                for i, h in enumerate(hashes)
+                if hamming_distance(query, h) <= 4
+            )
+            assert sorted(tree.query(query, 4)) == expected
+
+    def test_group_similar(self):
+        a = 0b1111_0000
+        hashes = [a, 1 << 40, a ^ 0b1, a ^ 0b11, 1 << 40, 2**64 - 1]
+        assert group_similar(hashes, 1) == [[0, 2, 3], [1, 4]]
+        assert group_similar(hashes, 0) == [[1, 4]]
@@ -0,0 +1,50 @@
+import json
+import subprocess
+import sys
+from unittest.mock import patch
+
+from lib.imaging import register_heif
+
+HEAVY_MODULES = ["PIL", "pillow_heif", "numpy", "filetype", "multiprocessing"]
+# share of the time spent importing cli that the project's own modules may take,
+# relative so the bound holds on a loaded machine too
+IMPORT_BUDGET_SHARE = 0.5
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+class TestStartup:
+    def test_cli_import_skips_heavy_modules(self):
+        result = run_python(
+            "-c",
+            "import cli, json, sys; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))",
+        )
+        assert json.loads(result.stdout) == []
+
+    def test_import_time_budget(self):
+        result = run_python("-X", "importtime", "-c", "import cli")
+        own_us = 0
+        total_us = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+            if name.strip() == "cli":
+                total_us = int(cumulative_us)
+            if name.strip() == "cli" or name.strip().startswith("lib."):
+                own_us += int(self_us)
+        assert own_us < IMPORT_BUDGET_SHARE * total_us
+
+    def test_heif_registered_once(self):
+        register_heif.cache_clear()
+        with patch("pillow_heif.register_heif_opener") as mock_register:
+            register_heif()
+            register_heif()
+        # let the next caller register the real plugin
+        register_heif.cache_clear()
+        assert mock_register.call_count == 1
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from lib.main import Utils
+from lib.takeout import SidecarIndex, read_taken_time
+from lib.walk import iter_files
+
+TAKEN = 1563192000
+LONG_NAME = "Screenshot_20190715-123456_Some_Very_Long_App_Name.png"
+SHORT_NAME = "Screenshot_20190715-123456_App.png"
+
+
+def write_sidecar(path, timestamp=TAKEN):
+    path.write_text(
+        json.dumps(
+            {
+                "title": path.name,
+                "photoTakenTime": {"timestamp": str(timestamp), "formatted": ""},
+            }
+        )
+    )
+
+
+def index_of(tmp_path) -> SidecarIndex:
+    index = SidecarIndex()
+    list(index.split(iter_files(str(tmp_path))))
+    return index
+
+
+class TestSidecarIndex:
+    @pytest.mark.parametrize(
+        "media,sidecar",
+        [
+            ("IMG_1234.jpg", "IMG_1234.jpg.json"),
+            ("IMG_1234.jpg", "IMG_1234.json"),
+            ("IMG_1234.jpg", "IMG_1234.jpg.supplemental-metadata.json"),
+            ("IMG_1234.jpg", "IMG_1234.jpg.supplemental-me.json"),
+            ("IMG_1234(1).jpg", "IMG_1234.jpg(1).json"),
+            ("IMG_1234(1).jpg", "IMG_1234.jpg.supplemental-metadata(1).json"),
+            ("IMG_1234-edited.jpg", "IMG_1234.jpg.json"),
+            # names are cut short at 46 characters
+            (LONG_NAME, LONG_NAME[:46] + ".json"),
+            (LONG_NAME[:-4] + "(1).png", LONG_NAME[:46] + "(1).json"),
+            (
+                SHORT_NAME,
+                (SHORT_NAME + ".supplemental-metadata")[:46] + ".json",
+            ),
+        ],
+    )
+    def test_find(self, tmp_path, media, sidecar):
+        (tmp_path / media).write_bytes(b"")
+        write_sidecar(tmp_path / sidecar)
+        index = index_of(tmp_path)
+        assert index.find(str(tmp_path / media)) == str(tmp_path / sidecar)
+        assert index.taken_time(str(tmp_path / media)) == datetime.fromtimestamp(TAKEN)
+
+    def test_copies_get_their_own_sidecar(self, tmp_path):
+        write_sidecar(tmp_path / "IMG.jpg.json", TAKEN)
+        write_sidecar(tmp_path / "IMG.jpg(1).json", TAKEN + 60)
+        index = index_of(tmp_path)
+        assert index.find(str(tmp_path / "IMG.jpg")) == str(tmp_path / "IMG.jpg.json")
+        assert index.find(str(tmp_path / "IMG(1).jpg")) == str(
+            tmp_path / "IMG.jpg(1).json"
+        )
+
+    def test_no_false_matches(self, tmp_path):
+        write_sidecar(tmp_path / "IMG_1.jpg.json")
+        write_sidecar(tmp_path / "sub.jpg.json")
+        index = index_of(tmp_path)
+        assert index.find(str(tmp_path / "IMG_12.jpg")) is None
+        assert index.find(str(tmp_path / "other" / "sub.jpg")) is None
+
+    def test_split_keeps_sidecars_out(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        for directory in (tmp_path, tmp_path / "sub"):
+            (directory / "a.jpg").write_bytes(b"")
+            write_sidecar(directory / "a.jpg.json")
+        index = SidecarIndex()
+        media = [entry.path for entry in index.split(iter_files(str(tmp_path), True))]
+        assert sorted(media) == sorted(
+            [str(tmp_path / "a.jpg"), str(tmp_path / "sub" / "a.jpg")]
+        )
+        assert len(index) == 2
+
+    def test_read_taken_time(self, tmp_path):
+        (tmp_path / "metadata.json").write_text('{"title": "Album"}')
+        (tmp_path / "broken.json").write_text("{")
+        assert read_taken_time(str(tmp_path / "metadata.json")) is None
+        assert read_taken_time(str(tmp_path / "broken.json")) is None
+        assert read_taken_time(str(tmp_path / "missing.json")) is None
+
+
+class TestTakeoutDates:
+    def test_sidecar_dates(self, tmp_path):
+        for name in ("jpeg_without_exif.jpeg", "jpeg_with_exif.jpeg"):
+            shutil.copy(os.path.join("test/files", name), tmp_path / name)
+        write_sidecar(tmp_path / "jpeg_without_exif.jpeg.json")
+
+        with patch.object(
+            Utils,
+            "get_file_created_date",
+            autospec=True,
+            side_effect=Utils.get_file_created_date,
+        ) as parsed:
+            Utils(base_dir=str(tmp_path)).update_dates_from_metadata()
+
+        # only the file without a sidecar was opened
+        assert [call.args[1] for call in parsed.call_args_list] == [
+            str(tmp_path / "jpeg_with_exif.jpeg")
+        ]
+        assert os.stat(tmp_path / "jpeg_without_exif.jpeg").st_mtime == TAKEN
+        # the sidecar itself is left alone
+        assert os.stat(tmp_path / "jpeg_without_exif.jpeg.json").st_mtime != TAKEN
+
+    def test_no_sidecars(self, tmp_path):
+        shutil.copy("test/files/jpeg_without_exif.jpeg", tmp_path / "a.jpeg")
+        write_sidecar(tmp_path / "a.jpeg.json")
+        Utils(base_dir=str(tmp_path), sidecars=False).update_dates_from_metadata()
+        assert os.stat(tmp_path / "a.jpeg").st_mtime != TAKEN
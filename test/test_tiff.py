@@ -0,0 +1,114 @@
+import datetime
+import struct
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+from lib.main import Utils
+from lib.reader import buffer_reader
+from lib.tiff import get_tiff_timestamp, parse_tiff_datetime
+
+
+def build_tiff(
+    endian: str, date_time: bytes, date_time_original: bytes | None
+) -> bytes:
+    """Builds a minimal TIFF with DateTime in IFD0 and an optional Exif IFD."""
+    byte_order = b"II" if endian == "<" else b"MM"
+    ifd0_offset = 8
+    ifd0_entries = 2 if date_time_original else 1
+    exif_offset = ifd0_offset + 2 + ifd0_entries * 12 + 4
+    exif_size = 2 + 12 + 4 if date_time_original else 0
+    data_offset = exif_offset + exif_size
+
+    out = byte_order + struct.pack(endian + "HI", 42, ifd0_offset)
+    out += struct.pack(endian + "H", ifd0_entries)
+    out += struct.pack(endian + "HHII", 0x0132, 2, len(date_time), data_offset)
+    if date_time_original:
+        out += struct.pack(endian + "HHII", 0x8769, 4, 1, exif_offset)
+    out += struct.pack(endian + "I", 0)
+    if date_time_original:
+        out += struct.pack(endian + "H", 1)
+        out += struct.pack(
+            endian + "HHII",
+            0x9003,
+            2,
+            len(date_time_original),
+            data_offset + len(date_time),
+        )
+        out += struct.pack(endian + "I", 0)
+    return out + date_time + (date_time_original or b"")
+
+
+class TestTiff:
+    @pytest.mark.parametrize("endian", ["<", ">"])
+    def test_prefers_date_time_original(self, endian):
+        data = build_tiff(
+            endian, b"2020:01:01 10:00:00\x00", b"2019:05:06 07:08:09\x00"
+        )
+        assert parse_tiff_datetime(buffer_reader(data)) == datetime.datetime(
+            2019, 5, 6, 7, 8, 9
+        )
+
+    @pytest.mark.parametrize("endian", ["<", ">"])
+    def test_falls_back_to_date_time(self, endian):
+        data = build_tiff(
+            endian, b"2020:01:01 10:00:00\x00", b"0000:00:00 00:00:00\x00"
+        )
+        assert parse_tiff_datetime(buffer_reader(data)) == datetime.datetime(
+            2020, 1, 1, 10, 0, 0
+        )
+
+    def test_falls_back_to_xmp(self):
+        xmp = b'<x:xmpmeta xmp:CreateDate="2018-02-03T04:05:06"/>'
+        data = b"II" + struct.pack("<HI", 42, 8)
+        data += struct.pack("<H", 1)
+        data += struct.pack("<HHII", 0x02BC, 7, len(xmp), 8 + 2 + 12 + 4)
+        data += struct.pack("<I", 0) + xmp
+        assert parse_tiff_datetime(buffer_reader(data)) == datetime.datetime(
+            2018, 2, 3, 4, 5, 6
+        )
+
+    def test_invalid_data(self):
+        with pytest.raises(ValueError):
+            parse_tiff_datetime(buffer_reader(b"\x89PNG\r\n\x1a\n"))
+        data = build_tiff("<", b"2020:01:01 10:00:00\x00", None)
+        with pytest.raises(ValueError):
+            parse_tiff_datetime(buffer_reader(data[:20]))
+
+    def test_jpeg_exif_payload(self):
+        exif = Image.open("./test/files/jpeg_with_exif.jpeg").info["exif"]
+        assert parse_tiff_datetime(buffer_reader(exif, base=6)) == datetime.datetime(
+            2024, 7, 27, 18, 7, 51
+        )
+
+    def test_get_file_created_date_skips_pil(self, tmp_path):
+        path = tmp_path / "raw.nef"
+        path.write_bytes(build_tiff(">", b"2020:01:01 10:00:00\x00", None))
+        assert get_tiff_timestamp(str(path)) == datetime.datetime(2020, 1, 1, 10, 0, 0)
+
+        with patch("lib.main.open_image") as mock_open:
+            assert Utils(base_dir=str(tmp_path)).get_file_created_date(
+                str(path)
+            ) == datetime.datetime(2020, 1, 1, 10, 0, 0)
+            mock_open.assert_not_called()
+
+    def test_missing_date_skips_pil(self, tmp_path):
+        path = tmp_path / "raw.nef"
+        path.write_bytes(build_tiff("<", b"0000:00:00 00:00:00\x00", None))
+
+        with patch("lib.main.open_image") as mock_open:
+            assert (
+                Utils(base_dir=str(tmp_path)).get_file_created_date(str(path)) is None
+            )
+            mock_open.assert_not_called()
+
+    def test_pil_fallback_prefers_date_time_original(self, tmp_path):
+        exif = Image.Exif()
+        exif[0x0132] = "2020:01:01 10:00:00"
+        exif.get_ifd(0x8769)[0x9003] = "2019:05:06 07:08:09"
+        path = tmp_path / "image.png"
+        Image.new("RGB", (1, 1)).save(path, exif=exif)
+
+        assert Utils(base_dir=str(tmp_path)).get_file_created_date(
+            str(path)
+        ) == datetime.datetime(2019, 5, 6, 7, 8, 9)